@@ -0,0 +1,177 @@
+import math
+import threading
+import time
+from collections import deque
+
+class AdmissionTicket:
+    """A granted slot; hand it back with AdaptiveLimiter.release()"""
+    def __init__(self):
+        self.start_time = time.time()
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit for research requests with a short wait queue
+
+    The limit grows by about one slot per limit's worth of healthy
+    completions while it is actually in use, and shrinks by
+    decrease_factor (at most once per decrease_interval) when a request
+    ends overloaded: latency well above the baseline (the median of the
+    last baseline_window completed requests, so it follows the workload up
+    as well as down), RSS near the memory limit, a failed request or a high
+    upstream error rate.
+
+    Requests over the limit wait in a FIFO queue of at most max_queue,
+    each until its own deadline; the rest are rejected with a Retry-After
+    estimate.
+
+    Args:
+        initial_limit (float): Starting limit
+        min_limit (int): Floor for the limit
+        max_limit (int): Ceiling for the limit
+        max_queue (int): Requests allowed to wait for a slot
+        memory_limit_mb (float): RSS at which the worker counts as full (None: ignore memory)
+        upstream_counters (callable): Returns cumulative (calls, failures) of upstream APIs
+    """
+    def __init__(self, initial_limit=5, min_limit=1, max_limit=20, max_queue=10,
+                 memory_limit_mb=None, upstream_counters=None):
+        self.lock = threading.Lock()
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.max_queue = max_queue
+        self.memory_limit_mb = memory_limit_mb
+        self.upstream_counters = upstream_counters
+
+        self.in_flight = 0
+        self.waiters = deque()  # Events of queued requests, oldest first
+        self.decrease_factor = 0.75
+        self.decrease_interval = 5.0  # Seconds between decreases, so one burst isn't counted many times
+        self.last_decrease = 0
+        self.latency_tolerance = 2.0  # Latency over baseline x this counts as overload
+        self.baseline_window = deque(maxlen=20)  # Latencies of recent completed requests
+        self.latency_alpha = 0.3  # EWMA of recent latencies, used for Retry-After
+        self.baseline_latency = None
+        self.recent_latency = None
+        self.memory_threshold = 0.85  # Share of memory_limit_mb that counts as overload
+        self.error_threshold = 0.2  # Upstream failure rate that counts as overload
+        self.upstream_error_rate = 0.0
+        self.last_upstream = None
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    def acquire(self, timeout=10.0):
+        """
+        Take a slot, waiting up to timeout seconds in the queue
+
+        Returns:
+            AdmissionTicket: The slot, or None if the request should be rejected
+        """
+        with self.lock:
+            if self.in_flight < int(self.limit) and not self.waiters:
+                return self._admit()
+            if len(self.waiters) >= self.max_queue or timeout <= 0:
+                self.rejected += 1
+                return None
+            waiter = threading.Event()
+            self.waiters.append(waiter)
+
+        if waiter.wait(timeout):
+            return AdmissionTicket()  # The releasing request handed its slot over
+
+        with self.lock:
+            if waiter.is_set():
+                return AdmissionTicket()  # Handed over just as the deadline passed
+            self.waiters.remove(waiter)
+            self.timed_out += 1
+            return None
+
+    def _admit(self):
+        self.in_flight += 1
+        self.admitted += 1
+        return AdmissionTicket()
+
+    def release(self, ticket, failed=False, measured=True):
+        """
+        Give a slot back and adapt the limit to how the request went
+
+        Args:
+            ticket (AdmissionTicket): From acquire()
+            failed (bool): True if the request ended in an error
+            measured (bool): False for fast-path responses (cached reports,
+                fail-fast answers) whose latency says nothing about load
+        """
+        latency = time.time() - ticket.start_time if measured else None
+        overloaded = self._overloaded(latency, failed)
+        with self.lock:
+            if overloaded:
+                if time.time() - self.last_decrease >= self.decrease_interval:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self.last_decrease = time.time()
+            elif self.in_flight >= int(self.limit):
+                # Only grow a limit that is actually being used
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+            self.in_flight -= 1
+            # Hand freed slots to the oldest waiters
+            while self.waiters and self.in_flight < int(self.limit):
+                self.in_flight += 1
+                self.admitted += 1
+                self.waiters.popleft().set()
+
+    def _overloaded(self, latency, failed):
+        """Update the latency (None: not measured), memory and upstream signals; True if any says overload"""
+        slow = False
+        with self.lock:
+            if latency is not None:
+                self.recent_latency = latency if self.recent_latency is None else \
+                    self.recent_latency + self.latency_alpha * (latency - self.recent_latency)
+                slow = self.baseline_latency is not None and latency > self.baseline_latency * self.latency_tolerance
+                if not failed:
+                    # Slow requests count too: a workload that got heavier raises the baseline
+                    self.baseline_window.append(latency)
+                    ordered = sorted(self.baseline_window)
+                    self.baseline_latency = ordered[len(ordered) // 2]
+
+        memory_high = False
+        if self.memory_limit_mb:
+            import psutil  # Imported on first use to keep cold start fast
+            rss_mb = psutil.Process().memory_info().rss / (1024 * 1024)
+            memory_high = rss_mb > self.memory_limit_mb * self.memory_threshold
+
+        upstream_failing = False
+        if self.upstream_counters is not None:
+            calls, failures = self.upstream_counters()
+            with self.lock:
+                if self.last_upstream is not None:
+                    new_calls = calls - self.last_upstream[0]
+                    if new_calls > 0:
+                        rate = (failures - self.last_upstream[1]) / new_calls
+                        self.upstream_error_rate += self.latency_alpha * (rate - self.upstream_error_rate)
+                self.last_upstream = (calls, failures)
+                upstream_failing = self.upstream_error_rate > self.error_threshold
+
+        return failed or slow or memory_high or upstream_failing
+
+    def retry_after(self):
+        """
+        Seconds a rejected client should wait: the work ahead of it spread over
+        the slots, assuming requests in flight are on average half done
+        """
+        with self.lock:
+            latency = self.recent_latency or 30.0
+            backlog = self.in_flight + len(self.waiters) + 1
+            return max(1, min(120, math.ceil(latency * backlog / max(self.limit, 1) / 2)))
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "queued": len(self.waiters),
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "baseline_latency": round(self.baseline_latency, 2) if self.baseline_latency else None,
+                "upstream_error_rate": round(self.upstream_error_rate, 3)
+            }
@@ -1,34 +1,192 @@
 import os
 import json
 from tools import WebSearchTool, WebScraperTool, ContentAnalyzerTool, NewsAggregatorTool
-import google.generativeai as genai
 import re
 from dotenv import load_dotenv
 import gc  # Garbage collection
 import time  # For rate limiting
-import psutil
+import threading
+import contextvars
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from llm import get_llm_client
+from relevance import LocalRelevanceScorer
+from resilience import CircuitOpenError, set_retry_budget, reset_retry_budget
+from depth import DepthLimit, resolve_depth, set_depth_limits, reset_depth_limits, current_depth_limits
+from sessions import SessionStore
+from profiling import profiled_task
+from utils import apply_shared_rate_limit, pack_context, estimate_tokens, CHARS_PER_TOKEN, TTLCache, normalize_query
+from utils import canonicalize_url
 
 load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+
+# Opening lines of the reports returned while an upstream is unavailable
+DEGRADED_REPORT_NOTE = "The summarization service is temporarily unavailable; these are excerpts from the most relevant sources found."
+SEARCH_UNAVAILABLE_MESSAGE = "Web search is temporarily unavailable and no stored sources cover your query. Please try again in a minute."
+
+def _max_search_rounds(default=3):
+    """MAX_SEARCH_ROUNDS, or the default if it isn't a positive whole number"""
+    setting = os.getenv("MAX_SEARCH_ROUNDS", str(default)).strip()
+    try:
+        rounds = int(setting)
+    except ValueError:
+        rounds = 0
+    if rounds < 1:
+        print(f"Invalid MAX_SEARCH_ROUNDS '{setting}', using {default}")
+        return default
+    return rounds
+
+class ResearchCancelled(Exception):
+    """research() was abandoned between stages because its should_stop callback asked for it"""
+
+class ResearchContext:
+    """
+    Per-request state for one research() run
+
+    Everything that varies between concurrent requests lives here, so one
+    WebResearchAgent (configuration plus thread-safe tools) can serve every
+    request in the worker.
+    """
+    def __init__(self, query, previous_queries=None, should_stop=None):
+        self.query = query
+        self.previous_queries = previous_queries or []  # Earlier queries in the same session
+        self.should_stop = should_stop  # Checked between stages; True abandons the run
+        # Check if this is a sports-related query
+        self.is_sports_query = any(term in query.lower() for term in
+                                   ["score", "match", "game", "won", "win", "ipl", "cricket", "football", "soccer", "nba", "nfl"])
+        # Sports and news need fresh sources; stored pages go stale quickly
+        self.is_time_sensitive = self.is_sports_query or any(term in query.lower() for term in
+                                   ["latest", "today", "yesterday", "tonight", "news", "current", "this week"])
+        self.analysis = {}
+        self.search_terms = []
+        self.min_relevance = None
+        self.timings = {}  # Step name -> seconds
+        self.scraped_pages = []  # Pages scraped for this request, kept for session follow-ups
+        # Iterative deepening state: search rounds run, normalized terms searched,
+        # links already extracted and the deepest result page of the planned terms
+        self.search_rounds = 0
+        self.searched_terms = set()
+        self.seen_links = set()
+        self.result_page = 0
+        self.speculative_links = None  # Canonical links only the speculative search contributed
+
+    @property
+    def query_type(self):
+        """'sports', 'news' (other time-sensitive queries) or 'general'"""
+        if self.is_sports_query:
+            return "sports"
+        return "news" if self.is_time_sensitive else "general"
+
+    @property
+    def key_aspects(self):
+        return self.analysis.get("key_aspects")
+
+    @property
+    def model_query(self):
+        """The query as given to the models, with the previous question for follow-ups"""
+        if not self.previous_queries:
+            return self.query
+        return f'{self.query} (follow-up to: "{self.previous_queries[-1]}")'
+
+    @contextmanager
+    def timed(self, step):
+        """Record how long a pipeline step takes"""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.timings[step] = round(time.time() - start_time, 3)
 
 class WebResearchAgent:
+    # Limits set in __init__ that a request's depth profile can override (see depth.py)
+    max_search_terms = DepthLimit()
+    max_results_per_term = DepthLimit()
+    initial_results_per_term = DepthLimit()
+    max_search_rounds = DepthLimit()
+    max_total_results = DepthLimit()
+    max_extracted_sources = DepthLimit()
+    max_synthesis_content_length = DepthLimit()
+    synthesis_token_budget = DepthLimit()
+
     def __init__(self):
         self.web_search = WebSearchTool()
         self.web_scraper = WebScraperTool()
         self.content_analyzer = ContentAnalyzerTool()
         self.news_aggregator = NewsAggregatorTool()
-        self.model = genai.GenerativeModel('gemini-1.5-flash')  # Lighter model
+        self.llm = get_llm_client('gemini-1.5-flash')  # Lighter model, shared client pool
+        # Per-call deadlines (seconds) so one stalled Gemini call can't hold the request
+        self.analysis_timeout = 15
+        self.synthesis_timeout = 45
+        # Seconds each request may spend retrying failed Gemini and SerpAPI calls
+        # (backoff waits plus the retries themselves)
+        self.retry_budget = float(os.getenv("RETRY_BUDGET", 10))
 
         # Resource constraints optimized for Vercel environment (0.6 CPU, 1026MB RAM)
         self.max_search_terms = 4
         self.max_results_per_term = 4
+        # Iterative deepening: research() asks for few results per term, then
+        # searches again (the next result page, or key aspects no source covers)
+        # only while fewer sources than the query type's quorum pass the
+        # relevance threshold, up to max_search_rounds rounds in all
+        self.initial_results_per_term = 2
+        self.max_search_rounds = _max_search_rounds()
         self.max_total_results = 8
         self.max_extracted_sources = 5
+        # Scrape a few more candidates than needed so slow or failing hosts
+        # don't hold up extraction
+        self.scrape_concurrency = 4
+        self.scrape_overprovision = 2
         self.max_synthesis_content_length = 500
+        # Token budget for all source content in one synthesis prompt
+        # (the old fixed cap: max_extracted_sources x 500 characters)
+        self.synthesis_token_budget = self.max_extracted_sources * self.max_synthesis_content_length // CHARS_PER_TOKEN
+        # Minimum relevance score for a source to be kept
+        self.min_relevance_score = 5
+        self.sports_min_relevance_score = 3  # Lower bar for time-sensitive sports results
+        # Quorum per query type: extraction stops (and synthesis starts) once this many
+        # sources score at least min_score, or their content fills the synthesis budget
+        self.quorum = {
+            "general": {"sources": 3, "min_score": 8},
+            "news": {"sources": 3, "min_score": 8},
+            "sports": {"sources": 2, "min_score": 7},  # Results pages agree; the first good ones suffice
+        }
 
         # Rate limiting to prevent CPU spikes - adjusted for Vercel
+        # (shared by all requests using this agent, hence the lock)
         self.last_api_call = 0
         self.min_api_interval = 2  # Reduced interval for Vercel's better CPU allocation
+        self.rate_limit_lock = threading.Lock()
+
+        # Follow-up sessions: pages gathered earlier in a session are re-used
+        # before searching again
+        self.sessions = SessionStore()
+        self.session_min_sources = 2  # Session sources needed to skip searching entirely
+        self.aspect_coverage_score = 5  # Lexical score at which a source covers a key aspect
+        self.aspect_scorer = LocalRelevanceScorer()
+
+        # Local knowledge index of previously scraped pages, searched before the web
+        self.knowledge_index = self.web_scraper.knowledge_index
+        self.knowledge_min_score = 0.6  # Normalized BM25 score (0-1) a passage needs
+        self.knowledge_min_sources = 3  # Relevant indexed pages needed to skip the web
+        self.knowledge_max_age = 7 * 24 * 3600  # Seconds; older pages aren't used
+        self.knowledge_time_sensitive_max_age = 3 * 3600  # For sports and news queries
+
+        # Caches of search results and finished reports, shared by all requests
+        # (and warmed by the prefetch scheduler)
+        self.search_cache = TTLCache(maxsize=500, ttl=3600)
+        self.news_search_cache_ttl = 600  # News results go stale faster
+        self.report_cache = TTLCache(maxsize=100, ttl=6 * 3600)
+        self.time_sensitive_report_ttl = 900  # Sports and news reports
+
+        # Speculative search: the raw query is searched (and optionally its top
+        # result scraped) while query analysis waits on Gemini. Off by default:
+        # it costs a SerpAPI call even when the answer turns out to be local
+        self.speculative_search = os.getenv("SPECULATIVE_SEARCH", "off").lower() in ("on", "1", "true")
+        self.speculative_scrape = os.getenv("SPECULATIVE_SCRAPE", "off").lower() in ("on", "1", "true")
+        self.speculation_timeout = 20  # Seconds to wait for a speculative search once it's needed
+        self.speculation_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="speculate")
+        self.speculation_stats = {"searches": 0, "used": 0, "wasted": 0, "scrapes": 0, "scrapes_used": 0}
+        self.speculation_lock = threading.Lock()
 
         # Memory optimization
         self.last_gc = time.time()
@@ -36,101 +194,124 @@ class WebResearchAgent:
 
     def _rate_limit(self):
         """Apply rate limiting to prevent CPU spikes"""
-        current_time = time.time()
-        time_since_last_call = current_time - self.last_api_call
-        if time_since_last_call < self.min_api_interval:
-            time.sleep(self.min_api_interval - time_since_last_call)
-        self.last_api_call = time.time()
-
-    def analyze_query(self, query):
+        with self.rate_limit_lock:
+            current_time = time.time()
+            time_since_last_call = current_time - self.last_api_call
+            if time_since_last_call < self.min_api_interval:
+                time.sleep(self.min_api_interval - time_since_last_call)
+            # Respect limits shared with other processes (bulk CLI workers)
+            apply_shared_rate_limit("gemini")
+            self.last_api_call = time.time()
+
+    def analyze_query(self, query, previous_queries=None):
         """
         Analyzes the user query to understand intent and determine search strategy
+
+        previous_queries are earlier questions in the same session, so a
+        follow-up like "what about Europe?" is analyzed in context.
         """
+        if self._llm_unavailable():
+            print("Gemini unavailable, using fallback query analysis")
+            return self._fallback_analysis(query)
         try:
             # Apply rate limiting
             self._rate_limit()
 
-            # Log the original query for debugging
-            print(f"Original query: '{query}'")
+            prompt = self._analysis_prompt(query, previous_queries)
+            response = self.llm.generate(prompt, timeout=self.analysis_timeout)
+            return self._parse_analysis(response.text, query)
+        except Exception as e:
+            print(f"Error analyzing query: {e}")
+            return self._fallback_analysis(query)
+        finally:
+            # Force garbage collection
+            gc.collect()
+
+    def _analysis_prompt(self, query, previous_queries=None):
+        """Build the query analysis prompt"""
+        # Log the original query for debugging
+        print(f"Original query: '{query}'")
 
-            # Clean the query to handle special characters
-            cleaned_query = query.strip()
+        # Clean the query to handle special characters
+        cleaned_query = query.strip()
 
-            # Check if this is a sports-related query
-            is_sports_query = any(term in cleaned_query.lower() for term in
-                                 ["score", "match", "game", "won", "win", "ipl", "cricket", "football", "soccer", "nba", "nfl"])
+        follow_up = ""
+        if previous_queries:
+            follow_up = f'This is a follow-up to the earlier question "{previous_queries[-1]}".\n'
 
-            # Improved prompt to handle both complex and simple queries
-            prompt = f"""Analyze this query: "{cleaned_query}"
-            Return JSON with: main_topic, key_aspects, content_type, search_terms.
+        # Improved prompt to handle both complex and simple queries
+        return f"""Analyze this query: "{cleaned_query}"
+            {follow_up}            Return JSON with: main_topic, key_aspects, content_type, search_terms.
             For complex topics (like quantum computing), break down into specific subtopics.
             For very short queries (like "advancement of AI"), expand with related concepts.
             For sports-related queries (like "who won ipl last night"), include specific team names and tournament details.
             Be very concise. Limit search_terms to 1-2 terms maximum.
             """
 
-            response = self.model.generate_content(prompt)
-            response_text = response.text
-
-            # Parse JSON from response
-            json_match = re.search(r'```(?:json)?\s*(.*?)```', response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
+    def _parse_analysis(self, response_text, query):
+        """Parse the query analysis JSON, falling back to the raw query"""
+        # Parse JSON from response
+        json_match = re.search(r'```(?:json)?\s*(.*?)```', response_text, re.DOTALL)
+        if json_match:
+            json_str = json_match.group(1)
+        else:
+            # Try to find anything that looks like JSON
+            json_str = re.search(r'(\{.*\})', response_text, re.DOTALL)
+            if json_str:
+                json_str = json_str.group(1)
             else:
-                # Try to find anything that looks like JSON
-                json_str = re.search(r'(\{.*\})', response_text, re.DOTALL)
-                if json_str:
-                    json_str = json_str.group(1)
-                else:
-                    json_str = response_text
+                json_str = response_text
 
-            try:
-                analysis = json.loads(json_str)
-                # Clear variables to free memory
-                del response
-                del response_text
-                del json_str
-                gc.collect()
-                return analysis
-            except json.JSONDecodeError:
-                # Fallback response
-                return {
-                    "main_topic": query,
-                    "key_aspects": [query],
-                    "content_type": "facts",
-                    "search_terms": [query]
-                }
-        except Exception as e:
-            print(f"Error analyzing query: {e}")
-            return {
-                "main_topic": query,
-                "key_aspects": [query],
-                "content_type": "facts",
-                "search_terms": [query]
-            }
-        finally:
-            # Force garbage collection
-            gc.collect()
+        try:
+            return json.loads(json_str)
+        except json.JSONDecodeError:
+            return self._fallback_analysis(query)
+
+    def _fallback_analysis(self, query):
+        return {
+            "main_topic": query,
+            "key_aspects": [query],
+            "content_type": "facts",
+            "search_terms": [query]
+        }
+
+    def search_web(self, search_terms, is_news=False, query="", num_results=None, start=0):
+        """
+        Searches the web using generated search terms
 
-    def search_web(self, search_terms, is_news=False, query=""):
-        """Searches the web using generated search terms"""
+        num_results per term defaults to what _adjust_search_parameters picks
+        for the query; start skips that many results of each term (web only).
+        While SerpAPI's circuit is open only cached results are returned.
+        """
         results = []
         params = self._adjust_search_parameters(query) or {}  # Ensure params is at least an empty dict
+        if num_results is None:
+            num_results = params.get("max_results_per_term", self.max_results_per_term)
+        search_down = self.web_search.breaker.is_open()
 
         # Add null check for search_terms
         if not search_terms or not isinstance(search_terms, list):
             search_terms = [query]
 
         for term in search_terms:
-            time.sleep(1)
             # Add null check for search term
             if not term:
                 continue
 
-            # Handle potential None results from search
-            term_results = (self.news_aggregator.get_news(term, max_results=params.get("max_results_per_term", self.max_results_per_term))
-                           if is_news
-                           else self.web_search.search(term, num_results=params.get("max_results_per_term", self.max_results_per_term)) or [])
+            cache_key = (normalize_query(term), is_news, num_results, start)
+            term_results = self.search_cache.get(cache_key)
+            if term_results is None and search_down:
+                print(f"Search unavailable, skipping '{term}'")
+            elif term_results is None:
+                time.sleep(1)
+                # Handle potential None results from search
+                if is_news:
+                    term_results = self.news_aggregator.get_news(term, max_results=num_results)
+                elif start:
+                    term_results = self.web_search.search(term, num_results=num_results, start=start) or []
+                else:
+                    term_results = self.web_search.search(term, num_results=num_results) or []
+                self._cache_search(cache_key, term_results)
 
             # Filter out None entries and only extend results once
             if term_results:
@@ -140,65 +321,236 @@ class WebResearchAgent:
             del term_results
             gc.collect()
 
+        unique_results = self._dedupe_results(results)
+
+        # Clear variables to free memory
+        del results
+        gc.collect()
+
+        return unique_results
+
+    def _cache_search(self, cache_key, term_results):
+        """Cache a term's search results; empty results (often errors) aren't cached"""
+        if term_results:
+            self.search_cache.set(cache_key, term_results,
+                                  ttl=self.news_search_cache_ttl if cache_key[1] else None)
+
+    def has_cached_report(self, query, depth=None, overrides=None):
+        """True if a fresh report for this query (at this depth) is cached"""
+        token = set_depth_limits(self._depth_limits(depth, overrides))
+        try:
+            return self.report_cache.get(self._report_key(query)) is not None
+        finally:
+            reset_depth_limits(token)
+
+    def _report_key(self, query):
+        """Report cache key: the normalized query, plus the limits of non-standard depths"""
+        limits = current_depth_limits()
+        if not limits:
+            return normalize_query(query)
+        return (normalize_query(query), tuple(sorted(limits.items())))
+
+    def _depth_limits(self, depth, overrides):
+        """A request's limits (see depth.resolve_depth), with the synthesis budget following the source limits"""
+        limits = resolve_depth(depth, overrides)
+        if "max_extracted_sources" in limits or "max_synthesis_content_length" in limits:
+            limits["synthesis_token_budget"] = (limits.get("max_extracted_sources", self.max_extracted_sources)
+                                                * limits.get("max_synthesis_content_length",
+                                                             self.max_synthesis_content_length)
+                                                // CHARS_PER_TOKEN)
+        return limits
+
+    def _cache_report(self, context, report):
+        """Cache a finished report for first-time (non follow-up) queries"""
+        if context.previous_queries or report.startswith(("Failed to synthesize", DEGRADED_REPORT_NOTE)):
+            return
+        self.report_cache.set(self._report_key(context.query), report,
+                              ttl=self.time_sensitive_report_ttl if context.is_time_sensitive else None)
+
+    def _should_speculate(self, context):
+        """
+        Speculate for first-time queries the knowledge index can't already
+        answer (a raw-query probe with the thresholds the index check uses)
+        """
+        if not self.speculative_search or context.previous_queries:
+            return False
+        if self.knowledge_index is None:
+            return True
+        max_age = (self.knowledge_time_sensitive_max_age if context.is_time_sensitive
+                   else self.knowledge_max_age)
+        hits = self.knowledge_index.search(context.query, max_age=max_age, limit=self.max_total_results)
+        pages = {canonicalize_url(hit["url"]) for hit in hits if hit["score"] >= self.knowledge_min_score}
+        if len(pages) >= self.knowledge_min_sources:
+            print("Knowledge index likely covers the query, not speculating")
+            return False
+        return True
+
+    def _start_speculation(self, context):
+        """Start searching the raw query of a first-time query in the background"""
+        if not self._should_speculate(context):
+            return None
+        self._count_speculation("searches")
+        return self.speculation_executor.submit(contextvars.copy_context().run, profiled_task, self._speculate,
+                                                context.query)
+
+    def _speculate(self, query):
+        """Search the raw query; returns (results, scraped top page or None)"""
+        results = self.search_web([query], is_news=False, query=query, num_results=self.initial_results_per_term)
+        page = None
+        if self.speculative_scrape and results:
+            self._count_speculation("scrapes")
+            scraped = self.web_scraper.scrape(results[0]["link"])
+            if scraped["content"]:
+                page = {"url": results[0]["link"], "title": scraped["title"], "content": scraped["content"]}
+        return results, page
+
+    def _speculation_result(self, speculation):
+        """Wait for a speculative search; ([], None) if it failed or took too long"""
+        try:
+            return speculation.result(timeout=self.speculation_timeout)
+        except Exception as e:
+            print(f"Speculative search failed: {e}")
+            return [], None
+
+    def _discard_speculation(self, speculation):
+        """The search turned out unnecessary (session or index covered the query)"""
+        if speculation is not None:
+            speculation.cancel()
+            self._count_speculation("wasted")
+
+    def _count_speculation(self, counter):
+        with self.speculation_lock:
+            self.speculation_stats[counter] += 1
+
+    def speculation_snapshot(self):
+        with self.speculation_lock:
+            return dict(self.speculation_stats)
+
+    def _speculative_terms(self, context, speculation):
+        """The analyzed search terms minus the raw query when it is already being searched"""
+        if speculation is None:
+            return context.search_terms
+        raw = normalize_query(context.query)
+        return [term for term in context.search_terms if normalize_query(term) != raw]
+
+    def _merge_speculation(self, context, search_results, speculative_results, page):
+        """
+        Merge speculative results into the analyzed terms' results and note
+        the links only the speculation contributed (see _settle_speculation)
+        """
+        raw = normalize_query(context.query)
+        if any(normalize_query(term) == raw for term in context.search_terms):
+            merged = speculative_results + search_results  # The raw query was an analyzed term too
+            analyzed_links = set()  # It stood in for that term's search: all its links count
+        else:
+            merged = search_results + speculative_results
+            analyzed_links = {canonicalize_url(result["link"]) for result in search_results}
+        merged = self._dedupe_results(merged)
+
+        links = {canonicalize_url(result["link"]) for result in merged}
+        context.speculative_links = {canonicalize_url(r["link"]) for r in speculative_results} & links - analyzed_links
+        if not context.speculative_links:
+            self._count_speculation("wasted")
+            context.speculative_links = None
+        if page is not None and canonicalize_url(page["url"]) in links:
+            # Already scraped: extraction analyzes it without fetching again
+            self._count_speculation("scrapes_used")
+            context.scraped_pages.append(page)
+            url = canonicalize_url(page["url"])
+            merged = [dict(result, title=page["title"], content=page["content"])
+                      if canonicalize_url(result["link"]) == url else result for result in merged]
+        return merged
+
+    def _settle_speculation(self, context, sources):
+        """Count the speculation used if a link only it contributed became a source, else wasted"""
+        if context.speculative_links is None:
+            return
+        used = any(canonicalize_url(source["url"]) in context.speculative_links for source in sources)
+        self._count_speculation("used" if used else "wasted")
+        context.speculative_links = None
+
+    def _dedupe_results(self, results):
+        """Drop malformed and repeated results, keeping the first max_total_results"""
         # Simplified deduplication to save memory
         unique_results = []
         urls = set()
+        max_total_results = self.max_total_results  # A DepthLimit: read it once, not per result
 
         for result in results:
             # Add null check for result and result["link"]
             if not result or not isinstance(result, dict) or "link" not in result:
                 continue
 
-            url = result["link"]
+            url = canonicalize_url(result["link"])
             if url not in urls:
                 unique_results.append(result)
                 urls.add(url)
 
                 # Break if we've reached our limit
-                if len(unique_results) >= self.max_total_results:
+                if len(unique_results) >= max_total_results:
                     break
 
-        # Clear variables to free memory
-        del results
-        del urls
-        gc.collect()
-
         return unique_results
 
-    def extract_content(self, search_results, query):
+    def extract_content(self, search_results, query, min_relevance=None, key_aspects=None, scraped_pages=None,
+                        quorum=None):
         """
         Extracts and analyzes content from search results
         Optimized for low resource environment
-        """
-        extracted_data = []
-        # Limit to configurable max results to process
-        search_results = search_results[:self.max_total_results]
 
-        for result in search_results:
-            # Apply rate limiting between scraping operations
-            time.sleep(1)
-
-            url = result["link"]
-            scraped_data = self.web_scraper.scrape(url)
+        Candidates are scraped concurrently in ranked order, keeping a few more
+        in flight than needed. As soon as max_extracted_sources relevant sources
+        are gathered the stragglers are cancelled: queued ones never start and
+        running ones stop before their next scrape or analysis, so they don't
+        hold rate limits and LLM slots live work needs. A failed or irrelevant
+        candidate is replaced by the next one in the ranking.
+
+        Sources scoring below min_relevance (default: min_relevance_score) are dropped.
+        key_aspects from the query analysis help the local relevance cascade.
+        Results that already carry 'content' (session pages) are analyzed
+        without scraping; newly scraped pages are appended to scraped_pages.
+        With a quorum ({"sources", "min_score"}), extraction also stops early
+        once the quorum of strong sources is in, cancelling the stragglers the
+        same way.
+        """
+        if min_relevance is None:
+            min_relevance = self.min_relevance_score
 
-            if scraped_data["content"]:
-                # Apply rate limiting before analysis
-                time.sleep(1)
+        extracted_data = []
+        candidates = iter(self._rank_candidates(search_results))
+        executor = ThreadPoolExecutor(max_workers=self.scrape_concurrency, thread_name_prefix="scrape")
+        pending = set()
+        stop = threading.Event()  # Set once extraction is over; running candidates check it between steps
 
-                analysis = self.content_analyzer.analyze(scraped_data["content"], query)
+        try:
+            while True:
+                # Keep (still needed + overprovision) candidates in flight
+                wanted = self.max_extracted_sources - len(extracted_data) + self.scrape_overprovision
+                while len(pending) < min(wanted, self.scrape_concurrency):
+                    result = next(candidates, None)
+                    if result is None:
+                        break
+                    # The copied context carries the request's retry budget and profiling into the worker
+                    pending.add(executor.submit(contextvars.copy_context().run, profiled_task, self._extract_one,
+                                                result, query, min_relevance, key_aspects, scraped_pages, stop))
+
+                if not pending:
+                    break
 
-                if analysis.get("relevance_score", 0) >= 5:  # Only keep relevant content
-                    extracted_data.append({
-                        "title": scraped_data["title"],
-                        "url": url,
-                        "content": analysis.get("relevant_content", ""),
-                        "relevance_score": analysis.get("relevance_score", 0)
-                    })
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = future.result()
+                    if item is not None:
+                        extracted_data.append(item)
 
-                # Clear variables to free memory
-                del scraped_data
-                del analysis
-                gc.collect()
+                if len(extracted_data) >= self.max_extracted_sources or self._quorum_reached(extracted_data, quorum):
+                    if pending:
+                        print(f"Gathered {len(extracted_data)} sources, cancelling {len(pending)} stragglers")
+                    break
+        finally:
+            # Queued work is dropped; running candidates stop at their next step
+            stop.set()
+            executor.shutdown(wait=False, cancel_futures=True)
 
         # Sort by relevance score
         extracted_data.sort(key=lambda x: x["relevance_score"], reverse=True)
@@ -208,36 +560,127 @@ class WebResearchAgent:
         gc.collect()
         return extracted_data
 
+    def _rank_candidates(self, search_results):
+        """
+        Extraction order for the first max_total_results results: results
+        that already carry 'content' (session, index or speculatively scraped
+        pages) first, since they need no fetch and no domain circuit check;
+        the rest without circuit-broken domains, slow/low-yield ones pushed down
+        """
+        results = search_results[:self.max_total_results]
+        held = [result for result in results if result.get("content")]
+        to_fetch = [result for result in results if not result.get("content")]
+        return held + self.web_scraper.domain_stats.rank(to_fetch)
+
+    def _quorum_reached(self, extracted_data, quorum):
+        """
+        True once enough strong sources are in, or their content fills the synthesis budget
+
+        Only LLM-verified scores count: the cascade's local accepts are
+        extractive guesses and can't end the extraction early.
+        """
+        if not quorum:
+            return False
+        strong = [item for item in extracted_data
+                  if item["relevance_score"] >= quorum["min_score"] and item.get("scored_by") != "local"]
+        if len(strong) >= quorum["sources"]:
+            print(f"Quorum of {len(strong)} sources scoring {quorum['min_score']}+ reached")
+            return True
+        if strong and sum(estimate_tokens(item["content"]) for item in strong) >= self.synthesis_token_budget:
+            print("Strong sources fill the synthesis budget")
+            return True
+        return False
+
+    def _extract_one(self, result, query, min_relevance, key_aspects, scraped_pages=None, stop=None):
+        """Scrape and analyze one search result; returns the source dict or None (also once stop is set)"""
+        try:
+            url = result["link"]
+            if stop is not None and stop.is_set():
+                return None
+            if result.get("content"):
+                # Already scraped earlier in the session
+                scraped_data = {"title": result.get("title", ""), "content": result["content"]}
+            else:
+                scraped_data = self.web_scraper.scrape(url)
+                if scraped_data["content"] and scraped_pages is not None:
+                    scraped_pages.append({"url": url, "title": scraped_data["title"],
+                                          "content": scraped_data["content"]})
+
+            if not scraped_data["content"]:
+                return None
+            if stop is not None and stop.is_set():
+                return None  # Extraction is over; don't spend an analysis on it
+
+            analysis = self.content_analyzer.analyze(scraped_data["content"], query,
+                                                     min_relevance=min_relevance,
+                                                     key_aspects=key_aspects)
+
+            self.web_scraper.domain_stats.record_relevance(url, analysis.get("relevance_score", 0))
+
+            if analysis.get("relevance_score", 0) < min_relevance:  # Only keep relevant content
+                return None
+
+            return {
+                "title": scraped_data["title"],
+                "url": url,
+                "content": analysis.get("relevant_content", ""),
+                "relevance_score": analysis.get("relevance_score", 0),
+                "source_quality": analysis.get("source_quality", 5),
+                "scored_by": analysis.get("scored_by", "llm")
+            }
+        except Exception as e:
+            print(f"Error extracting {result.get('link', '')}: {e}")
+            return None
+
     def synthesize_information(self, extracted_data, query):
         """
         Synthesizes extracted information into a comprehensive report
         Optimized for low resource environment
+
+        While Gemini's circuit is open, the sources' excerpts are returned instead.
         """
         try:
             # Check if there's any data to synthesize
             if not extracted_data:
                 return "I couldn't find relevant information for your query. Please try with different search terms."
+            if self._llm_unavailable():
+                return self._degraded_report(extracted_data)
 
             # Apply rate limiting
             self._rate_limit()
 
-            # Prepare content for synthesis
-            context = []
             # Limit to configurable top sources
             extracted_data = extracted_data[:self.max_extracted_sources]
+            prompt = self._synthesis_prompt(extracted_data, query)
 
-            for item in extracted_data:
-                # Limit content length for each source using the configurable limit
-                content = item.get('content', '')
-                if len(content) > self.max_synthesis_content_length:
-                    content = content[:self.max_synthesis_content_length] + "..."
+            response = self.llm.generate(prompt, timeout=self.synthesis_timeout)
+            return self._with_sources(response.text, extracted_data)
+        except CircuitOpenError:
+            return self._degraded_report(extracted_data)
+        except Exception as e:
+            print(f"Error synthesizing information: {e}")
+            return "Failed to synthesize information due to an error."
+        finally:
+            # Force garbage collection
+            gc.collect()
 
-                context.append(f"Source: {item.get('title', 'Unknown')} ({item.get('url', '')})\n{content}\n")
+    def _synthesis_prompt(self, extracted_data, query):
+        """Build the synthesis prompt, packing source content into the token budget"""
+        # Prepare content for synthesis
+        context = []
+        headers = [f"Source: {item.get('title', 'Unknown')} ({item.get('url', '')})" for item in extracted_data]
+        # Share the token budget by relevance and quality, trimming at sentence boundaries
+        content_budget = max(self.synthesis_token_budget - sum(estimate_tokens(h) for h in headers), 0)
+        packed_contents = pack_context(extracted_data, content_budget)
 
-            context_text = "\n".join(context)
+        for header, content in zip(headers, packed_contents):
+            if content:
+                context.append(f"{header}\n{content}\n")
 
-            # Simplified prompt to reduce token usage
-            prompt = f"""Based on this information, answer: "{query}"
+        context_text = "\n".join(context)
+
+        # Simplified prompt to reduce token usage
+        return f"""Based on this information, answer: "{query}"
 
             INFORMATION:
             {context_text}
@@ -246,36 +689,214 @@ class WebResearchAgent:
             Include proper citations.
             """
 
-            response = self.model.generate_content(prompt)
-            report = response.text
+    def _llm_unavailable(self):
+        """True while Gemini's circuit is open"""
+        return self.llm.breaker is not None and self.llm.breaker.is_open()
+
+    def _degraded_report(self, extracted_data):
+        """The top sources' extracted content, for when Gemini can't write the report (not cached)"""
+        excerpts = [f"{item.get('title') or 'Untitled'}:\n{item.get('content', '')[:self.max_synthesis_content_length]}"
+                    for item in extracted_data[:self.max_extracted_sources]]
+        return self._with_sources(f"{DEGRADED_REPORT_NOTE}\n\n" + "\n\n".join(excerpts),
+                                  extracted_data[:self.max_extracted_sources])
+
+    def _with_sources(self, report, extracted_data):
+        """Add the list of sources at the end of a report"""
+        sources = "\n\nSources:\n"
+        for i, item in enumerate(extracted_data):
+            sources += f"{i+1}. {item.get('title', 'Unknown')} - {item.get('url', '')}\n"
+        return report + sources
+
+    def _uncovered_aspects(self, sources, key_aspects):
+        """Key aspects that none of the sources covers (lexically)"""
+        if isinstance(key_aspects, str):
+            key_aspects = [key_aspects]
+        uncovered = []
+        for aspect in key_aspects or []:
+            if not isinstance(aspect, str) or not aspect.strip():
+                continue
+            if not any(self.aspect_scorer.score(source["content"], aspect) >= self.aspect_coverage_score
+                       for source in sources):
+                uncovered.append(aspect)
+        return uncovered
 
-            # Add sources at the end
-            sources = "\n\nSources:\n"
-            for i, item in enumerate(extracted_data):
-                sources += f"{i+1}. {item.get('title', 'Unknown')} - {item.get('url', '')}\n"
+    def _search_knowledge_index(self, context):
+        """
+        Look up every search term in the local knowledge index
 
-            # Clear variables to free memory
-            del context
-            del context_text
-            del prompt
-            del response
-            gc.collect()
+        Returns:
+            list: Result dicts with the matching passages as 'content', one per
+                  page, or an empty list unless every term has fresh, high-scoring hits
+        """
+        max_age = (self.knowledge_time_sensitive_max_age if context.is_time_sensitive
+                   else self.knowledge_max_age)
+        pages = {}
+        for term in context.search_terms:
+            hits = [hit for hit in self.knowledge_index.search(term, max_age=max_age, limit=self.max_total_results)
+                    if hit["score"] >= self.knowledge_min_score]
+            if not hits:
+                return []  # This term needs the web anyway
+            for hit in hits:
+                page = pages.setdefault(canonicalize_url(hit["url"]),
+                                        {"link": hit["url"], "title": hit["title"], "passages": []})
+                if hit["text"] not in page["passages"]:
+                    page["passages"].append(hit["text"])
+
+        results = [{"link": page["link"], "title": page["title"], "content": " ".join(page["passages"])}
+                   for page in pages.values()]
+        return results[:self.max_total_results]
+
+    def _plan_search(self, context):
+        """Settle the search terms and relevance threshold from the query analysis"""
+        analysis = context.analysis
+        print(f"Query analysis: {analysis}")
+
+        # Check if search_terms exists and is a list
+        if "search_terms" not in analysis or not analysis["search_terms"]:
+            analysis["search_terms"] = [context.query]  # Use the original query as fallback
+        elif not isinstance(analysis["search_terms"], list):
+            analysis["search_terms"] = [analysis["search_terms"]]  # Convert to list if it's a string
+
+        # Process search terms
+        context.search_terms = analysis["search_terms"][:self.max_search_terms]
+
+        # For sports queries, lower the relevance threshold
+        context.min_relevance = (self.sports_min_relevance_score if context.is_sports_query
+                                 else self.min_relevance_score)
+
+    def _narrow_search_to_session(self, context, session_data):
+        """Search only for the key aspects the session's sources don't cover"""
+        if not session_data:
+            return
+        uncovered = self._uncovered_aspects(session_data, context.key_aspects)
+        print(f"Session supplied {len(session_data)} sources; uncovered aspects: {uncovered}")
+        context.search_terms = uncovered[:self.max_search_terms]
+        if not context.search_terms and len(session_data) < self.session_min_sources:
+            context.search_terms = context.analysis["search_terms"][:self.max_search_terms]
+
+    def _session_results(self, session):
+        """A session's stored pages as pre-scraped search results, most recent first"""
+        return [{"link": page["url"], "title": page["title"], "content": page["content"]}
+                for page in reversed(session["pages"])]
+
+    def _record_search_round(self, context, terms, results):
+        """Count a search round and remember its terms and result links"""
+        context.search_rounds += 1
+        context.searched_terms.update(normalize_query(term) for term in terms if isinstance(term, str))
+        context.seen_links.update(canonicalize_url(result["link"]) for result in results)
+
+    def _needs_deeper_search(self, context, sources):
+        """True while fewer sources than the query type's quorum passed and rounds remain"""
+        target = self.quorum.get(context.query_type, {}).get("sources", self.max_extracted_sources)
+        if len(sources) >= target or context.search_rounds >= self.max_search_rounds:
+            return False
+        if self.web_search.breaker.is_open():
+            return False
+        print(f"Only {len(sources)} of {target} sources after {context.search_rounds} search rounds, searching deeper")
+        return True
+
+    def _next_search_round(self, context, sources):
+        """
+        Terms and result offset for the next deepening round: key aspects no
+        source covers yet (each searched once), else the next result page of
+        the planned terms
 
-            return report + sources
-        except Exception as e:
-            print(f"Error synthesizing information: {e}")
-            return "Failed to synthesize information due to an error."
-        finally:
-            # Force garbage collection
-            gc.collect()
+        Returns:
+            tuple: (search terms, start)
+        """
+        topic = context.analysis.get("main_topic")
+        topic = topic if isinstance(topic, str) else ""
+        aspect_terms = []
+        for aspect in self._uncovered_aspects(sources, context.key_aspects):
+            term = aspect if topic.lower() in aspect.lower() else f"{topic} {aspect}".strip()
+            if normalize_query(term) not in context.searched_terms:
+                aspect_terms.append(term)
+        if aspect_terms:
+            return aspect_terms[:self.max_search_terms], 0
+        context.result_page += 1
+        return context.search_terms, context.result_page * self.initial_results_per_term
+
+    def _new_results(self, context, results):
+        """Results not seen in an earlier round"""
+        return [result for result in results if canonicalize_url(result["link"]) not in context.seen_links]
+
+    def _deepen_search(self, context, sources):
+        """
+        Iterative deepening: search again and extract the new results while
+        too few sources pass the relevance threshold
 
-    def research(self, query):
+        Returns:
+            list: The sources, merged with any found by deeper rounds
+        """
+        while self._needs_deeper_search(context, sources):
+            self._check_stop(context)
+            terms, start = self._next_search_round(context, sources)
+            results = self._new_results(context, self.search_web(terms, query=context.query,
+                                                                 num_results=self.initial_results_per_term,
+                                                                 start=start))
+            self._record_search_round(context, terms, results)
+            if not results:
+                print("No new results, stopping the deeper search")
+                break
+            new_sources = self.extract_content(results, context.model_query, min_relevance=context.min_relevance,
+                                               key_aspects=context.key_aspects,
+                                               scraped_pages=context.scraped_pages,
+                                               quorum=self.quorum.get(context.query_type))
+            sources = self._merge_sources(sources, new_sources)
+        return sources
+
+    def _check_stop(self, context, speculation=None):
+        """Abandon the run between stages once context.should_stop() asks for it"""
+        if context.should_stop is not None and context.should_stop():
+            self._discard_speculation(speculation)
+            raise ResearchCancelled(f"Research for '{context.query}' was stopped")
+
+    def _merge_sources(self, prior_data, extracted_data):
+        """Merge session/index sources with freshly extracted ones, best first"""
+        if not prior_data:
+            return extracted_data
+        # Earlier sources first for equal scores; fresh copies of the same page win
+        seen_urls = {canonicalize_url(item["url"]) for item in extracted_data}
+        merged = []
+        for item in prior_data:
+            url = canonicalize_url(item["url"])
+            if url not in seen_urls:
+                seen_urls.add(url)
+                merged.append(item)
+        merged += extracted_data
+        merged.sort(key=lambda x: x["relevance_score"], reverse=True)
+        return merged[:self.max_extracted_sources]
+
+    def research(self, query, session_id=None, depth=None, overrides=None, should_stop=None):
         """
         Main method to perform web research based on user query
         Optimized for low resource environment
+
+        With a session_id, pages gathered for earlier queries in the session
+        are tried first; only the key aspects they don't cover are searched.
+        The local knowledge index is consulted next, and the web is skipped
+        when it holds enough fresh, relevant pages.
+
+        depth picks a limits profile ("quick", "standard" or "deep", see
+        depth.py) and overrides sets individual limits, for this request only.
+
+        Failed Gemini and SerpAPI calls are retried within the request's
+        retry budget; while an upstream's circuit is open the pipeline
+        degrades instead (fallback analysis, cached search results only,
+        local scoring, extractive report).
+
+        should_stop, if given, is called between stages (background prefetch
+        uses it to back off when live traffic arrives).
+
+        Raises:
+            ValueError: For an unknown depth or an invalid override
+            ResearchCancelled: should_stop returned True
         """
+        depth_token = set_depth_limits(self._depth_limits(depth, overrides))
+        budget_token = set_retry_budget(self.retry_budget)
         try:
             # Monitor memory usage
+            import psutil  # Imported on first use to keep cold start fast
             process = psutil.Process()
             memory_info = process.memory_info()
             memory_usage_mb = memory_info.rss / (1024 * 1024)
@@ -284,87 +905,107 @@ class WebResearchAgent:
             if memory_usage_mb > max_memory_mb * 0.8:  # If using more than 80% of allowed memory
                 gc.collect()  # Force garbage collection
 
+            session = self.sessions.get(session_id) if session_id else {"queries": [], "pages": []}
+            context = ResearchContext(query, previous_queries=session["queries"], should_stop=should_stop)
+            model_query = context.model_query
+
+            # Reports for first-time queries are served from cache while fresh
+            cached_report = None if context.previous_queries else self.report_cache.get(self._report_key(query))
+            if cached_report is not None:
+                print(f"Serving cached report for '{query}'")
+                if session_id:
+                    self.sessions.add(session_id, query, [])
+                return cached_report
+
+            # The raw query is usually a fine search term: start on it while the analysis runs
+            speculation = self._start_speculation(context)
+
             # Step 1: Analyze the query
-            analysis = self.analyze_query(query)
-            print(f"Query analysis: {analysis}")
-
-            # Check if this is a sports-related query
-            is_sports_query = any(term in query.lower() for term in
-                                ["score", "match", "game", "won", "win", "ipl", "cricket", "football", "soccer", "nba", "nfl"])
-
-            # Step 2: Search for general information
-            # Check if search_terms exists and is a list
-            if "search_terms" not in analysis or not analysis["search_terms"]:
-                analysis["search_terms"] = [query]  # Use the original query as fallback
-            elif not isinstance(analysis["search_terms"], list):
-                analysis["search_terms"] = [analysis["search_terms"]]  # Convert to list if it's a string
-
-            # Process search terms
-            search_terms = analysis["search_terms"][:self.max_search_terms]
-
-            # For sports queries, also search news sources
-            if is_sports_query:
-                print("Detected sports query, searching news sources...")
-                news_results = self.search_web(search_terms, is_news=True, query=query)
-                search_results = self.search_web(search_terms, is_news=False, query=query)
-                # Combine results, prioritizing news
-                combined_results = news_results + search_results
-                # Remove duplicates while preserving order
-                seen_urls = set()
-                unique_results = []
-                for result in combined_results:
-                    if result.get("link") not in seen_urls:
-                        seen_urls.add(result.get("link"))
-                        unique_results.append(result)
-                search_results = unique_results[:self.max_total_results]
-            else:
-                search_results = self.search_web(search_terms, is_news=False, query=query)
+            with context.timed("analyze_query"):
+                context.analysis = self.analyze_query(query, previous_queries=context.previous_queries)
+            self._check_stop(context, speculation)
+            self._plan_search(context)
+
+            # Follow-ups: answer from the session's pages first
+            session_data = []
+            if session["pages"]:
+                with context.timed("session"):
+                    session_data = self.extract_content(self._session_results(session), model_query,
+                                                        min_relevance=context.min_relevance,
+                                                        key_aspects=context.key_aspects)
+                self._narrow_search_to_session(context, session_data)
+
+            # Then the local knowledge index
+            index_data = []
+            if context.search_terms and self.knowledge_index is not None:
+                with context.timed("knowledge_index"):
+                    index_results = self._search_knowledge_index(context)
+                    if len(index_results) >= self.knowledge_min_sources:
+                        index_data = self.extract_content(index_results, model_query,
+                                                          min_relevance=context.min_relevance,
+                                                          key_aspects=context.key_aspects)
+                if len(index_data) >= self.knowledge_min_sources:
+                    print(f"Knowledge index supplied {len(index_data)} sources, skipping web search")
+                    context.search_terms = []
+
+            self._check_stop(context, speculation)
+            search_results = []
+            with context.timed("search"):
+                web_terms = self._speculative_terms(context, speculation)
+                if not context.search_terms:
+                    print("Gathered material covers the query, skipping search")
+                    self._discard_speculation(speculation)
+                    speculation = None
+                # For sports queries, also search news sources
+                elif context.is_sports_query:
+                    print("Detected sports query, searching news sources...")
+                    news_results = self.search_web(context.search_terms, is_news=True, query=query)
+                    search_results = (self.search_web(web_terms, is_news=False, query=query,
+                                                      num_results=self.initial_results_per_term)
+                                      if web_terms else [])
+                    # Combine results, prioritizing news, without duplicates
+                    search_results = self._dedupe_results(news_results + search_results)
+                elif web_terms:
+                    search_results = self.search_web(web_terms, is_news=False, query=query,
+                                                     num_results=self.initial_results_per_term)
+
+                if speculation is not None:
+                    search_results = self._merge_speculation(context, search_results,
+                                                             *self._speculation_result(speculation))
+                self._record_search_round(context, context.search_terms, search_results)
 
             # Clear memory after each major step
             gc.collect()
 
             # Step 3: Extract and analyze content
-            # For sports queries, lower the relevance threshold in extract_content
-            if is_sports_query:
-                # Store original threshold
-                original_threshold = 5
-                # Temporarily modify the extract_content method to use a lower threshold
-                extracted_data = []
-                for result in search_results[:self.max_total_results]:
-                    # Apply rate limiting between scraping operations
-                    time.sleep(1)
-                    url = result["link"]
-                    scraped_data = self.web_scraper.scrape(url)
-                    if scraped_data["content"]:
-                        # Apply rate limiting before analysis
-                        time.sleep(1)
-                        analysis = self.content_analyzer.analyze(scraped_data["content"], query)
-                        # Lower threshold for sports queries
-                        if analysis.get("relevance_score", 0) >= 3:  # Lower threshold
-                            extracted_data.append({
-                                "title": scraped_data["title"],
-                                "url": url,
-                                "content": analysis.get("relevant_content", ""),
-                                "relevance_score": analysis.get("relevance_score", 0)
-                            })
-                        # Clear variables to free memory
-                        del scraped_data
-                        # Don't delete analysis here as it might be needed later
-                        gc.collect()
-                # Sort by relevance score
-                extracted_data.sort(key=lambda x: x["relevance_score"], reverse=True)
-                # Limit to configurable top most relevant results
-                extracted_data = extracted_data[:self.max_extracted_sources]
-            else:
-                extracted_data = self.extract_content(search_results, query)
+            self._check_stop(context)
+            with context.timed("extract"):
+                extracted_data = self.extract_content(search_results, model_query, min_relevance=context.min_relevance,
+                                                      key_aspects=context.key_aspects,
+                                                      scraped_pages=context.scraped_pages,
+                                                      quorum=self.quorum.get(context.query_type))
+
+            extracted_data = self._merge_sources(session_data + index_data, extracted_data)
+            self._settle_speculation(context, extracted_data)
+
+            # Search deeper only if too few sources passed the relevance threshold
+            if context.search_terms:
+                with context.timed("deepen"):
+                    extracted_data = self._deepen_search(context, extracted_data)
+            if session_id:
+                self.sessions.add(session_id, query, context.scraped_pages)
 
             # Clear memory after each major step
             del search_results
             gc.collect()
 
             # Step 4: Synthesize information
+            self._check_stop(context)
             if extracted_data:
-                report = self.synthesize_information(extracted_data, query)
+                with context.timed("synthesize"):
+                    report = self.synthesize_information(extracted_data, model_query)
+                print(f"Research timings: {context.timings}")
+                self._cache_report(context, report)
 
                 # Clear variables to free memory
                 # Don't delete analysis here as it might be needed later
@@ -372,12 +1013,18 @@ class WebResearchAgent:
                 gc.collect()
 
                 return report
+            elif self.web_search.breaker.is_open():
+                return SEARCH_UNAVAILABLE_MESSAGE
             else:
                 return "I couldn't find relevant information for your query. Please try with different search terms."
+        except ResearchCancelled:
+            raise
         except Exception as e:
             print(f"Error in research process: {e}")
             return f"An error occurred during the research process: {str(e)}"
         finally:
+            reset_retry_budget(budget_token)
+            reset_depth_limits(depth_token)
             # Force garbage collection at the end
             gc.collect()
 
@@ -1,32 +1,115 @@
-from flask import Flask, request, render_template, jsonify
-from agent import WebResearchAgent
+from flask import Flask, request, render_template, jsonify, Response
+from agent import WebResearchAgent, SEARCH_UNAVAILABLE_MESSAGE
+from llm import llm_stats
+from resilience import breaker_stats
+from domain_stats import get_domain_stats
+from admission import AdaptiveLimiter
+from prefetch import PrefetchScheduler, schedule_from_env
+from profiling import ProfileStore, get_stack_sampler, sampling_enabled
+from depth import resolve_depth
 import gc
+import hmac
 import os
 import threading
 import queue
-import psutil  # Already in your requirements.txt
+import time
 
 app = Flask(__name__)
-# Track active workers
-active_workers = 0
-max_workers = 5  # Maximum concurrent workers for Vercel environment (0.6 CPU)
 
-# Create a global agent instance that can be reused
+def _upstream_counters():
+    """Cumulative (calls, failures) of the shared Gemini clients"""
+    stats = llm_stats().values()
+    return sum(s["calls"] for s in stats), sum(s["errors"] + s["timeouts"] for s in stats)
+
+# Adaptive limit on concurrent research requests (starts at the old fixed 5),
+# driven by request latency, worker memory and Gemini error rates
+admission = AdaptiveLimiter(initial_limit=int(os.getenv('ADMISSION_INITIAL_LIMIT', 5)),
+                            max_limit=int(os.getenv('ADMISSION_MAX_LIMIT', 20)),
+                            max_queue=int(os.getenv('ADMISSION_QUEUE_SIZE', 10)),
+                            memory_limit_mb=int(os.getenv('WORKER_MAX_MEMORY_MB', 800)),
+                            upstream_counters=_upstream_counters)
+queue_timeout = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 10))  # Seconds a request may wait for a slot
+request_timeout = 180  # Seconds from arrival, including time spent queued
+
+# One warm agent per worker process, shared by all request threads
 research_agent = None
+research_agent_lock = threading.Lock()
+
+def get_research_agent():
+    """Return the worker's shared WebResearchAgent, creating it on first use"""
+    global research_agent
+    if research_agent is None:
+        with research_agent_lock:
+            if research_agent is None:
+                research_agent = WebResearchAgent()
+    return research_agent
+
+# Background prefetch of scheduled and popular queries while the worker is idle (PREFETCH=on)
+prefetcher = None
+prefetcher_lock = threading.Lock()
+
+def get_prefetcher():
+    """Return the worker's PrefetchScheduler, started on first use; None if prefetching is off"""
+    global prefetcher
+    if os.getenv('PREFETCH', 'off').lower() not in ('on', '1', 'true'):
+        return None
+    if prefetcher is None:
+        with prefetcher_lock:
+            if prefetcher is None:
+                # Started from a request rather than at import: with preload_app,
+                # threads started in the master would not survive the fork
+                prefetcher = PrefetchScheduler(get_research_agent(), admission, schedule_from_env())
+                prefetcher.start()
+    return prefetcher
+
+# Per-request profiles, captured on demand (X-Profile header or /admin/profiling)
+profiles = ProfileStore()
+
+def _start_sampling():
+    """Start the always-on stack sampler if PROFILE_SAMPLING=on (after the fork, like the prefetcher)"""
+    if sampling_enabled():
+        get_stack_sampler().start()
+
+def _is_admin():
+    """True if the request carries 'Authorization: Bearer <ADMIN_TOKEN>'"""
+    token = os.getenv('ADMIN_TOKEN')
+    supplied = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode())
+
+def _admin_denied():
+    """Error response for admin routes, or None if the request may proceed"""
+    if not os.getenv('ADMIN_TOKEN'):
+        return jsonify({'error': 'Not found'}), 404  # Admin routes are off without a token
+    if not _is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    return None
 
 @app.route('/')
 def index():
     return render_template('index.html')
 
-def process_request(query, result_queue):
-    """Worker function to process research requests"""
-    global active_workers, research_agent
+@app.route('/stats')
+def stats():
+    """Runtime stats for the shared upstream clients (admin only: they name the domains scraped)"""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    return jsonify({'llm': llm_stats(), 'breakers': breaker_stats(), 'domains': get_domain_stats().snapshot(),
+                    'admission': admission.snapshot(),
+                    'prefetch': prefetcher.snapshot() if prefetcher is not None else None,
+                    'speculation': research_agent.speculation_snapshot() if research_agent is not None else None})
+
+def process_request(query, result_queue, session_id=None, ticket=None, profile_mode=None, depth_options=None):
+    """Worker function to process research requests (depth_options: research()'s depth/overrides)"""
+    failed = False
+    fast_path = False
     try:
-        # Create the agent if it doesn't exist
-        if research_agent is None:
-            research_agent = WebResearchAgent()
+        agent = get_research_agent()
+        # Cached reports say nothing about load; keep them out of the latency signal
+        fast_path = not session_id and agent.has_cached_report(query, **(depth_options or {}))
 
         # Check memory usage before processing - optimized for Vercel (1026MB RAM)
+        import psutil  # Imported on first use to keep cold start fast
         process = psutil.Process()
         memory_info = process.memory_info()
         memory_usage_mb = memory_info.rss / (1024 * 1024)
@@ -36,52 +119,137 @@ def process_request(query, result_queue):
             gc.collect()  # Force garbage collection
 
         # Continue with normal processing
-        agent = WebResearchAgent()
-        result = agent.research(query)
-        result_queue.put({"success": True, "result": result})
+        profile_id = None
+        if profile_mode:
+            result, profile_id = profiles.run(profile_mode, query, agent.research, query, session_id=session_id,
+                                              **(depth_options or {}))
+        else:
+            result = agent.research(query, session_id=session_id, **(depth_options or {}))
+        failed = result.startswith("An error occurred")
+        fast_path = fast_path or result == SEARCH_UNAVAILABLE_MESSAGE
+        result_queue.put({"success": True, "result": result, "profile_id": profile_id})
     except Exception as e:
+        failed = True
         result_queue.put({"success": False, "error": str(e)})
     finally:
         # Force garbage collection
         gc.collect()
-        # Decrement active workers
-        active_workers -= 1  # Only decrement once
+        # Release the slot (only here, even if the request timed out)
+        if ticket is not None:
+            admission.release(ticket, failed=failed, measured=not fast_path)
 
 @app.route('/research', methods=['POST'])
 def perform_research():
-    global active_workers
-
+    arrived = time.time()
     query = request.json.get('query', '')
     if not query:
         return jsonify({'error': 'Query is required'}), 400
+    # Optional: follow-up queries in the same session reuse gathered sources
+    session_id = request.json.get('session_id')
+    if session_id is not None and (not isinstance(session_id, str) or len(session_id) > 100):
+        return jsonify({'error': 'session_id must be a string of at most 100 characters'}), 400
+    # Optional: "depth" ("quick", "standard", "deep") and "overrides" ({limit: value}) trade speed for thoroughness
+    depth_options = {key: request.json[key] for key in ('depth', 'overrides') if request.json.get(key) is not None}
+    try:
+        resolve_depth(**depth_options)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    scheduler = get_prefetcher()
+    if scheduler is not None and not session_id and not depth_options:
+        scheduler.record(query)
+    _start_sampling()
+    # Profile this run if an admin asked for it, by header or by arming the next requests
+    profile_mode = request.headers.get('X-Profile')
+    if profile_mode not in ProfileStore.MODES or not _is_admin():
+        profile_mode = profiles.take_armed()
 
-    # Check if we can handle more requests
-    if active_workers >= max_workers:
-        return jsonify({'error': 'Server is currently processing too many requests. Please try again later.'}), 429
+    # Claim a slot, waiting briefly in the queue if the worker is at its limit
+    ticket = admission.acquire(timeout=queue_timeout)
+    if ticket is None:
+        return (jsonify({'error': 'Server is currently processing too many requests. Please try again later.'}), 429,
+                {'Retry-After': str(admission.retry_after())})
 
     # Create a result queue for this request
     result_queue = queue.Queue()
 
-    # Increment active workers
-    active_workers += 1
-
     # Start worker thread
-    worker = threading.Thread(target=process_request, args=(query, result_queue))
+    worker = threading.Thread(target=process_request,
+                              args=(query, result_queue, session_id, ticket, profile_mode, depth_options))
     worker.daemon = True
     worker.start()
 
     # Wait for result with timeout - increased for Vercel environment
     try:
-        result = result_queue.get(timeout=180)  # Increased timeout for Vercel (60s platform limit)
+        result = result_queue.get(timeout=max(request_timeout - (time.time() - arrived), 1))
         if result["success"]:
-            return jsonify({'result': result["result"]})
+            response = {'result': result["result"]}
+            if session_id:
+                response['session_id'] = session_id
+            if result.get("profile_id"):
+                response['profile_id'] = result["profile_id"]
+            return jsonify(response)
         else:
             return jsonify({'error': result["error"]}), 500
     except queue.Empty:
-        # Timeout occurred
-        active_workers -= 1  # Decrement since we're abandoning this request
+        # Timeout occurred; the worker thread releases its slot when it finishes
         return jsonify({'error': 'Request timed out. Please try again with a simpler query.'}), 504
 
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+def admin_profiling():
+    """
+    Profiling controls. POST {"requests": N, "mode": "cprofile"|"sample"}
+    profiles the next N research requests; {"sampling": true|false}
+    starts or stops the always-on stack sampler
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if 'requests' in data:
+            mode = data.get('mode', 'cprofile')
+            if mode not in ProfileStore.MODES or not isinstance(data['requests'], int):
+                return jsonify({'error': 'requests must be an integer and mode one of cprofile, sample'}), 400
+            profiles.arm(data['requests'], mode)
+        if 'sampling' in data:
+            if data['sampling']:
+                get_stack_sampler().start()
+            else:
+                get_stack_sampler().stop()
+    return jsonify({'armed': profiles.armed, 'mode': profiles.armed_mode,
+                    'sampler': get_stack_sampler().snapshot(), 'profiles': profiles.list()})
+
+@app.route('/admin/profiles/<profile_id>')
+def admin_profile(profile_id):
+    """
+    A stored profile: pstats file (cprofile; ?format=text for a summary)
+    or collapsed stacks (sample)
+    """
+    denied = _admin_denied()
+    if denied:
+        return denied
+    profile = profiles.get(profile_id)
+    if profile is None:
+        return jsonify({'error': 'Profile not found'}), 404
+    if profile['mode'] == 'sample':
+        return Response(profile['data'], mimetype='text/plain')
+    if request.args.get('format') == 'text':
+        return Response(profile['summary'], mimetype='text/plain')
+    return Response(profile['data'], mimetype='application/octet-stream',
+                    headers={'Content-Disposition': f'attachment; filename=research-{profile_id}.prof'})
+
+@app.route('/admin/stacks')
+def admin_stacks():
+    """Hot stacks from the always-on sampler in collapsed format; ?reset=1 starts a new window"""
+    denied = _admin_denied()
+    if denied:
+        return denied
+    sampler = get_stack_sampler()
+    collapsed = sampler.collapsed()
+    if request.args.get('reset'):
+        sampler.reset()
+    return Response(collapsed, mimetype='text/plain')
+
 if __name__ == '__main__':
     port = int(os.environ.get("PORT", 8080))
     app.run(host='0.0.0.0', port=port, debug=False)  # Set debug to False in production
@@ -0,0 +1,161 @@
+"""
+ASGI entry point: the asyncio serving mode
+
+Serves the same / and /research routes as the Flask app (app.py, still the
+default) from one event loop, backed by AsyncWebResearchAgent. Requests
+waiting on SerpAPI, Gemini or remote sites don't hold a thread, so one
+process can keep hundreds of them in flight.
+
+Run with any ASGI server, e.g.:
+    pip install uvicorn aiohttp
+    uvicorn asgi:app --port 8080
+"""
+import asyncio
+import hmac
+import json
+import os
+from async_agent import AsyncWebResearchAgent
+from depth import resolve_depth
+from llm import llm_stats
+from resilience import breaker_stats
+from domain_stats import get_domain_stats
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "index.html")
+
+# Requests in flight, across the whole process
+active_requests = 0
+max_requests = int(os.getenv("ASGI_MAX_CONCURRENT", 200))
+request_timeout = 180  # Seconds, as the Flask app
+max_body_size = 64 * 1024
+
+# One agent for the process; everything runs on the event loop, so no lock is needed
+research_agent = None
+
+def get_research_agent():
+    """Return the process's AsyncWebResearchAgent, creating it on first use"""
+    global research_agent
+    if research_agent is None:
+        research_agent = AsyncWebResearchAgent()
+    return research_agent
+
+async def _send_response(send, status, body, content_type):
+    await send({"type": "http.response.start", "status": status,
+                "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+async def _send_json(send, status, data):
+    await _send_response(send, status, json.dumps(data).encode("utf-8"), b"application/json")
+
+async def _read_body(receive):
+    """Read the request body; None if it is larger than max_body_size"""
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return body
+        body += message.get("body", b"")
+        if len(body) > max_body_size:
+            return None
+        if not message.get("more_body"):
+            return body
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if research_agent is not None:
+                await research_agent.aclose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def research(receive, send):
+    """POST /research: same request and response format as the Flask route"""
+    global active_requests
+
+    body = await _read_body(receive)
+    if body is None:
+        await _send_json(send, 413, {'error': 'Request body too large'})
+        return
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        await _send_json(send, 400, {'error': 'Request body must be a JSON object'})
+        return
+
+    query = data.get('query', '')
+    if not query:
+        await _send_json(send, 400, {'error': 'Query is required'})
+        return
+    session_id = data.get('session_id')
+    if session_id is not None and (not isinstance(session_id, str) or len(session_id) > 100):
+        await _send_json(send, 400, {'error': 'session_id must be a string of at most 100 characters'})
+        return
+    depth_options = {key: data[key] for key in ('depth', 'overrides') if data.get(key) is not None}
+    try:
+        resolve_depth(**depth_options)
+    except ValueError as e:
+        await _send_json(send, 400, {'error': str(e)})
+        return
+
+    if active_requests >= max_requests:
+        await _send_json(send, 429, {'error': 'Server is currently processing too many requests. Please try again later.'})
+        return
+
+    active_requests += 1
+    try:
+        result = await asyncio.wait_for(get_research_agent().aresearch(query, session_id=session_id, **depth_options),
+                                        timeout=request_timeout)
+    except asyncio.TimeoutError:
+        await _send_json(send, 504, {'error': 'Request timed out. Please try again with a simpler query.'})
+        return
+    except Exception as e:
+        await _send_json(send, 500, {'error': str(e)})
+        return
+    finally:
+        active_requests -= 1
+
+    response = {'result': result}
+    if session_id:
+        response['session_id'] = session_id
+    await _send_json(send, 200, response)
+
+def _admin_denied(scope):
+    """(status, error) for admin-only routes, as the Flask app's check, or None if the request may proceed"""
+    token = os.getenv("ADMIN_TOKEN")
+    if not token:
+        return 404, {'error': 'Not found'}  # Admin routes are off without a token
+    supplied = dict(scope.get("headers") or []).get(b"authorization", b"")
+    if not hmac.compare_digest(supplied, f"Bearer {token}".encode()):
+        return 403, {'error': 'Forbidden'}
+    return None
+
+async def app(scope, receive, send):
+    """The ASGI application"""
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    if scope["type"] != "http":
+        return
+
+    path, method = scope["path"], scope["method"]
+    if path == "/" and method in ("GET", "HEAD"):
+        with open(TEMPLATE_PATH, "rb") as f:
+            await _send_response(send, 200, f.read(), b"text/html; charset=utf-8")
+    elif path == "/stats" and method == "GET":
+        denied = _admin_denied(scope)
+        if denied:
+            await _send_json(send, *denied)
+            return
+        await _send_json(send, 200, {'llm': llm_stats(), 'breakers': breaker_stats(),
+                                     'domains': get_domain_stats().snapshot(),
+                                     'active_requests': active_requests})
+    elif path == "/research" and method == "POST":
+        await research(receive, send)
+    elif path in ("/", "/stats", "/research"):
+        await _send_json(send, 405, {'error': 'Method not allowed'})
+    else:
+        await _send_json(send, 404, {'error': 'Not found'})
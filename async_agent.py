@@ -0,0 +1,329 @@
+import asyncio
+from agent import WebResearchAgent, ResearchContext, SEARCH_UNAVAILABLE_MESSAGE
+from resilience import CircuitOpenError, set_retry_budget, reset_retry_budget
+from depth import set_depth_limits, reset_depth_limits
+from utils import AsyncIntervalLimiter, aapply_shared_rate_limit, normalize_query
+
+class AsyncWebResearchAgent(WebResearchAgent):
+    """
+    asyncio version of the research pipeline, used by the ASGI app (asgi.py)
+
+    Same configuration, tools, sessions and knowledge index as
+    WebResearchAgent, but searches, page fetches and Gemini calls are
+    awaited instead of holding a thread, so one process can keep hundreds
+    of research requests in flight. Web requests use aiohttp; HTML parsing
+    runs in the default executor (or the parsing pool when enabled), as do
+    the other blocking steps: knowledge index lookups, domain stats ranking
+    and saves, and packing the synthesis context. No per-step gc.collect():
+    with many requests on one loop, full collections would stall all of them.
+    """
+    def __init__(self):
+        super().__init__()
+        self.api_limiter = AsyncIntervalLimiter()
+        self.http_session = None  # aiohttp.ClientSession, created inside the serving loop
+        self.max_connections = 100  # Open connections to remote sites, across all requests
+
+    async def _http(self):
+        """The shared aiohttp session, created on first use"""
+        if self.http_session is None or self.http_session.closed:
+            import aiohttp  # Only the asyncio serving mode needs it
+            self.http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.max_connections))
+        return self.http_session
+
+    async def aclose(self):
+        """Close the HTTP session (on server shutdown)"""
+        if self.http_session is not None:
+            await self.http_session.close()
+            self.http_session = None
+
+    async def _arate_limit(self):
+        """asyncio version of _rate_limit"""
+        await self.api_limiter.wait(self.min_api_interval)
+        # Respect limits shared with other processes (bulk CLI workers)
+        await aapply_shared_rate_limit("gemini")
+
+    async def aanalyze_query(self, query, previous_queries=None):
+        """asyncio version of analyze_query"""
+        if self._llm_unavailable():
+            print("Gemini unavailable, using fallback query analysis")
+            return self._fallback_analysis(query)
+        try:
+            await self._arate_limit()
+            prompt = self._analysis_prompt(query, previous_queries)
+            response = await self.llm.agenerate(prompt, timeout=self.analysis_timeout)
+            return self._parse_analysis(response.text, query)
+        except Exception as e:
+            print(f"Error analyzing query: {e}")
+            return self._fallback_analysis(query)
+
+    async def asearch_web(self, search_terms, is_news=False, query="", num_results=None, start=0):
+        """asyncio version of search_web; terms are searched concurrently (the tools pace SerpAPI calls)"""
+        if num_results is None:
+            params = self._adjust_search_parameters(query) or {}
+            num_results = params.get("max_results_per_term", self.max_results_per_term)
+
+        # Add null check for search_terms
+        if not search_terms or not isinstance(search_terms, list):
+            search_terms = [query]
+
+        session = await self._http()
+        search_down = self.web_search.breaker.is_open()
+
+        async def search_term(term):
+            cache_key = (normalize_query(term), is_news, num_results, start)
+            term_results = self.search_cache.get(cache_key)
+            if term_results is None and search_down:
+                print(f"Search unavailable, skipping '{term}'")
+            elif term_results is None:
+                if is_news:
+                    search = self.news_aggregator.aget_news(term, max_results=num_results, session=session)
+                elif start:
+                    search = self.web_search.asearch(term, num_results=num_results, session=session, start=start)
+                else:
+                    search = self.web_search.asearch(term, num_results=num_results, session=session)
+                term_results = await search
+                self._cache_search(cache_key, term_results)
+            return term_results
+
+        results = []
+        for term_results in await asyncio.gather(*[search_term(term) for term in search_terms if term]):
+            results.extend(r for r in term_results or [] if isinstance(r, dict))
+        return self._dedupe_results(results)
+
+    async def aextract_content(self, search_results, query, min_relevance=None, key_aspects=None, scraped_pages=None,
+                               quorum=None):
+        """
+        asyncio version of extract_content
+
+        Keeps the same over-provisioning: (still needed + scrape_overprovision)
+        candidates in flight, at most scrape_concurrency, and the stragglers
+        are cancelled once max_extracted_sources are gathered or the quorum is reached.
+        """
+        if min_relevance is None:
+            min_relevance = self.min_relevance_score
+
+        extracted_data = []
+        # Threads started by to_thread copy the context, and with it the request's limits
+        candidates = iter(await asyncio.to_thread(self._rank_candidates, search_results))
+        pending = set()
+        try:
+            while True:
+                wanted = self.max_extracted_sources - len(extracted_data) + self.scrape_overprovision
+                while len(pending) < min(wanted, self.scrape_concurrency):
+                    result = next(candidates, None)
+                    if result is None:
+                        break
+                    pending.add(asyncio.ensure_future(
+                        self._aextract_one(result, query, min_relevance, key_aspects, scraped_pages)))
+
+                if not pending:
+                    break
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    item = task.result()
+                    if item is not None:
+                        extracted_data.append(item)
+
+                if len(extracted_data) >= self.max_extracted_sources or self._quorum_reached(extracted_data, quorum):
+                    if pending:
+                        print(f"Gathered {len(extracted_data)} sources, cancelling {len(pending)} stragglers")
+                    break
+        finally:
+            # In-flight fetches stop; Gemini calls already running finish in the client's threads
+            for task in pending:
+                task.cancel()
+
+        extracted_data.sort(key=lambda x: x["relevance_score"], reverse=True)
+        return extracted_data[:self.max_extracted_sources]
+
+    async def _aextract_one(self, result, query, min_relevance, key_aspects, scraped_pages=None):
+        """asyncio version of _extract_one"""
+        try:
+            url = result["link"]
+            if result.get("content"):
+                # Already scraped earlier in the session, or from the knowledge index
+                scraped_data = {"title": result.get("title", ""), "content": result["content"]}
+            else:
+                scraped_data = await self.web_scraper.ascrape(url, await self._http())
+                if scraped_data["content"] and scraped_pages is not None:
+                    scraped_pages.append({"url": url, "title": scraped_data["title"],
+                                          "content": scraped_data["content"]})
+
+            if not scraped_data["content"]:
+                return None
+
+            analysis = await self.content_analyzer.aanalyze(scraped_data["content"], query,
+                                                            min_relevance=min_relevance,
+                                                            key_aspects=key_aspects)
+            # May write the stats file
+            await asyncio.to_thread(self.web_scraper.domain_stats.record_relevance, url,
+                                    analysis.get("relevance_score", 0))
+
+            if analysis.get("relevance_score", 0) < min_relevance:
+                return None
+
+            return {
+                "title": scraped_data["title"],
+                "url": url,
+                "content": analysis.get("relevant_content", ""),
+                "relevance_score": analysis.get("relevance_score", 0),
+                "source_quality": analysis.get("source_quality", 5),
+                "scored_by": analysis.get("scored_by", "llm")
+            }
+        except Exception as e:
+            print(f"Error extracting {result.get('link', '')}: {e}")
+            return None
+
+    async def _adeepen_search(self, context, sources):
+        """asyncio version of _deepen_search"""
+        while self._needs_deeper_search(context, sources):
+            terms, start = self._next_search_round(context, sources)
+            results = self._new_results(context, await self.asearch_web(terms, query=context.query,
+                                                                        num_results=self.initial_results_per_term,
+                                                                        start=start))
+            self._record_search_round(context, terms, results)
+            if not results:
+                print("No new results, stopping the deeper search")
+                break
+            new_sources = await self.aextract_content(results, context.model_query,
+                                                      min_relevance=context.min_relevance,
+                                                      key_aspects=context.key_aspects,
+                                                      scraped_pages=context.scraped_pages,
+                                                      quorum=self.quorum.get(context.query_type))
+            sources = self._merge_sources(sources, new_sources)
+        return sources
+
+    async def asynthesize_information(self, extracted_data, query):
+        """asyncio version of synthesize_information"""
+        try:
+            if not extracted_data:
+                return "I couldn't find relevant information for your query. Please try with different search terms."
+            if self._llm_unavailable():
+                return self._degraded_report(extracted_data)
+
+            await self._arate_limit()
+            extracted_data = extracted_data[:self.max_extracted_sources]
+            prompt = await asyncio.to_thread(self._synthesis_prompt, extracted_data, query)
+            response = await self.llm.agenerate(prompt, timeout=self.synthesis_timeout)
+            return self._with_sources(response.text, extracted_data)
+        except CircuitOpenError:
+            return self._degraded_report(extracted_data)
+        except Exception as e:
+            print(f"Error synthesizing information: {e}")
+            return "Failed to synthesize information due to an error."
+
+    async def aresearch(self, query, session_id=None, depth=None, overrides=None):
+        """asyncio version of research, with the same steps and arguments"""
+        # Tasks started below copy the context, and with it the limits and retry budget
+        depth_token = set_depth_limits(self._depth_limits(depth, overrides))
+        budget_token = set_retry_budget(self.retry_budget)
+        try:
+            session = self.sessions.get(session_id) if session_id else {"queries": [], "pages": []}
+            context = ResearchContext(query, previous_queries=session["queries"])
+            model_query = context.model_query
+
+            cached_report = None if context.previous_queries else self.report_cache.get(self._report_key(query))
+            if cached_report is not None:
+                if session_id:
+                    self.sessions.add(session_id, query, [])
+                return cached_report
+
+            # Search the raw query while the analysis runs (no speculative scrape in this mode)
+            speculation = None
+            if (self.speculative_search and not context.previous_queries
+                    and await asyncio.to_thread(self._should_speculate, context)):
+                self._count_speculation("searches")
+                speculation = asyncio.ensure_future(self.asearch_web([query], is_news=False, query=query,
+                                                                     num_results=self.initial_results_per_term))
+
+            # Step 1: Analyze the query
+            with context.timed("analyze_query"):
+                context.analysis = await self.aanalyze_query(query, previous_queries=context.previous_queries)
+            self._plan_search(context)
+
+            # Follow-ups: answer from the session's pages first
+            session_data = []
+            if session["pages"]:
+                with context.timed("session"):
+                    session_data = await self.aextract_content(self._session_results(session), model_query,
+                                                               min_relevance=context.min_relevance,
+                                                               key_aspects=context.key_aspects)
+                self._narrow_search_to_session(context, session_data)
+
+            # Then the local knowledge index
+            index_data = []
+            if context.search_terms and self.knowledge_index is not None:
+                with context.timed("knowledge_index"):
+                    index_results = await asyncio.to_thread(self._search_knowledge_index, context)
+                    if len(index_results) >= self.knowledge_min_sources:
+                        index_data = await self.aextract_content(index_results, model_query,
+                                                                 min_relevance=context.min_relevance,
+                                                                 key_aspects=context.key_aspects)
+                if len(index_data) >= self.knowledge_min_sources:
+                    print(f"Knowledge index supplied {len(index_data)} sources, skipping web search")
+                    context.search_terms = []
+
+            # Step 2: Search
+            search_results = []
+            with context.timed("search"):
+                web_terms = self._speculative_terms(context, speculation)
+                if not context.search_terms:
+                    print("Gathered material covers the query, skipping search")
+                    self._discard_speculation(speculation)
+                    speculation = None
+                elif context.is_sports_query:
+                    # For sports queries, also search news sources (prioritized)
+                    searches = [self.asearch_web(context.search_terms, is_news=True, query=query)]
+                    if web_terms:
+                        searches.append(self.asearch_web(web_terms, is_news=False, query=query,
+                                                         num_results=self.initial_results_per_term))
+                    search_results = self._dedupe_results([r for results in await asyncio.gather(*searches)
+                                                           for r in results])
+                elif web_terms:
+                    search_results = await self.asearch_web(web_terms, is_news=False, query=query,
+                                                            num_results=self.initial_results_per_term)
+
+                if speculation is not None:
+                    try:
+                        speculative_results = await asyncio.wait_for(speculation, self.speculation_timeout)
+                    except Exception as e:
+                        print(f"Speculative search failed: {e}")
+                        speculative_results = []
+                    search_results = self._merge_speculation(context, search_results, speculative_results, None)
+                self._record_search_round(context, context.search_terms, search_results)
+
+            # Step 3: Extract and analyze content
+            with context.timed("extract"):
+                extracted_data = await self.aextract_content(search_results, model_query,
+                                                             min_relevance=context.min_relevance,
+                                                             key_aspects=context.key_aspects,
+                                                             scraped_pages=context.scraped_pages,
+                                                             quorum=self.quorum.get(context.query_type))
+
+            extracted_data = self._merge_sources(session_data + index_data, extracted_data)
+            self._settle_speculation(context, extracted_data)
+
+            # Search deeper only if too few sources passed the relevance threshold
+            if context.search_terms:
+                with context.timed("deepen"):
+                    extracted_data = await self._adeepen_search(context, extracted_data)
+            if session_id:
+                self.sessions.add(session_id, query, context.scraped_pages)
+
+            # Step 4: Synthesize information
+            if not extracted_data and self.web_search.breaker.is_open():
+                return SEARCH_UNAVAILABLE_MESSAGE
+            if not extracted_data:
+                return "I couldn't find relevant information for your query. Please try with different search terms."
+            with context.timed("synthesize"):
+                report = await self.asynthesize_information(extracted_data, model_query)
+            print(f"Research timings: {context.timings}")
+            self._cache_report(context, report)
+            return report
+        except Exception as e:
+            print(f"Error in research process: {e}")
+            return f"An error occurred during the research process: {str(e)}"
+        finally:
+            reset_retry_budget(budget_token)
+            reset_depth_limits(depth_token)
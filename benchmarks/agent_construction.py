@@ -0,0 +1,72 @@
+"""
+Per-request agent cost benchmark
+
+Compares what each /research request paid before and after the agent was
+shared per worker:
+- original: a new WebResearchAgent per request, each building its own two
+  GenerativeModel objects (as the agent did before LLM clients were shared)
+- per request: a new WebResearchAgent per request with today's code
+- after: fetching the worker's shared agent via app.get_research_agent()
+
+Reports wall time and tracemalloc allocation churn (bytes and blocks
+allocated) per request. No network calls are made.
+
+Usage:
+    python benchmarks/agent_construction.py [--requests 200]
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def measure(label, get_agent, requests):
+    """Time and trace allocations of get_agent() over a number of requests"""
+    get_agent()  # Warm-up: lazy imports and shared clients are a one-off cost
+
+    start_time = time.perf_counter()
+    for _ in range(requests):
+        get_agent()
+    elapsed = time.perf_counter() - start_time
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    agents = [get_agent() for _ in range(requests)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    stats = after.compare_to(before, "filename")
+    allocated = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    blocks = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    del agents
+
+    print(f"{label:<28} {elapsed / requests * 1e6:10.1f} us/request "
+          f"{allocated / requests / 1024:10.2f} KiB/request {blocks / requests:10.1f} blocks/request")
+    return elapsed / requests
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark per-request agent construction vs. a shared agent")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    from agent import WebResearchAgent
+    import app
+    import google.generativeai as genai
+
+    def original_agent():
+        agent = WebResearchAgent()
+        agent.model = genai.GenerativeModel('gemini-1.5-flash')
+        agent.content_analyzer.model = genai.GenerativeModel('gemini-1.5-flash')
+        return agent
+
+    print(f"{args.requests} simulated requests")
+    measure("original (own models)", original_agent, args.requests)
+    per_request = measure("new agent per request", WebResearchAgent, args.requests)
+    shared = measure("shared agent per worker", app.get_research_agent, args.requests)
+    print(f"Shared agent saves {(per_request - shared) * 1e3:.3f} ms per request")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
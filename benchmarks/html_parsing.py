@@ -0,0 +1,91 @@
+"""
+HTML parsing throughput benchmark
+
+Simulates N request threads scraping concurrently and compares parsing
+the HTML in-thread (BeautifulSoup under the GIL) with handing it to the
+HTMLParsingPool. While parsing runs, a heartbeat thread sleeps in 5 ms
+steps and records how late it wakes up: a stand-in for how responsive the
+Flask worker stays for other requests. No network calls are made; pages
+are synthetic.
+
+Usage:
+    python benchmarks/html_parsing.py [--threads 4] [--pages 8]
+        [--page-kb 200] [--processes N]
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def make_page(size_kb, seed):
+    """A synthetic article page of roughly size_kb kilobytes"""
+    paragraph = (f"<div class='post'><p>Paragraph {seed} with <a href='/link'>a link</a>, "
+                 "<b>bold text</b> and some ordinary words about the research topic.</p></div>\n")
+    body = paragraph * (size_kb * 1024 // len(paragraph) + 1)
+    return f"<html><head><title>Page {seed}</title></head><body>{body}</body></html>".encode("utf-8")
+
+def run(label, parse, threads, pages):
+    """Parse threads x len(pages) documents from concurrent threads"""
+    stop = threading.Event()
+    lateness = []
+
+    def heartbeat():
+        while not stop.is_set():
+            start = time.perf_counter()
+            time.sleep(0.005)
+            lateness.append(time.perf_counter() - start - 0.005)
+
+    def worker():
+        for page in pages:
+            parse(page)
+
+    beat = threading.Thread(target=heartbeat)
+    beat.start()
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start_time = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start_time
+    stop.set()
+    beat.join()
+
+    total = threads * len(pages)
+    p99 = sorted(lateness)[int(len(lateness) * 0.99)] if lateness else 0.0
+    print(f"{label:<24} {total / elapsed:8.1f} pages/s  {elapsed:6.2f} s  "
+          f"heartbeat lateness median {statistics.median(lateness or [0]) * 1e3:6.1f} ms, p99 {p99 * 1e3:6.1f} ms")
+    return total / elapsed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark in-thread vs process-pool HTML parsing")
+    parser.add_argument("--threads", type=int, default=4, help="Concurrent scraping threads (default: 4)")
+    parser.add_argument("--pages", type=int, default=8, help="Pages parsed per thread (default: 8)")
+    parser.add_argument("--page-kb", type=int, default=200, help="Size of each page in KB (default: 200)")
+    parser.add_argument("--processes", type=int, default=None, help="Pool size (default: available CPUs)")
+    args = parser.parse_args(argv)
+
+    from parsing import HTMLParsingPool, parse_html, available_cpus
+
+    max_length = 2500  # Same limit as WebScraperTool
+    pages = [make_page(args.page_kb, i) for i in range(args.pages)]
+    pool = HTMLParsingPool(args.processes)
+    # Start the workers (and their bs4 import) before timing
+    pool.parse(pages[0], max_length)
+
+    print(f"{args.threads} threads x {args.pages} pages of {args.page_kb} KB; "
+          f"{available_cpus()} CPUs available, pool of {pool.max_workers}")
+    try:
+        in_thread = run("in-thread", lambda page: parse_html(page, max_length), args.threads, pages)
+        pooled = run("process pool", lambda page: pool.parse(page, max_length), args.threads, pages)
+    finally:
+        pool.shutdown()
+    print(f"Process pool throughput: {pooled / in_thread:.2f}x in-thread")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
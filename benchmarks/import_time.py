@@ -0,0 +1,104 @@
+"""
+Cold-start import benchmark
+
+Measures how long `import app` takes in a fresh interpreter using
+`python -X importtime`, which is what a Vercel cold start pays before the
+first request. Compares the median against a stored baseline and exits
+non-zero on a regression.
+
+Usage:
+    python benchmarks/import_time.py [--runs 7] [--module app]
+        [--tolerance 0.4] [--update-baseline]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baselines", "import_time.json")
+
+def measure(module, python=sys.executable):
+    """
+    Import a module in a fresh interpreter and collect -X importtime output
+
+    Returns:
+        tuple: (cumulative microseconds for the module, {module: cumulative us})
+    """
+    completed = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=ROOT, capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        # "import time:   self |   cumulative |   <indent>module"
+        _, total_us, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        cumulative[name] = int(total_us)
+    return cumulative.get(module), cumulative
+
+def load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark cold-start import time")
+    parser.add_argument("--module", default="app", help="Module to import (default: app)")
+    parser.add_argument("--runs", type=int, default=7, help="Fresh interpreters to measure (default: 7)")
+    parser.add_argument("--tolerance", type=float, default=0.4,
+                        help="Allowed slowdown over the baseline before failing (default: 0.4)")
+    parser.add_argument("--top", type=int, default=10, help="Heaviest top-level imports to list")
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the new baseline")
+    args = parser.parse_args(argv)
+
+    # One throwaway run so .pyc files are written and the OS cache is warm
+    measure(args.module)
+    totals = []
+    last_breakdown = {}
+    for _ in range(args.runs):
+        total, last_breakdown = measure(args.module)
+        totals.append(total)
+
+    median_ms = statistics.median(totals) / 1000
+    print(f"import {args.module}: median {median_ms:.1f} ms, min {min(totals) / 1000:.1f} ms over {args.runs} runs")
+
+    print("Heaviest imports (cumulative, last run):")
+    heaviest = sorted(((us, name) for name, us in last_breakdown.items() if name != args.module), reverse=True)
+    shown = []
+    for us, name in heaviest:
+        # One line per top-level package
+        package = name.split(".")[0]
+        if package in shown:
+            continue
+        shown.append(package)
+        print(f"  {us / 1000:8.1f} ms  {name}")
+        if len(shown) >= args.top:
+            break
+
+    baselines = load_baseline()
+    if args.update_baseline:
+        baselines[args.module] = round(median_ms, 1)
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline updated: {median_ms:.1f} ms")
+        return 0
+
+    baseline_ms = baselines.get(args.module)
+    if baseline_ms is None:
+        print("No baseline stored; run with --update-baseline to create one")
+        return 0
+
+    limit_ms = baseline_ms * (1 + args.tolerance)
+    print(f"Baseline {baseline_ms:.1f} ms, limit {limit_ms:.1f} ms")
+    if median_ms > limit_ms:
+        print(f"REGRESSION: import {args.module} is {median_ms / baseline_ms - 1:.0%} slower than the baseline")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
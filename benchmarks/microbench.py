@@ -0,0 +1,179 @@
+"""
+Microbenchmarks for the CPU-bound steps every request runs
+
+Times JSON extraction from model responses (the agent's, the content
+analyzer's and utils.extract_json_from_text), HTML-to-text, chunking,
+search-result dedup, sports/time-sensitivity keyword scans and context
+packing over the fixture corpus in benchmarks/fixtures (HTML pages and
+Gemini responses). No network calls are made.
+
+Each benchmark runs one pass over its inputs. Passes are timed with
+timeit in batches of at least --min-time seconds, with the garbage
+collector off, and the batch is repeated --repeat times; the fastest batch
+is the result (the least disturbed by other processes), the median is
+shown for spread. Results are compared with the stored baseline and any
+benchmark slower than it by more than --tolerance is flagged; the exit
+status is 1 if any is. Baselines are only comparable on the same machine
+and Python version, which are stored with them.
+
+Usage:
+    python benchmarks/microbench.py [--filter json] [--repeat 7]
+        [--min-time 0.2] [--tolerance 0.25] [--update-baseline]
+"""
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import timeit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+FIXTURES = os.path.join(ROOT, "benchmarks", "fixtures")
+BASELINE_PATH = os.path.join(ROOT, "benchmarks", "baselines", "microbench.json")
+
+QUERIES = [
+    "who won the IPL match last night",
+    "latest news on solar panel subsidies",
+    "how do solar panels work",
+    "history of the printing press",
+    "NBA finals score today",
+    "What are the health effects of intermittent fasting?",
+]
+
+def load_corpus():
+    """HTML pages (bytes, as fetched), their text as the scraper keeps it and model responses"""
+    pages = []
+    for path in sorted(glob.glob(os.path.join(FIXTURES, "pages", "*.html"))):
+        with open(path, "rb") as f:
+            pages.append(f.read())
+    with open(os.path.join(FIXTURES, "llm_responses.jsonl"), encoding="utf-8") as f:
+        responses = [json.loads(line) for line in f if line.strip()]
+
+    from parsing import parse_html
+    from tools import WebScraperTool
+    max_length = WebScraperTool().max_content_length
+    texts = [parse_html(page, max_length)["content"] for page in pages]
+    return {"pages": pages, "texts": texts, "responses": responses}
+
+def build_benchmarks(corpus):
+    """Benchmark name -> zero-argument callable running one pass over its inputs"""
+    from agent import WebResearchAgent, ResearchContext
+    from tools import ContentAnalyzerTool, WebScraperTool
+    from parsing import parse_html
+    from utils import extract_json_from_text, pack_context
+
+    agent = WebResearchAgent()
+    analyzer = ContentAnalyzerTool()
+    max_length = WebScraperTool().max_content_length
+    analysis_texts = [r["text"] for r in corpus["responses"] if r["kind"] == "analysis"]
+    content_texts = [r["text"] for r in corpus["responses"] if r["kind"] == "content"]
+    all_texts = analysis_texts + content_texts
+
+    # Search results as several terms return them: overlapping links, a few malformed entries
+    results = []
+    for term in range(4):
+        for i in range(12):
+            results.append({"link": f"https://site{(i + term * 3) % 20}.example.com/article/{i % 7}",
+                            "title": f"Result {i}", "snippet": "A snippet of text " * 5})
+        results.append(None)
+        results.append({"title": "no link"})
+
+    # Extracted sources as synthesis gets them (relevant_content is capped at 2000 characters)
+    sources = [{"title": f"Source {i}", "url": f"https://site{i}.example.com", "content": text[:2000],
+                "relevance_score": 9 - i, "source_quality": 6}
+               for i, text in enumerate(corpus["texts"] * 2)]
+
+    return {
+        "json_extract.utils": lambda: [extract_json_from_text(text) for text in all_texts],
+        "json_extract.query_analysis": lambda: [agent._parse_analysis(text, "solar panel costs") for text in analysis_texts],
+        "json_extract.content_analysis": lambda: [analyzer._parse_analysis(text) for text in content_texts],
+        "html_to_text": lambda: [parse_html(page, max_length) for page in corpus["pages"]],
+        "chunking": lambda: [analyzer._prepare(text, query) for text in corpus["texts"] for query in QUERIES[:2]],
+        "url_dedup": lambda: agent._dedupe_results(results),
+        "keyword_scan": lambda: [ResearchContext(query) for query in QUERIES],
+        "pack_context": lambda: pack_context(sources, agent.synthesis_token_budget),
+    }
+
+def measure(func, repeat=7, min_time=0.2):
+    """
+    Time func with timeit: batches of at least min_time seconds, repeated
+
+    Returns:
+        tuple: (fastest, median) microseconds per call
+    """
+    # Chunking logs each call; keep the terminal out of the measurement
+    with contextlib.redirect_stdout(io.StringIO()):
+        timer = timeit.Timer(func)
+        number, elapsed = timer.autorange()
+        number = max(number, int(number * min_time / elapsed)) if elapsed else number
+        timings = [t / number * 1e6 for t in timer.repeat(repeat=repeat, number=number)]
+    return min(timings), statistics.median(timings)
+
+def machine():
+    return f"{platform.machine()} {platform.processor() or platform.system()} / Python {platform.python_version()}"
+
+def load_baseline():
+    if not os.path.exists(BASELINE_PATH):
+        return {}
+    with open(BASELINE_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Microbenchmarks for CPU-bound request steps")
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=7, help="Timed batches per benchmark (default: 7)")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per batch (default: 0.2)")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown over the baseline before flagging (default: 0.25)")
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the new baseline")
+    args = parser.parse_args(argv)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        benchmarks = build_benchmarks(load_corpus())
+    baseline = load_baseline()
+    baseline_results = baseline.get("results", {})
+    if baseline and baseline.get("machine") != machine():
+        print(f"Baseline was taken on {baseline.get('machine')}; this is {machine()}. Differences may be the machine's.")
+
+    results = {}
+    regressions = []
+    print(f"{'benchmark':<32} {'fastest us':>12} {'median us':>12} {'baseline':>12} {'change':>8}")
+    for name, func in benchmarks.items():
+        if args.filter not in name:
+            continue
+        fastest, median = measure(func, args.repeat, args.min_time)
+        results[name] = round(fastest, 2)
+
+        before = baseline_results.get(name)
+        change = ""
+        flag = ""
+        if before:
+            ratio = fastest / before - 1
+            change = f"{ratio:+.0%}"
+            if ratio > args.tolerance:
+                flag = "  REGRESSION"
+                regressions.append(name)
+        print(f"{name:<32} {fastest:12.2f} {median:12.2f} {before or '-':>12} {change:>8}{flag}")
+
+    if args.update_baseline:
+        baseline_results.update(results)
+        os.makedirs(os.path.dirname(BASELINE_PATH), exist_ok=True)
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump({"machine": machine(), "results": baseline_results}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline updated for {len(results)} benchmarks")
+        return 0
+
+    if regressions:
+        print(f"REGRESSION beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
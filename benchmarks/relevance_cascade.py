@@ -0,0 +1,107 @@
+"""
+Relevance cascade benchmark
+
+Compares the local relevance cascade against a full-LLM baseline: how many
+Gemini analysis calls the cascade avoids, and how often its local
+keep/discard decisions agree with the LLM's.
+
+Usage:
+    python benchmarks/relevance_cascade.py [samples.jsonl] [--live]
+        [--reject-below 1.5] [--accept-above 7.5] [--min-relevance 5]
+
+Each sample line has "query", "text", optional "key_aspects" and a
+"baseline_score" from the full-LLM analysis. With --live, samples missing a
+baseline_score are scored by ContentAnalyzerTool with the cascade disabled
+(requires GEMINI_API_KEY). The checked-in fixture is hand-labelled; refresh
+it with real LLM scores from your own traffic for meaningful numbers.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from relevance import LocalRelevanceScorer
+
+DEFAULT_SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "relevance_samples.jsonl")
+
+def load_samples(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def run(samples, scorer, min_relevance=5, live=False):
+    """
+    Run the cascade over samples and compare against the LLM baseline
+
+    Returns:
+        dict: Decision counts, LLM call reduction and agreement rates
+    """
+    analyzer = None
+    counts = {"accept": 0, "reject": 0, "escalate": 0}
+    local_decided = 0
+    local_agreed = 0
+    local_time = 0.0
+
+    for sample in samples:
+        if "baseline_score" not in sample:
+            if not live:
+                raise ValueError("Sample without baseline_score; rerun with --live")
+            if analyzer is None:
+                from tools import ContentAnalyzerTool
+                analyzer = ContentAnalyzerTool()
+                analyzer.cascade = None
+                analyzer.stream_analysis = False
+            sample["baseline_score"] = analyzer.analyze(sample["text"], sample["query"]).get("relevance_score", 0)
+
+        start_time = time.perf_counter()
+        decision = scorer.assess(sample["text"], sample["query"], sample.get("key_aspects"))["decision"]
+        local_time += time.perf_counter() - start_time
+        counts[decision] += 1
+
+        if decision == "escalate":
+            continue
+        local_decided += 1
+        baseline_keep = sample["baseline_score"] >= min_relevance
+        if (decision == "accept") == baseline_keep:
+            local_agreed += 1
+
+    total = len(samples)
+    return {
+        "samples": total,
+        "decisions": counts,
+        "llm_calls_baseline": total,
+        "llm_calls_cascade": counts["escalate"],
+        "llm_call_reduction": (total - counts["escalate"]) / total if total else 0.0,
+        # Agreement on the pages decided locally
+        "local_agreement": local_agreed / local_decided if local_decided else 1.0,
+        # Share of all pages the cascade decided and got right; escalated pages don't count as agreement
+        "overall_agreement": local_agreed / total if total else 1.0,
+        "local_ms_per_page": 1000 * local_time / total if total else 0.0
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the local relevance cascade against the LLM baseline")
+    parser.add_argument("samples", nargs="?", default=DEFAULT_SAMPLES)
+    parser.add_argument("--live", action="store_true", help="Score samples without a baseline_score with Gemini")
+    parser.add_argument("--reject-below", type=float, default=None)
+    parser.add_argument("--accept-above", type=float, default=None)
+    parser.add_argument("--min-relevance", type=float, default=5)
+    args = parser.parse_args(argv)
+
+    scorer = LocalRelevanceScorer(reject_below=args.reject_below, accept_above=args.accept_above)
+    report = run(load_samples(args.samples), scorer, min_relevance=args.min_relevance, live=args.live)
+
+    print(f"Bands: reject < {scorer.reject_below}, accept >= {scorer.accept_above}")
+    print(f"Samples:            {report['samples']}")
+    print(f"Decisions:          {report['decisions']}")
+    print(f"LLM calls:          {report['llm_calls_cascade']} (baseline {report['llm_calls_baseline']})")
+    print(f"LLM call reduction: {report['llm_call_reduction']:.1%}")
+    print(f"Local agreement:    {report['local_agreement']:.1%}")
+    print(f"Overall agreement:  {report['overall_agreement']:.1%}")
+    print(f"Local scoring:      {report['local_ms_per_page']:.3f} ms/page")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
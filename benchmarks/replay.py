@@ -0,0 +1,185 @@
+"""
+Record/replay workload benchmark
+
+Records the upstream traffic (SerpAPI, page fetches, Gemini) of running a
+file of real queries into a cassette, then replays the same queries
+offline against it, with the original or scaled latencies, and reports
+pipeline latency, upstream call counts and memory. Reports can be
+compared to see what a change did to the same workload.
+
+Usage:
+    python benchmarks/replay.py record queries.jsonl day.cassette.gz
+    python benchmarks/replay.py replay queries.jsonl day.cassette.gz
+        [--latency-scale 1.0] [--concurrency 1] [--report after.json]
+        [--compare before.json]
+    python benchmarks/replay.py {record,replay} queries.jsonl depths.cassette.gz
+        --depth quick,standard,deep
+
+Queries use the bulk_research.py format (one {"id", "query"} object or
+string per line). Recording needs SERPAPI_KEY and GEMINI_API_KEY; replay
+needs no network. Each run starts with an empty knowledge index, domain
+stats file and caches, so recording and replay see the same state.
+
+With --depth, the workload is run once per research depth profile (record
+and replay with the same list) and each profile's latency and upstream
+calls per query are reported side by side. Every profile gets a fresh
+agent and the knowledge index is off, so one profile's pages don't answer
+the next one's queries. Peak RSS is a process-lifetime high-water mark
+that later profiles would inherit, so profiles report their own peak of
+Python allocations (tracemalloc) instead; tracing slows Python code, so
+compare those latencies with each other rather than with plain runs.
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def run(queries, cassette, concurrency=1, depth=None, trace_memory=False):
+    """
+    Research every query through the cassette
+
+    Args:
+        depth (str): Research depth profile, None for the agent's defaults
+        trace_memory (bool): Report this run's peak traced allocations instead of the process's peak RSS
+
+    Returns:
+        dict: Latency percentiles, upstream call counts, misses and memory
+    """
+    from agent import WebResearchAgent
+    from cassettes import install
+
+    agent = install(WebResearchAgent(), cassette)
+    if depth is not None:
+        agent.knowledge_index = agent.web_scraper.knowledge_index = None
+    before = cassette.snapshot()
+    latencies = []
+    errors = 0
+
+    def research(record):
+        start_time = time.perf_counter()
+        report = agent.research(record["query"], depth=depth)
+        return time.perf_counter() - start_time, report.startswith(("An error occurred", "Failed to synthesize"))
+
+    if trace_memory:
+        tracemalloc.start()
+    try:
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for latency, failed in executor.map(research, queries):
+                latencies.append(latency)
+                errors += failed
+        elapsed = time.perf_counter() - start_time
+        if trace_memory:
+            memory = {"peak_traced_mb": round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)}
+        else:
+            memory = {"peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}  # KB on Linux
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    latencies.sort()
+    # This run's calls only (profiles share one cassette)
+    snapshot = {section: {kind: count - before[section].get(kind, 0) for kind, count in counts.items()}
+                for section, counts in cassette.snapshot().items()}
+    return {
+        "queries": len(queries),
+        "errors": errors,
+        "elapsed": round(elapsed, 2),
+        "latency_p50": round(statistics.median(latencies), 3) if latencies else None,
+        "latency_p95": round(latencies[int(len(latencies) * 0.95)], 3) if latencies else None,
+        "calls": snapshot["calls"],
+        "misses": snapshot["misses"],
+        **memory
+    }
+
+def print_report(report, baseline=None):
+    print(f"{report['queries']} queries in {report['elapsed']} s, {report['errors']} errors")
+    rows = [("latency_p50", report["latency_p50"]), ("latency_p95", report["latency_p95"])]
+    rows += [(name, report[name]) for name in ("peak_rss_mb", "peak_traced_mb") if name in report]
+    rows += [(f"calls.{kind}", count) for kind, count in sorted(report["calls"].items())]
+    rows += [(f"misses.{kind}", count) for kind, count in sorted(report["misses"].items())]
+    for name, value in rows:
+        line = f"  {name:<16} {value}"
+        if baseline is not None:
+            section, _, key = name.partition(".")
+            before = baseline.get(section, {}).get(key, 0) if key else baseline.get(name)
+            if isinstance(before, (int, float)) and isinstance(value, (int, float)):
+                change = f" ({(value - before) / before:+.0%})" if before else ""
+                line += f"   was {before}{change}"
+        print(line)
+
+def print_depth_table(reports):
+    """Latency, peak traced memory and upstream calls per query of each depth profile"""
+    kinds = sorted({kind for report in reports.values() for kind in report["calls"]})
+    print(f"{'depth':<10} {'p50 s':>8} {'p95 s':>8} {'peak MB':>8} {'errors':>7} {'misses':>7}"
+          + "".join(f" {kind + '/query':>14}" for kind in kinds))
+    for depth, report in reports.items():
+        per_query = [report["calls"].get(kind, 0) / max(report["queries"], 1) for kind in kinds]
+        print(f"{depth:<10} {report['latency_p50']:>8} {report['latency_p95']:>8} "
+              f"{report.get('peak_traced_mb', ''):>8} {report['errors']:>7} "
+              f"{sum(report['misses'].values()):>7}" + "".join(f" {calls:>14.1f}" for calls in per_query))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Record upstream traffic for a workload, or replay it offline")
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("queries", help="JSONL file of queries")
+    parser.add_argument("cassette", help="Cassette file (.gz)")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="Replay: multiplier for recorded latencies, 0 to not wait (default: 1.0)")
+    parser.add_argument("--concurrency", type=int, default=1, help="Queries researched at once (default: 1)")
+    parser.add_argument("--report", help="Write the report as JSON to this file")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    parser.add_argument("--depth", help="Comma-separated depth profiles to run and compare, e.g. quick,standard,deep")
+    args = parser.parse_args(argv)
+
+    # Fresh persistent state, set before the tools read it
+    state_dir = tempfile.mkdtemp(prefix="replay-")
+    os.environ["KNOWLEDGE_INDEX_DIR"] = os.path.join(state_dir, "index")
+    os.environ["DOMAIN_STATS_PATH"] = os.path.join(state_dir, "domain_stats.json")
+
+    from bulk_research import load_queries
+    from cassettes import Cassette
+    from depth import resolve_depth
+
+    depths = args.depth.split(",") if args.depth else [None]
+    for depth in depths:
+        if depth is not None:
+            resolve_depth(depth)  # Unknown profiles fail before any query runs
+
+    queries = load_queries(args.queries)
+    cassette = Cassette(args.cassette, mode=args.mode, latency_scale=args.latency_scale)
+    reports = {}
+    try:
+        for depth in depths:
+            reports[depth] = run(queries, cassette, args.concurrency, depth, trace_memory=args.depth is not None)
+    finally:
+        cassette.save()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    if args.depth:
+        report = {"profiles": reports}
+        for depth, profile_report in reports.items():
+            print(f"[{depth}]")
+            print_report(profile_report, (baseline or {}).get("profiles", {}).get(depth))
+        print_depth_table(reports)
+    else:
+        report = reports[None]
+        print_report(report, baseline)
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
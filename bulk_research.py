@@ -0,0 +1,223 @@
+"""
+Offline bulk research runner
+
+Reads queries from a JSONL file and runs WebResearchAgent.research across a
+process pool, streaming each finished result to an output JSONL file. The
+output file doubles as the checkpoint: on restart, queries whose ids already
+have a successful result in it are skipped, so a killed run resumes where it
+stopped. Failed queries (an "error" in their record) are run again.
+
+Usage:
+    python bulk_research.py queries.jsonl results.jsonl --workers 4
+
+Each input line is either a JSON object with a "query" field (and an
+optional "id") or a bare JSON string.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from utils import SharedRateLimiter, set_shared_rate_limiter
+
+# Agent owned by each worker process, created once in _init_worker
+_worker_agent = None
+
+def load_queries(path):
+    """
+    Load research queries from a JSONL file
+
+    Args:
+        path (str): Path to the input JSONL file
+
+    Returns:
+        list: Records of the form {"id": str, "query": str}
+    """
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping malformed line {line_number} in {path}")
+                continue
+
+            if isinstance(record, str):
+                record = {"query": record}
+            if not isinstance(record, dict) or not record.get("query"):
+                print(f"Skipping line {line_number} in {path}: no query")
+                continue
+
+            queries.append({
+                "id": str(record.get("id", line_number)),
+                "query": record["query"]
+            })
+    return queries
+
+def load_completed_ids(path):
+    """
+    Read the ids already written to an output file so a run can resume
+
+    Records with an error don't count, so failed queries are retried. A
+    partially written last line (from a killed run) is truncated away.
+
+    Args:
+        path (str): Path to the output JSONL file
+
+    Returns:
+        set: Ids of queries that already have a successful result
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+
+    valid_length = 0
+    with open(path, "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            if not record.get("error"):
+                completed.add(str(record.get("id")))
+            valid_length += len(line)
+
+    if valid_length < os.path.getsize(path):
+        print(f"Truncating partial record at the end of {path}")
+        with open(path, "r+b") as f:
+            f.truncate(valid_length)
+
+    return completed
+
+def _init_worker(rate_limiters):
+    """Create the per-process agent and install the shared rate limiters"""
+    global _worker_agent
+    for upstream, limiter in rate_limiters.items():
+        set_shared_rate_limiter(upstream, limiter)
+
+    from agent import WebResearchAgent
+    _worker_agent = WebResearchAgent()
+
+def _research_one(record):
+    """Run one query in a worker process and return its output record"""
+    from agent import SEARCH_UNAVAILABLE_MESSAGE  # Already imported by _init_worker
+    start_time = time.time()
+    try:
+        result = _worker_agent.research(record["query"])
+        error = None
+        # research() reports failures in its answer instead of raising
+        if result.startswith("An error occurred") or result == SEARCH_UNAVAILABLE_MESSAGE:
+            result, error = None, result
+    except Exception as e:
+        result = None
+        error = str(e)
+
+    return {
+        "id": record["id"],
+        "query": record["query"],
+        "result": result,
+        "error": error,
+        "elapsed": round(time.time() - start_time, 2)
+    }
+
+def _format_duration(seconds):
+    """Format a duration in seconds as e.g. '1h02m' or '3m05s'"""
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{(seconds % 3600) // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+def run_bulk(input_path, output_path, workers=2, gemini_interval=1.0, serpapi_interval=1.0):
+    """
+    Run every pending query from input_path and append results to output_path
+
+    Args:
+        input_path (str): Input JSONL file of queries
+        output_path (str): Output JSONL file, also used as the checkpoint
+        workers (int): Number of worker processes
+        gemini_interval (float): Minimum seconds between Gemini calls across all workers
+        serpapi_interval (float): Minimum seconds between SerpAPI calls across all workers
+
+    Returns:
+        int: Number of queries processed in this run
+    """
+    queries = load_queries(input_path)
+    completed = load_completed_ids(output_path)
+    pending = [record for record in queries if record["id"] not in completed]
+
+    print(f"{len(queries)} queries, {len(queries) - len(pending)} already done, {len(pending)} to run")
+    if not pending:
+        return 0
+
+    rate_limiters = {
+        "gemini": SharedRateLimiter(gemini_interval),
+        "serpapi": SharedRateLimiter(serpapi_interval)
+    }
+
+    processed = 0
+    start_time = time.time()
+    pending_iter = iter(pending)
+    # Keep only a couple of tasks per worker queued so huge files stream
+    max_in_flight = workers * 2
+
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                initargs=(rate_limiters,)) as executor:
+        in_flight = set()
+        try:
+            while True:
+                for record in pending_iter:
+                    in_flight.add(executor.submit(_research_one, record))
+                    if len(in_flight) >= max_in_flight:
+                        break
+                if not in_flight:
+                    break
+
+                done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    output = future.result()
+                    out.write(json.dumps(output) + "\n")
+                    out.flush()
+                    os.fsync(out.fileno())
+                    processed += 1
+
+                    elapsed = time.time() - start_time
+                    rate = processed / elapsed if elapsed else 0
+                    remaining = len(pending) - processed
+                    eta = _format_duration(remaining / rate) if rate else "?"
+                    print(f"[{processed}/{len(pending)}] {rate * 60:.1f} queries/min, "
+                          f"ETA {eta} - {output['id']} ({output['elapsed']}s)")
+        except KeyboardInterrupt:
+            print("Interrupted, progress saved; rerun the same command to resume")
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+    return processed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run web research over a JSONL file of queries")
+    parser.add_argument("input", help="Input JSONL file with one query per line")
+    parser.add_argument("output", help="Output JSONL file; existing results are skipped on resume")
+    parser.add_argument("--workers", type=int, default=2, help="Number of worker processes (default: 2)")
+    parser.add_argument("--gemini-interval", type=float, default=1.0,
+                        help="Minimum seconds between Gemini calls across all workers (default: 1.0)")
+    parser.add_argument("--serpapi-interval", type=float, default=1.0,
+                        help="Minimum seconds between SerpAPI calls across all workers (default: 1.0)")
+    args = parser.parse_args(argv)
+
+    try:
+        run_bulk(args.input, args.output, workers=args.workers,
+                 gemini_interval=args.gemini_interval, serpapi_interval=args.serpapi_interval)
+    except KeyboardInterrupt:
+        return 130
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+Record/replay of upstream traffic
+
+A cassette holds the SerpAPI responses, scraped pages and Gemini
+prompt/response pairs of real research runs, with how long each call took,
+in one gzip-compressed JSONL file. In replay mode the same calls are
+answered from the cassette after their original latency (optionally
+scaled), so a day of real queries can be re-run offline and compared
+across changes (see benchmarks/replay.py).
+
+Requests are matched by content: SerpAPI parameters (without the API key),
+the page URL, or the prompt. A request recorded several times is replayed
+in the order recorded, the last answer repeating. Only the sync pipeline
+(WebResearchAgent) is wired up.
+"""
+import base64
+import gzip
+import hashlib
+import json
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from llm import LLMClient
+
+class CassetteMiss(LookupError):
+    """A replayed request that isn't on the cassette"""
+
+class Cassette:
+    """
+    Args:
+        path (str): Cassette file (gzip-compressed JSONL)
+        mode (str): "record" (call upstreams and store them) or "replay"
+        latency_scale (float): Replay: multiplier for recorded latencies (0: don't wait)
+    """
+    def __init__(self, path, mode="replay", latency_scale=1.0):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.lock = threading.Lock()
+        self.entries = defaultdict(deque)  # (kind, key) -> recorded entries, oldest first
+        self.recorded = []
+        self.calls = Counter()
+        self.misses = Counter()
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries[(entry["kind"], entry["key"])].append(entry)
+
+    def save(self):
+        """Write the recorded calls (record mode)"""
+        if self.mode != "record":
+            return
+        with self.lock:
+            entries = list(self.recorded)
+        with gzip.open(self.path, "wt", encoding="utf-8") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+        print(f"Saved {len(entries)} calls to {self.path}")
+
+    @staticmethod
+    def request_key(request):
+        return hashlib.sha1(json.dumps(request, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:20]
+
+    def call(self, kind, request, live, wait=True):
+        """
+        Record live() or replay its recorded response
+
+        Args:
+            kind (str): "serpapi", "http" or "gemini"
+            request (dict): Identifies the request (JSON-serializable)
+            live (callable): Makes the real call; returns a JSON-serializable response
+            wait (bool): Replay: sleep the scaled latency here (False: the caller spreads it)
+
+        Returns:
+            tuple: (response, scaled latency still to wait, 0 if already waited)
+        """
+        key = self.request_key(request)
+        with self.lock:
+            self.calls[kind] += 1
+
+        if self.mode == "record":
+            start_time = time.monotonic()
+            response, error = None, None
+            try:
+                response = live()
+            except Exception as e:
+                error = e
+            entry = {"kind": kind, "key": key, "latency": round(time.monotonic() - start_time, 4),
+                     "response": response, "error": f"{type(error).__name__}: {error}" if error else None}
+            with self.lock:
+                self.recorded.append(entry)
+            if error is not None:
+                raise error
+            return response, 0
+
+        with self.lock:
+            recorded = self.entries.get((kind, key))
+            if not recorded:
+                self.misses[kind] += 1
+                raise CassetteMiss(f"No recorded {kind} call for {json.dumps(request, default=str)[:200]}")
+            entry = recorded.popleft() if len(recorded) > 1 else recorded[0]
+
+        delay = entry["latency"] * self.latency_scale
+        if wait and delay > 0:
+            time.sleep(delay)
+            delay = 0
+        if entry["error"]:
+            raise RuntimeError(entry["error"])
+        return entry["response"], delay
+
+    def wrap_search(self, fetch_results):
+        """Wrap a tool's fetch_results (SerpAPI params -> response dict)"""
+        def fetch(params):
+            request = {k: v for k, v in params.items() if k != "api_key"}
+            return self.call("serpapi", request, lambda: fetch_results(params))[0]
+        return fetch
+
+    def wrap_fetch_page(self, fetch_page):
+        """Wrap WebScraperTool.fetch_page (url -> (status, body))"""
+        def fetch(url, headers, timeout=10):
+            def live():
+                status_code, content = fetch_page(url, headers, timeout)
+                return {"status": status_code, "body": base64.b64encode(content).decode("ascii")}
+            response = self.call("http", {"url": url}, live)[0]
+            return response["status"], base64.b64decode(response["body"])
+        return fetch
+
+    def snapshot(self):
+        with self.lock:
+            return {"calls": dict(self.calls), "misses": dict(self.misses)}
+
+class RecordedResponse:
+    """A replayed model response: .text, and iterable chunks for streamed calls"""
+    def __init__(self, text, chunks=None, delay=0):
+        self.text = text
+        self.chunks = chunks
+        self.delay = delay
+
+    def __iter__(self):
+        # Spread the latency over the chunks, so early aborts save time as they would live
+        chunks = self.chunks or [self.text]
+        for chunk in chunks:
+            if self.delay:
+                time.sleep(self.delay / len(chunks))
+            yield RecordedResponse(chunk)
+
+class CassetteModel:
+    """
+    Model for LLMClient whose generate_content() goes through a cassette
+
+    Args:
+        cassette (Cassette): Where calls are recorded or replayed from
+        model_factory (callable): Returns the real model (only called when recording)
+    """
+    def __init__(self, cassette, model_factory):
+        self.cassette = cassette
+        self.model_factory = model_factory
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        def live():
+            response = self.model_factory().generate_content(prompt, stream=stream, **kwargs)
+            # Streams are recorded in full, so replays can abort at any point
+            chunks = [chunk.text for chunk in response] if stream else None
+            return {"text": response.text, "chunks": chunks}
+
+        recorded, delay = self.cassette.call("gemini", {"prompt": prompt, "stream": stream}, live, wait=not stream)
+        return RecordedResponse(recorded["text"], recorded["chunks"], delay)
+
+def install(agent, cassette):
+    """
+    Route an agent's SerpAPI, page and Gemini calls through a cassette
+
+    The agent gets its own LLMClient without hedging: a hedged duplicate
+    would be recorded (or replayed) as a second call.
+    """
+    agent.web_search.fetch_results = cassette.wrap_search(agent.web_search.fetch_results)
+    agent.news_aggregator.fetch_results = cassette.wrap_search(agent.news_aggregator.fetch_results)
+    agent.web_scraper.fetch_page = cassette.wrap_fetch_page(agent.web_scraper.fetch_page)
+
+    shared = agent.llm
+    client = LLMClient(CassetteModel(cassette, lambda: shared.model), timeout=shared.timeout, hedge=False,
+                       breaker=shared.breaker)
+    agent.llm = client
+    agent.content_analyzer.llm = client
+    return agent
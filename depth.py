@@ -0,0 +1,106 @@
+import contextvars
+
+# Named research depths. "standard" is the agent's and tools' configured
+# values; the others replace them for one request.
+DEPTH_PROFILES = {
+    "quick": {
+        "max_search_terms": 2,
+        "max_results_per_term": 2,
+        "initial_results_per_term": 2,
+        "max_search_rounds": 1,
+        "max_total_results": 4,
+        "max_extracted_sources": 3,
+        "max_synthesis_content_length": 400,
+        "max_content_length": 1500,
+        "max_analysis_length": 800,
+    },
+    "standard": {},
+    "deep": {
+        "max_search_terms": 6,
+        "max_results_per_term": 6,
+        "initial_results_per_term": 3,
+        "max_search_rounds": 4,
+        "max_total_results": 15,
+        "max_extracted_sources": 8,
+        "max_synthesis_content_length": 700,
+        "max_content_length": 5000,
+        "max_analysis_length": 1500,
+    },
+}
+
+# Limits a request may override, with the largest value accepted
+DEPTH_LIMITS = {
+    "max_search_terms": 8,
+    "max_results_per_term": 10,
+    "initial_results_per_term": 10,
+    "max_search_rounds": 5,
+    "max_total_results": 20,
+    "max_extracted_sources": 10,
+    "max_synthesis_content_length": 2000,
+    "max_content_length": 10000,
+    "max_analysis_length": 4000,
+}
+
+class DepthLimit:
+    """
+    Descriptor for a configured limit that the current request's depth can
+    override: reads return the request's value when it sets one, else the
+    instance's own (assigned as usual, e.g. in __init__)
+    """
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        limits = _depth_limits.get()
+        if limits is not None and self.name in limits:
+            return limits[self.name]
+        return instance.__dict__[self.name]
+
+    def __set__(self, instance, value):
+        instance.__dict__[self.name] = value
+
+def resolve_depth(depth=None, overrides=None):
+    """
+    The limits for a request: a named profile plus per-limit overrides
+
+    Args:
+        depth (str): "quick", "standard" or "deep" (default: "standard")
+        overrides (dict): Limit name -> positive integer, applied on top of the profile
+
+    Returns:
+        dict: Limit name -> value; empty for the configured defaults
+
+    Raises:
+        ValueError: For an unknown profile or limit, or a value out of range
+    """
+    depth = depth or "standard"
+    if depth not in DEPTH_PROFILES:
+        raise ValueError(f"depth must be one of: {', '.join(DEPTH_PROFILES)}")
+    limits = dict(DEPTH_PROFILES[depth])
+    if overrides is None:
+        return limits
+    if not isinstance(overrides, dict):
+        raise ValueError("overrides must be an object of limit names to numbers")
+    for name, value in overrides.items():
+        if name not in DEPTH_LIMITS:
+            raise ValueError(f"Unknown limit '{name}'; limits are: {', '.join(DEPTH_LIMITS)}")
+        if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= DEPTH_LIMITS[name]:
+            raise ValueError(f"{name} must be an integer from 1 to {DEPTH_LIMITS[name]}")
+        limits[name] = value
+    return limits
+
+# The current request's limits; copied into the threads and tasks it starts
+_depth_limits = contextvars.ContextVar("depth_limits", default=None)
+
+def set_depth_limits(limits):
+    """Apply limits to the current request; returns a token for reset_depth_limits()"""
+    return _depth_limits.set(limits or None)
+
+def reset_depth_limits(token):
+    _depth_limits.reset(token)
+
+def current_depth_limits():
+    """The current request's limit overrides, or None for the configured values"""
+    return _depth_limits.get()
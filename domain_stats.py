@@ -0,0 +1,209 @@
+import atexit
+import json
+import os
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+def domain_of(url):
+    """Lowercased host of a URL without a leading 'www.'"""
+    host = urlparse(url).netloc.lower().split("@")[-1].split(":")[0]
+    return host[4:] if host.startswith("www.") else host
+
+class DomainStats:
+    """
+    Per-domain scraping statistics with circuit breaking
+
+    Tracks, per domain, a latency EWMA, a failure-rate EWMA (timeouts, HTTP
+    errors, empty or bot-block pages), the average extracted text length and
+    the average relevance score the ContentAnalyzerTool gave its pages.
+    Domains that keep failing are circuit-broken for a cooldown period, and
+    slow or low-yield domains are pushed down the scrape order. Stats are
+    persisted to a JSON file so they survive worker restarts.
+
+    Args:
+        path (str): JSON file to persist to, or None to keep stats in memory only
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.domains = {}
+        self.alpha = 0.3  # EWMA weight of the newest observation
+        self.min_samples = 3  # Observations before a domain can be judged
+        self.failure_threshold = 0.6  # Failure rate that opens the circuit
+        self.cooldown = 600  # Seconds a broken domain is skipped
+        self.slow_latency = 5.0  # Seconds; slower domains are deprioritized
+        self.low_relevance = 4.0  # Average score below which a domain is deprioritized
+        self.min_content_length = 200  # Shorter pages count as failures (paywalls, bot blocks)
+        self.save_interval = 30  # Seconds between writes to disk
+        self.last_save = 0
+        self.load()
+
+    def _entry(self, domain):
+        entry = self.domains.get(domain)
+        if entry is None:
+            entry = {
+                "requests": 0,
+                "failures": 0,
+                "latency_ewma": None,
+                "failure_rate": 0.0,
+                "avg_length": None,
+                "relevance_samples": 0,
+                "avg_relevance": None,
+                "open_until": 0,
+                "updated": 0
+            }
+            self.domains[domain] = entry
+        return entry
+
+    def _ewma(self, previous, value):
+        return value if previous is None else previous + self.alpha * (value - previous)
+
+    def record_fetch(self, url, latency, content_length, failed=False):
+        """
+        Record the outcome of one scrape
+
+        Args:
+            url (str): Scraped URL
+            latency (float): Seconds the fetch took
+            content_length (int): Length of the extracted text
+            failed (bool): True for timeouts, connection and HTTP errors
+        """
+        failed = failed or content_length < self.min_content_length
+        with self.lock:
+            entry = self._entry(domain_of(url))
+            entry["requests"] += 1
+            entry["failures"] += int(failed)
+            entry["latency_ewma"] = self._ewma(entry["latency_ewma"], latency)
+            entry["failure_rate"] = self._ewma(entry["failure_rate"] if entry["requests"] > 1 else None, float(failed))
+            if not failed:
+                entry["avg_length"] = self._ewma(entry["avg_length"], content_length)
+
+            if entry["requests"] >= self.min_samples and entry["failure_rate"] >= self.failure_threshold:
+                if entry["open_until"] < time.time():
+                    print(f"Circuit open for {domain_of(url)} (failure rate {entry['failure_rate']:.2f})")
+                entry["open_until"] = time.time() + self.cooldown
+            entry["updated"] = time.time()
+        self._maybe_save()
+
+    def record_relevance(self, url, score):
+        """Record the relevance score the analyzer gave a page from this domain"""
+        with self.lock:
+            entry = self._entry(domain_of(url))
+            entry["relevance_samples"] += 1
+            entry["avg_relevance"] = self._ewma(entry["avg_relevance"], float(score))
+            entry["updated"] = time.time()
+        self._maybe_save()
+
+    def is_open(self, url):
+        """True while a domain's circuit is broken and it should not be scraped"""
+        with self.lock:
+            entry = self.domains.get(domain_of(url))
+            return bool(entry) and entry["open_until"] > time.time()
+
+    def penalty(self, url):
+        """0 for a healthy or unknown domain, growing for slow, failing or low-yield ones"""
+        with self.lock:
+            entry = self.domains.get(domain_of(url))
+            if not entry or entry["requests"] < self.min_samples:
+                return 0.0
+            penalty = entry["failure_rate"]
+            if (entry["latency_ewma"] or 0) > self.slow_latency:
+                penalty += 0.5
+            if entry["relevance_samples"] >= self.min_samples and entry["avg_relevance"] < self.low_relevance:
+                penalty += 0.5
+            return penalty
+
+    def rank(self, results):
+        """
+        Order search results for scraping: drop circuit-broken domains and push
+        penalized ones down while otherwise keeping the search ranking
+
+        Args:
+            results (list): Search result dicts with a 'link'
+
+        Returns:
+            list: Reordered results
+        """
+        kept = [r for r in results if not self.is_open(r.get("link", ""))]
+        skipped = len(results) - len(kept)
+        if skipped:
+            print(f"Skipping {skipped} result(s) from circuit-broken domains")
+        # A penalty of 1.0 moves a result back about four places
+        order = sorted(range(len(kept)), key=lambda i: i + 4 * self.penalty(kept[i].get("link", "")))
+        return [kept[i] for i in order]
+
+    def snapshot(self, limit=50):
+        """The most-requested domains' stats, for inspection"""
+        with self.lock:
+            items = sorted(self.domains.items(), key=lambda item: item[1]["requests"], reverse=True)[:limit]
+            now = time.time()
+            return {domain: dict(entry, circuit_open=entry["open_until"] > now) for domain, entry in items}
+
+    def load(self):
+        """Load persisted stats; a missing or corrupt file starts empty"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                with self.lock:
+                    self.domains.update(data)
+        except (OSError, ValueError) as e:
+            print(f"Could not load domain stats from {self.path}: {e}")
+
+    def save(self):
+        """
+        Write stats to disk atomically, keeping entries other workers updated
+        more recently than ours
+        """
+        if not self.path:
+            return
+        try:
+            on_disk = {}
+            if os.path.exists(self.path):
+                with open(self.path, encoding="utf-8") as f:
+                    on_disk = json.load(f)
+            with self.lock:
+                merged = dict(on_disk) if isinstance(on_disk, dict) else {}
+                for domain, entry in self.domains.items():
+                    if entry["updated"] >= merged.get(domain, {}).get("updated", 0):
+                        merged[domain] = entry
+                self.domains.update(merged)
+                self.last_save = time.time()
+
+            temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(merged, f)
+            os.replace(temp_path, self.path)
+        except (OSError, ValueError) as e:
+            print(f"Could not save domain stats to {self.path}: {e}")
+
+    def _maybe_save(self):
+        with self.lock:
+            due = time.time() - self.last_save >= self.save_interval
+            if due:
+                self.last_save = time.time()  # Claim this save so other threads skip it
+        if due:
+            self.save()
+
+# One stats table per process, shared by every scraper
+_domain_stats = None
+_domain_stats_lock = threading.Lock()
+
+def get_domain_stats():
+    """
+    Get the process-wide DomainStats, loading it on first use
+
+    Persisted to DOMAIN_STATS_PATH (default: a file in the temp directory).
+    """
+    global _domain_stats
+    with _domain_stats_lock:
+        if _domain_stats is None:
+            path = os.getenv("DOMAIN_STATS_PATH",
+                             os.path.join(tempfile.gettempdir(), "web_research_domain_stats.json"))
+            _domain_stats = DomainStats(path)
+            atexit.register(_domain_stats.save)
+        return _domain_stats
@@ -0,0 +1,457 @@
+import atexit
+import json
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from relevance import tokenize
+from utils import split_sentences, canonicalize_url
+
+try:
+    import fcntl  # Serializes writers across worker processes (POSIX only)
+except ImportError:
+    fcntl = None
+
+# passages.idx record: offset and length in passages.dat, doc id, fetch time, token count
+_PASSAGE_RECORD = struct.Struct("<QIIdI")
+# Posting: passage id, term frequency
+_POSTING = struct.Struct("<II")
+
+class KnowledgeIndex:
+    """
+    Local on-disk BM25 index of scraped pages
+
+    Pages are split into passages of a few sentences. Adds are buffered and
+    flushed as small immutable segments by a background thread (and at
+    exit), so scrapes never wait on disk; segments are merged once there are
+    more than max_segments, and compaction also drops superseded copies of a
+    re-scraped URL and passages older than the retention period. Queries
+    memory-map the passage table and the postings, so only the parts a
+    query touches are read; they load new files under a shared file lock,
+    so a flush or compaction in another process is never seen half-written.
+
+    Writers (flush, compaction) are serialized by write_lock and the
+    exclusive file lock and do their I/O without self.lock, which guards
+    the pending buffer and the loaded view and is only held to swap or
+    install them. A query that finds a writer at work searches the view it
+    already has instead of waiting.
+
+    Files in the index directory:
+    - manifest.json: segments, passage count and total token length
+    - docs.jsonl: one line per indexed page (URL, title)
+    - passages.dat / passages.idx: zlib-compressed passage text and fixed-size records
+    - <segment>.terms.json / <segment>.post: term dictionary and packed postings
+
+    Args:
+        directory (str): Where the index lives; created if missing
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock = threading.RLock()  # Pending pages and the loaded view
+        self.write_lock = threading.Lock()  # One flush or compaction at a time in this process
+        self.k1 = 1.2
+        self.b = 0.75
+        self.passage_length = 500  # Characters per passage, at sentence boundaries
+        self.min_page_length = 200  # Shorter pages (bot blocks, paywalls) aren't indexed
+        self.flush_size = 8  # Buffered pages before a flush
+        self.max_segments = 8  # More segments than this triggers compaction
+        self.retention = 30 * 24 * 3600  # Seconds passages are kept at compaction
+        self.max_pending = 256  # Pages kept for a retry when flushes fail; the oldest are dropped
+
+        self.pending = []  # Pages waiting to be flushed
+        self.flush_requested = threading.Event()
+        self.flush_thread = None
+        self._reset_view()
+        atexit.register(self.flush)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _reset_view(self):
+        """Forget everything loaded from disk"""
+        self.manifest = {"generation": 0, "segments": [], "passages": 0, "total_length": 0, "next_segment": 0}
+        self.docs = []  # doc id -> {"url", "title"}
+        self.latest_doc = {}  # canonical url -> newest doc id
+        self.doc_live = []  # doc id -> False once a newer copy of its URL was indexed
+        self.docs_offset = 0
+        self.segments = {}  # name -> (term dictionary, postings mmap)
+        self.passage_index = None
+        self.passage_data = None
+        self.manifest_mtime = None
+
+    def _map(self, name):
+        """Read-only mmap of a file, or None when it is missing or empty"""
+        path = self._path(name)
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _refresh(self):
+        """Pick up segments and pages written since the last look (by any process)"""
+        path = self._path("manifest.json")
+        if not os.path.exists(path):
+            return
+        mtime = os.stat(path).st_mtime_ns
+        if mtime == self.manifest_mtime:
+            return
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest["generation"] != self.manifest["generation"]:
+            # Compacted: every file was rewritten
+            self._reset_view()
+        self.manifest = manifest
+        self.manifest_mtime = mtime
+
+        with open(self._path("docs.jsonl"), encoding="utf-8") as f:
+            f.seek(self.docs_offset)
+            for line in iter(f.readline, ""):
+                if not line.endswith("\n"):
+                    break  # Being written; read it next time
+                doc = json.loads(line)
+                # Variants of one page (AMP, mobile, tracking parameters) supersede each other
+                key = canonicalize_url(doc["url"])
+                previous = self.latest_doc.get(key)
+                if previous is not None:
+                    self.doc_live[previous] = False
+                self.latest_doc[key] = len(self.docs)
+                self.docs.append(doc)
+                self.doc_live.append(True)
+                self.docs_offset = f.tell()
+
+        self.passage_index = self._map("passages.idx")
+        self.passage_data = self._map("passages.dat")
+        for name in manifest["segments"]:
+            if name not in self.segments:
+                with open(self._path(f"{name}.terms.json"), encoding="utf-8") as f:
+                    terms = json.load(f)
+                self.segments[name] = (terms, self._map(f"{name}.post"))
+        for name in set(self.segments) - set(manifest["segments"]):
+            del self.segments[name]
+
+    def add(self, url, title, content, fetched_at=None):
+        """
+        Queue a scraped page for indexing
+
+        Args:
+            url (str): Page URL; a newer copy supersedes older ones
+            title (str): Page title
+            content (str): Extracted page text
+            fetched_at (float): Fetch time (default: now)
+        """
+        if not content or len(content) < self.min_page_length:
+            return
+        with self.lock:
+            self.pending.append({"url": url, "title": title or "", "content": content,
+                                 "fetched_at": fetched_at or time.time()})
+            due = len(self.pending) >= self.flush_size
+        if due:
+            self._request_flush()
+
+    def _request_flush(self):
+        """Have the background thread flush (and compact if due), starting it on first use"""
+        with self.lock:
+            if self.flush_thread is None:
+                self.flush_thread = threading.Thread(target=self._flush_loop, name="knowledge-index-flush",
+                                                     daemon=True)
+                self.flush_thread.start()
+        self.flush_requested.set()
+
+    def _flush_loop(self):
+        while True:
+            self.flush_requested.wait()
+            self.flush_requested.clear()
+            self.flush()
+
+    def _passages(self, content):
+        """Split page text into passages of about passage_length characters"""
+        passages = []
+        current = ""
+        for sentence in split_sentences(content):
+            if current and len(current) + len(sentence) + 1 > self.passage_length:
+                passages.append(current)
+                current = ""
+            current = f"{current} {sentence}" if current else sentence
+        if current:
+            passages.append(current)
+        return passages
+
+    def _file_lock(self, shared=False, blocking=True):
+        """
+        Lock the index directory: exclusive for writers, shared for readers loading files
+
+        Always taken before self.lock. Returns the open lock file (close it to
+        unlock), or None if blocking is False and a writer holds the lock.
+        """
+        lock_file = open(self._path("index.lock"), "a")
+        if fcntl is not None:
+            try:
+                fcntl.flock(lock_file, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                            | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                lock_file.close()
+                return None
+        return lock_file
+
+    def _write_manifest(self, manifest):
+        temp_path = self._path(f"manifest.json.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(temp_path, self._path("manifest.json"))
+
+    def _write_segment(self, name, postings):
+        """Write term -> [(passage id, tf)] postings as a new segment"""
+        terms = {}
+        offset = 0
+        with open(self._path(f"{name}.post"), "wb") as f:
+            for term in sorted(postings):
+                entries = postings[term]
+                f.write(b"".join(_POSTING.pack(pid, tf) for pid, tf in entries))
+                terms[term] = [offset, len(entries)]
+                offset += len(entries)
+        with open(self._path(f"{name}.terms.json"), "w", encoding="utf-8") as f:
+            json.dump(terms, f, separators=(",", ":"))
+
+    def _append_pages(self, pages, next_passage, next_doc, postings, data_file, index_file, docs_file):
+        """Append pages to the passage store, collecting postings; returns (passages, total length)"""
+        count = 0
+        total_length = 0
+        offset = data_file.tell()
+        for doc_id, page in enumerate(pages, start=next_doc):
+            docs_file.write(json.dumps({"url": page["url"], "title": page["title"]}) + "\n")
+            for text in self._passages(page["content"]):
+                tokens = tokenize(text)
+                if not tokens:
+                    continue
+                blob = zlib.compress(text.encode("utf-8"))
+                data_file.write(blob)
+                index_file.write(_PASSAGE_RECORD.pack(offset, len(blob), doc_id, page["fetched_at"], len(tokens)))
+                offset += len(blob)
+
+                counts = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                for token, tf in counts.items():
+                    postings.setdefault(token, []).append((next_passage + count, tf))
+                count += 1
+                total_length += len(tokens)
+        return count, total_length
+
+    def flush(self):
+        """Write buffered pages to disk as a new segment; on failure they stay buffered for the next flush"""
+        with self.write_lock:
+            with self.lock:
+                pages, self.pending = self.pending, []
+            if not pages:
+                return
+            try:
+                lock_file = self._file_lock()
+                try:
+                    manifest = self._write_pages(pages)
+                    if len(manifest["segments"]) > self.max_segments:
+                        self._compact()
+                finally:
+                    lock_file.close()
+            except (OSError, ValueError) as e:
+                print(f"Could not update knowledge index in {self.directory}: {e}")
+
+    def _write_pages(self, pages):
+        """
+        Append pages as a new segment (caller holds write_lock and the exclusive file lock)
+
+        If that fails, the appended files are cut back and the pages are
+        buffered again, so a retry writes where the manifest expects.
+
+        Returns:
+            dict: The new manifest
+        """
+        # With both write locks held nothing else changes the view; self.lock only to update it
+        with self.lock:
+            self._refresh()
+        manifest = dict(self.manifest)
+        sizes = {name: os.path.getsize(self._path(name)) if os.path.exists(self._path(name)) else 0
+                 for name in ("passages.dat", "passages.idx", "docs.jsonl")}
+        try:
+            postings = {}
+            with open(self._path("passages.dat"), "ab") as data_file, \
+                    open(self._path("passages.idx"), "ab") as index_file, \
+                    open(self._path("docs.jsonl"), "a", encoding="utf-8") as docs_file:
+                count, total_length = self._append_pages(pages, manifest["passages"], len(self.docs),
+                                                         postings, data_file, index_file, docs_file)
+            name = f"seg_{manifest['next_segment']:06d}"
+            self._write_segment(name, postings)
+            manifest.update(segments=manifest["segments"] + [name],
+                            passages=manifest["passages"] + count,
+                            total_length=manifest["total_length"] + total_length,
+                            next_segment=manifest["next_segment"] + 1)
+            self._write_manifest(manifest)
+        except (OSError, ValueError):
+            for file_name, size in sizes.items():
+                if os.path.exists(self._path(file_name)):
+                    os.truncate(self._path(file_name), size)
+            with self.lock:
+                self.pending = (pages + self.pending)[-self.max_pending:]
+            raise
+        with self.lock:
+            self._refresh()
+        return manifest
+
+    def compact(self):
+        """Merge all segments, dropping superseded and expired passages"""
+        self.flush()
+        with self.write_lock:
+            lock_file = self._file_lock()
+            try:
+                self._compact()
+            finally:
+                lock_file.close()
+
+    def _compact(self):
+        """Rewrite the whole index as one segment (caller holds write_lock and the exclusive file lock)"""
+        with self.lock:
+            self._refresh()
+        if not self.manifest["segments"]:
+            return
+        cutoff = time.time() - self.retention
+        # Rebuild the pages from their live passages
+        pages = {}
+        for pid in range(self.manifest["passages"]):
+            offset, length, doc_id, fetched_at, _ = _PASSAGE_RECORD.unpack_from(self.passage_index,
+                                                                              pid * _PASSAGE_RECORD.size)
+            doc = self.docs[doc_id]
+            if not self.doc_live[doc_id] or fetched_at < cutoff:
+                continue
+            text = zlib.decompress(self.passage_data[offset:offset + length]).decode("utf-8")
+            page = pages.setdefault(doc_id, {"url": doc["url"], "title": doc["title"],
+                                             "fetched_at": fetched_at, "passages": []})
+            page["passages"].append(text)
+
+        generation = self.manifest["generation"] + 1
+        postings = {}
+        with open(self._path("passages.dat.tmp"), "wb") as data_file, \
+                open(self._path("passages.idx.tmp"), "wb") as index_file, \
+                open(self._path("docs.jsonl.tmp"), "w", encoding="utf-8") as docs_file:
+            # Passages are re-split from their joined text, which keeps the same boundaries
+            rebuilt = [dict(page, content=" ".join(page["passages"])) for page in pages.values()]
+            count, total_length = self._append_pages(rebuilt, 0, 0, postings, data_file, index_file, docs_file)
+        name = f"seg_{self.manifest['next_segment']:06d}"
+        self._write_segment(name, postings)
+        for file_name in ("passages.dat", "passages.idx", "docs.jsonl"):
+            os.replace(self._path(f"{file_name}.tmp"), self._path(file_name))
+        old_segments = self.manifest["segments"]
+        self._write_manifest({"generation": generation, "segments": [name], "passages": count,
+                              "total_length": total_length, "next_segment": self.manifest["next_segment"] + 1})
+        for old in old_segments:
+            for suffix in (".terms.json", ".post"):
+                try:
+                    os.remove(self._path(old + suffix))
+                except OSError:
+                    pass
+        with self.lock:
+            self._reset_view()
+            self._refresh()
+        print(f"Compacted knowledge index: {len(old_segments)} segments -> 1, {count} passages")
+
+    def search(self, query, max_age=None, limit=5):
+        """
+        Find the passages that best match a query (BM25)
+
+        Args:
+            query (str): Query or search term
+            max_age (float): Ignore passages fetched more than this many seconds ago
+            limit (int): Maximum passages to return
+
+        Returns:
+            list: Dicts with 'url', 'title', 'text', 'fetched_at' and 'score', best first.
+                  The score is normalized to 0-1, where 1 means every query term
+                  appears in a passage of average length (idf-weighted).
+        """
+        if self.pending:
+            self._request_flush()  # Searchable once written; the request doesn't wait for it
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        try:
+            # Writers hold the file lock exclusively while files are being appended or replaced;
+            # rather than wait for one, search the files loaded so far (their maps stay valid)
+            lock_file = self._file_lock(shared=True, blocking=False)
+            if lock_file is not None:
+                try:
+                    with self.lock:
+                        self._refresh()
+                finally:
+                    lock_file.close()
+        except (OSError, ValueError) as e:
+            print(f"Could not read knowledge index in {self.directory}: {e}")
+            return []
+
+        with self.lock:
+            total = self.manifest["passages"]
+            if not total or self.passage_index is None:
+                return []
+            average_length = self.manifest["total_length"] / total
+            cutoff = time.time() - max_age if max_age is not None else None
+
+            scores = {}
+            reference = 0.0  # Score of a passage with each term once, at average length
+            passage_index, doc_live = self.passage_index, self.doc_live
+            record_size, unpack_record = _PASSAGE_RECORD.size, _PASSAGE_RECORD.unpack_from
+            length_factor = self.k1 * self.b / average_length
+            base_norm = self.k1 * (1 - self.b)
+            for term in terms:
+                postings = [(terms_dict[term], post) for terms_dict, post in self.segments.values()
+                            if term in terms_dict and post is not None]
+                df = sum(count for (_, count), _ in postings)
+                idf = math.log(1 + (total - df + 0.5) / (df + 0.5))
+                reference += idf
+                weight = idf * (self.k1 + 1)
+                for (start, count), post in postings:
+                    # One C-level unpack per segment's postings list instead of one call per posting
+                    for pid, tf in _POSTING.iter_unpack(post[start * _POSTING.size:(start + count) * _POSTING.size]):
+                        _, _, doc_id, fetched_at, length = unpack_record(passage_index, pid * record_size)
+                        if not doc_live[doc_id]:
+                            continue  # Superseded by a newer fetch of the same URL
+                        if cutoff is not None and fetched_at < cutoff:
+                            continue
+                        scores[pid] = scores.get(pid, 0.0) + weight * tf / (tf + base_norm + length_factor * length)
+
+            results = []
+            for pid, score in sorted(scores.items(), key=lambda item: item[1], reverse=True)[:limit]:
+                offset, length, doc_id, fetched_at, _ = _PASSAGE_RECORD.unpack_from(self.passage_index,
+                                                                                  pid * _PASSAGE_RECORD.size)
+                doc = self.docs[doc_id]
+                results.append({
+                    "url": doc["url"],
+                    "title": doc["title"],
+                    "text": zlib.decompress(self.passage_data[offset:offset + length]).decode("utf-8"),
+                    "fetched_at": fetched_at,
+                    "score": round(min(score / reference, 1.0), 3) if reference else 0.0
+                })
+            return results
+
+# One index per process, fed by every scraper
+_knowledge_index = None
+_knowledge_index_lock = threading.Lock()
+
+def get_knowledge_index():
+    """
+    Get the process-wide KnowledgeIndex, or None when disabled
+
+    Stored in KNOWLEDGE_INDEX_DIR (default: a directory in the temp
+    directory); set KNOWLEDGE_INDEX=off to disable it.
+    """
+    global _knowledge_index
+    if os.getenv("KNOWLEDGE_INDEX", "on").lower() in ("0", "off", "false", "no"):
+        return None
+    with _knowledge_index_lock:
+        if _knowledge_index is None:
+            directory = os.getenv("KNOWLEDGE_INDEX_DIR",
+                                  os.path.join(tempfile.gettempdir(), "web_research_index"))
+            _knowledge_index = KnowledgeIndex(directory)
+        return _knowledge_index
@@ -0,0 +1,372 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from resilience import acall_upstream, call_upstream, get_breaker
+
+class LLMTimeoutError(TimeoutError):
+    """Raised when an LLM call misses its deadline"""
+
+class LLMSlotTimeoutError(LLMTimeoutError):
+    """Raised when no attempt got a local concurrency slot before the deadline (Gemini was never called)"""
+
+class LatencyStats:
+    """Rolling window of call latencies plus call/hedge/timeout counters"""
+    def __init__(self, window=200):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def record(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+
+    def increment(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def percentile(self, percent):
+        """Latency percentile in seconds, or None without samples"""
+        with self.lock:
+            samples = sorted(self.latencies)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(percent / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def snapshot(self):
+        with self.lock:
+            count = len(self.latencies)
+            snapshot = {
+                "calls": self.calls,
+                "errors": self.errors,
+                "timeouts": self.timeouts,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "samples": count
+            }
+        for percent in (50, 95, 99):
+            value = self.percentile(percent)
+            snapshot[f"p{percent}_ms"] = round(value * 1000, 1) if value is not None else None
+        return snapshot
+
+def _cancel_grpc(response):
+    """Cancel a Gemini response's underlying gRPC stream so the model stops generating"""
+    cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+    if callable(cancel):
+        cancel()
+
+class LLMStream:
+    """
+    A streamed response that keeps its LLMClient slot until the stream is
+    drained, cancelled or past its deadline
+
+    A watchdog cancels the stream at the deadline, so a chunk read that
+    stalls raises LLMTimeoutError instead of blocking. Other attributes
+    (e.g. text, once drained) come from the underlying response.
+    """
+    def __init__(self, response, on_end, deadline):
+        self._response = response
+        self._on_end = on_end
+        self._lock = threading.Lock()
+        self._ended = False
+        self.timed_out = False
+        self._watchdog = threading.Timer(max(deadline - time.monotonic(), 0), self._expire)
+        self._watchdog.daemon = True
+        self._watchdog.start()
+
+    def __iter__(self):
+        try:
+            for chunk in self._response:
+                if self.timed_out:
+                    break
+                yield chunk
+            if self.timed_out:
+                raise LLMTimeoutError("LLM stream exceeded its deadline")
+        except Exception as e:
+            if self.timed_out and not isinstance(e, LLMTimeoutError):
+                raise LLMTimeoutError("LLM stream exceeded its deadline") from e
+            raise
+        finally:
+            self._end()
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    def cancel(self):
+        """Stop generating and give the slot back"""
+        _cancel_grpc(self._response)
+        self._end()
+
+    def _expire(self):
+        self.timed_out = True
+        self.cancel()
+
+    def _end(self):
+        with self._lock:
+            if self._ended:
+                return
+            self._ended = True
+        self._watchdog.cancel()
+        self._on_end(self.timed_out)
+
+class LLMClient:
+    """
+    Shared client for a generative model with a concurrency limit, per-call
+    deadlines and hedged requests
+
+    A call that is still running after the observed p95 latency gets a
+    duplicate request; whichever answer arrives first wins. Sync callers use
+    generate(), asyncio callers use agenerate(); both share the same slots.
+    Streamed calls (stream=True) return an LLMStream that holds its slot
+    until consumed; their latencies are kept apart in stream_stats so
+    time-to-first-chunk doesn't lower the hedging percentile.
+
+    Args:
+        model: Object with a generate_content(prompt, **kwargs) method, or a
+            zero-argument factory for one, called on the first request
+        max_concurrency (int): Maximum model calls in flight at once
+        timeout (float): Default per-call deadline in seconds
+        hedge (bool): Issue a duplicate request for slow calls
+        breaker (CircuitBreaker): Upstream breaker; calls fail fast while it
+            is open and failed calls are retried within the request's retry
+            budget (None: no breaker, no retries)
+    """
+    def __init__(self, model, max_concurrency=4, timeout=30, hedge=True, breaker=None):
+        if hasattr(model, "generate_content"):
+            self._model, self._model_factory = model, None
+        else:
+            self._model, self._model_factory = None, model
+        self._model_lock = threading.Lock()
+        self.timeout = timeout
+        self.hedge = hedge
+        self.breaker = breaker
+        self.hedge_percentile = 95
+        self.hedge_min_samples = 20  # Don't hedge until p95 means something
+        self.min_hedge_delay = 1.0  # Never hedge sooner than this (seconds)
+        self.stats = LatencyStats()
+        self.stream_stats = LatencyStats()  # Full stream durations, not used for hedging
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        # Extra threads so attempts waiting for a slot don't block finished ones
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency * 2, thread_name_prefix="llm")
+
+    @property
+    def model(self):
+        """The underlying model, created on first use"""
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._model_factory()
+        return self._model
+
+    def hedge_delay(self):
+        """Seconds to wait before hedging a call, or None if hedging is not ready"""
+        with self.stats.lock:
+            samples = len(self.stats.latencies)
+        if samples < self.hedge_min_samples:
+            return None
+        return max(self.stats.percentile(self.hedge_percentile), self.min_hedge_delay)
+
+    def _attempt(self, prompt, kwargs, deadline, started):
+        """Run one model call inside a concurrency slot; sets started once it has one"""
+        if not self._slots.acquire(timeout=max(deadline - time.monotonic(), 0)):
+            raise LLMSlotTimeoutError("No LLM slot available before the deadline")
+        started.set()
+        start_time = time.monotonic()
+        try:
+            response = self.model.generate_content(prompt, **kwargs)
+        except BaseException:
+            self._slots.release()
+            raise
+        if kwargs.get("stream"):
+            # generate_content returned at the first chunk; the slot is freed when the stream ends
+            return LLMStream(response, lambda timed_out: self._end_stream(start_time, timed_out), deadline), None
+        self._slots.release()
+        return response, time.monotonic() - start_time
+
+    def _end_stream(self, start_time, timed_out):
+        self._slots.release()
+        if timed_out:
+            self.stats.increment("timeouts")
+        else:
+            self.stream_stats.record(time.monotonic() - start_time)
+
+    def _prepare(self, timeout, hedge, kwargs):
+        timeout = self.timeout if timeout is None else timeout
+        if hedge is None:
+            # A stream can't be raced: its chunks are consumed after we return
+            hedge = self.hedge and not kwargs.get("stream")
+        self.stats.increment("calls")
+        return time.monotonic() + timeout, self.hedge_delay() if hedge else None
+
+    def _finish(self, future, hedge_future):
+        response, latency = future.result()
+        if latency is not None:  # Streams record their own duration when they end
+            self.stats.record(latency)
+        if future is hedge_future:
+            self.stats.increment("hedge_wins")
+        return response
+
+    def _fail(self, pending, last_error, started):
+        """Raise the right error once no attempt can succeed"""
+        if pending or last_error is None or isinstance(last_error, LLMTimeoutError):
+            self.stats.increment("timeouts")
+            if not started.is_set():
+                raise LLMSlotTimeoutError("No LLM slot available before the deadline") from last_error
+            raise LLMTimeoutError("LLM call exceeded its deadline") from last_error
+        self.stats.increment("errors")
+        raise last_error
+
+    @staticmethod
+    def _retryable(error):
+        # A timed-out call already used its whole deadline; retrying would double it
+        return not isinstance(error, LLMTimeoutError)
+
+    @staticmethod
+    def _local_error(error):
+        # Waiting for a local slot says nothing about Gemini's health
+        return isinstance(error, LLMSlotTimeoutError)
+
+    def generate(self, prompt, timeout=None, hedge=None, **kwargs):
+        """
+        Generate content, blocking until the first answer or the deadline
+
+        Args:
+            prompt: Prompt passed to generate_content
+            timeout (float): Deadline in seconds (default: self.timeout)
+            hedge (bool): Override hedging for this call
+            **kwargs: Passed through to generate_content (e.g. stream=True)
+
+        Returns:
+            The model response
+
+        Raises:
+            LLMTimeoutError: If no attempt finished before the deadline
+            CircuitOpenError: If the model's circuit breaker is open
+        """
+        if self.breaker is None:
+            return self._generate(prompt, timeout, hedge, kwargs)
+        return call_upstream(self.breaker, self._generate, prompt, timeout, hedge, kwargs,
+                             retryable=self._retryable, is_local=self._local_error)
+
+    def _generate(self, prompt, timeout, hedge, kwargs):
+        deadline, hedge_delay = self._prepare(timeout, hedge, kwargs)
+        hedge_at = time.monotonic() + hedge_delay if hedge_delay is not None else None
+        started = threading.Event()  # Set once any attempt reaches the model
+        pending = {self._executor.submit(self._attempt, prompt, kwargs, deadline, started)}
+        hedge_future = None
+        last_error = None
+
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wait_until = min(deadline, hedge_at) if hedge_at and not hedge_future else deadline
+            done, pending = wait(pending, timeout=max(wait_until - now, 0), return_when=FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    return self._finish(future, hedge_future)
+                except Exception as e:
+                    last_error = e
+
+            if pending and hedge_at and not hedge_future and time.monotonic() >= hedge_at:
+                self.stats.increment("hedges")
+                hedge_future = self._executor.submit(self._attempt, prompt, kwargs, deadline, started)
+                pending.add(hedge_future)
+
+        return self._fail(pending, last_error, started)
+
+    async def agenerate(self, prompt, timeout=None, hedge=None, **kwargs):
+        """
+        Asyncio version of generate(); the event loop is never blocked
+
+        Takes the same arguments and raises the same errors as generate().
+        """
+        if self.breaker is None:
+            return await self._agenerate(prompt, timeout, hedge, kwargs)
+        return await acall_upstream(self.breaker, self._agenerate, prompt, timeout, hedge, kwargs,
+                                    retryable=self._retryable, is_local=self._local_error)
+
+    async def _agenerate(self, prompt, timeout, hedge, kwargs):
+        import asyncio  # Only asyncio callers pay for the import
+        deadline, hedge_delay = self._prepare(timeout, hedge, kwargs)
+        hedge_at = time.monotonic() + hedge_delay if hedge_delay is not None else None
+        started = threading.Event()  # Set once any attempt reaches the model
+        primary = asyncio.wrap_future(self._executor.submit(self._attempt, prompt, kwargs, deadline, started))
+        pending = {primary}
+        hedge_future = None
+        last_error = None
+
+        while pending:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wait_until = min(deadline, hedge_at) if hedge_at and not hedge_future else deadline
+            done, pending = await asyncio.wait(pending, timeout=max(wait_until - now, 0),
+                                               return_when=asyncio.FIRST_COMPLETED)
+
+            for future in done:
+                try:
+                    return self._finish(future, hedge_future)
+                except Exception as e:
+                    last_error = e
+
+            if pending and hedge_at and not hedge_future and time.monotonic() >= hedge_at:
+                self.stats.increment("hedges")
+                hedge_future = asyncio.wrap_future(self._executor.submit(self._attempt, prompt, kwargs, deadline,
+                                                                         started))
+                pending.add(hedge_future)
+
+        return self._fail(pending, last_error, started)
+
+# One shared client per model name for the whole process
+_clients = {}
+_clients_lock = threading.Lock()
+_genai_configured = False
+
+def _create_gemini_model(model_name):
+    """Import and configure google.generativeai on first use, then build the model"""
+    global _genai_configured
+    import google.generativeai as genai
+    with _clients_lock:
+        if not _genai_configured:
+            genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+            _genai_configured = True
+    return genai.GenerativeModel(model_name)
+
+def get_llm_client(model_name='gemini-1.5-flash'):
+    """
+    Get the process-wide LLMClient for a Gemini model, creating it on first use
+
+    The Gemini SDK is only imported, configured and asked for a model when the
+    first call is made, keeping it off the cold-start path. Concurrency and
+    default deadline come from LLM_MAX_CONCURRENCY (default 4) and
+    LLM_TIMEOUT (default 30 seconds). All Gemini models share the "gemini"
+    circuit breaker.
+    """
+    with _clients_lock:
+        client = _clients.get(model_name)
+        if client is None:
+            client = LLMClient(lambda: _create_gemini_model(model_name),
+                               max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 4)),
+                               timeout=float(os.getenv("LLM_TIMEOUT", 30)),
+                               breaker=get_breaker("gemini"))
+            _clients[model_name] = client
+        return client
+
+def llm_stats():
+    """Latency and hedging stats for every shared client, keyed by model name"""
+    with _clients_lock:
+        clients = dict(_clients)
+    stats = {}
+    for name, client in clients.items():
+        stats[name] = client.stats.snapshot()
+        stream = client.stream_stats.snapshot()
+        stats[name]["stream"] = {key: stream[key] for key in ("samples", "p50_ms", "p95_ms", "p99_ms")}
+    return stats
@@ -0,0 +1,131 @@
+import os
+import threading
+
+def parse_html(content, max_length=None):
+    """
+    Extract the title and visible text from an HTML document
+
+    Args:
+        content (bytes): Raw response body
+        max_length (int): Truncate the text to this many characters
+
+    Returns:
+        dict: 'title' and 'content'
+    """
+    from bs4 import BeautifulSoup  # Imported on first use to keep cold start fast
+
+    soup = BeautifulSoup(content, 'html.parser')
+    title = soup.title.string if soup.title else 'No title found'
+    text = soup.get_text(separator='\n', strip=True)
+    if max_length is not None:
+        text = text[:max_length]
+    # Plain str: NavigableString drags the whole parse tree along when pickled
+    return {"title": str(title) if title is not None else None, "content": text}
+
+def _parse_shared(name, size, max_length):
+    """Pool worker: parse a document the caller left in shared memory"""
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        content = bytes(shm.buf[:size])
+    finally:
+        shm.close()
+    return parse_html(content, max_length)
+
+def available_cpus():
+    """CPUs this process may run on (respects affinity/cgroup pinning where the OS exposes it)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+class HTMLParsingPool:
+    """
+    Parses HTML in worker processes so concurrent scrapes don't serialize on the GIL
+
+    Large bodies are handed over through shared memory instead of being
+    pickled through the pool's pipe; only the compact title/text result
+    comes back.
+
+    Args:
+        max_workers (int): Worker processes (default: available CPUs)
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or available_cpus()
+        self.shared_memory_threshold = 64 * 1024  # Smaller bodies are cheaper to pickle
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # spawn: forking a process that runs request threads can deadlock
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                    mp_context=multiprocessing.get_context("spawn"))
+            return self.executor
+
+    def parse(self, content, max_length=None):
+        """
+        Parse an HTML document in a worker process
+
+        Args:
+            content (bytes): Raw response body
+            max_length (int): Truncate the text to this many characters
+
+        Returns:
+            dict: 'title' and 'content', as parse_html
+        """
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        executor = self._get_executor()
+        if len(content) < self.shared_memory_threshold:
+            return executor.submit(parse_html, content, max_length).result()
+
+        from multiprocessing import shared_memory
+        shm = shared_memory.SharedMemory(create=True, size=len(content))
+        try:
+            shm.buf[:len(content)] = content
+            return executor.submit(_parse_shared, shm.name, len(content), max_length).result()
+        finally:
+            shm.close()
+            shm.unlink()
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+
+# One pool per process, shared by every scraper
+_parsing_pool = None
+_parsing_pool_lock = threading.Lock()
+
+def get_parsing_pool():
+    """
+    Get the process-wide HTMLParsingPool, or None to parse in the calling thread
+
+    Enabled by HTML_PARSE_PROCESSES: "auto" sizes the pool from the
+    available CPUs, a number sets it explicitly. Off by default, since on a
+    single vCPU the extra processes only add memory; an invalid value also
+    leaves it off.
+    """
+    global _parsing_pool
+    setting = os.getenv("HTML_PARSE_PROCESSES", "off").strip().lower()
+    if setting in ("", "0", "off", "false", "no"):
+        return None
+    processes = None
+    if setting != "auto":
+        try:
+            processes = int(setting)
+        except ValueError:
+            processes = 0
+        if processes < 1:
+            print(f"Invalid HTML_PARSE_PROCESSES '{setting}', parsing in the calling thread")
+            return None
+    with _parsing_pool_lock:
+        if _parsing_pool is None:
+            _parsing_pool = HTMLParsingPool(processes)
+        return _parsing_pool
@@ -0,0 +1,193 @@
+import json
+import os
+import threading
+import time
+from agent import ResearchCancelled
+from utils import normalize_query
+
+class PrefetchScheduler:
+    """
+    Background thread that runs research for scheduled and popular queries
+    while the worker is idle, so the first real requester hits warm caches
+    (search results, indexed pages and the finished report)
+
+    Candidates, in order:
+    - scheduled queries due this hour (e.g. morning news, evening results)
+    - queries live users asked most often recently (decayed counts)
+    A query is skipped while its cached report is still fresh.
+
+    Prefetching only starts when no live request is running or queued and
+    none arrived for idle_grace seconds, holds an admission slot while it
+    runs (so live requests see the capacity it uses), goes through the
+    same upstream rate limits as live traffic, and is capped per hour.
+    A run that live traffic catches up with is abandoned at the next stage
+    boundary, freeing its upstream quota and threads for the live request.
+
+    Args:
+        agent (WebResearchAgent): Agent whose caches are warmed
+        admission (AdaptiveLimiter): The worker's admission control
+        schedule (list): Dicts with 'query' and optional 'hours' (local hours to run at; all hours if omitted)
+    """
+    def __init__(self, agent, admission, schedule=None):
+        self.agent = agent
+        self.admission = admission
+        self.schedule = schedule or []
+        self.lock = threading.Lock()
+        self.interval = 60  # Seconds between checks
+        self.idle_grace = 30  # Seconds without live requests before prefetching
+        self.max_per_hour = 20  # Caps the upstream cost of prefetching
+        self.half_life = 3600  # Seconds for a query's popularity to halve
+        self.min_popularity = 1.5  # Decayed count needed: about two recent requests
+        self.max_tracked = 500  # Popular queries remembered
+
+        self.popularity = {}  # normalized query -> (decayed count, last update, original query)
+        self.last_live_request = 0
+        self.scheduled_runs = {}  # normalized query -> hour (as "YYYY-MM-DD HH") it last ran
+        self.recent_runs = []  # Start times of prefetches in the last hour
+        self.prefetched = 0
+        self.skipped_busy = 0
+        self.abandoned = 0  # Runs stopped because live traffic arrived
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def record(self, query):
+        """Count a live request and note that the worker is busy"""
+        now = time.time()
+        key = normalize_query(query)
+        with self.lock:
+            self.last_live_request = now
+            count, updated, _ = self.popularity.get(key, (0.0, now, query))
+            self.popularity[key] = (self._decay(count, updated, now) + 1, now, query)
+            if len(self.popularity) > self.max_tracked:
+                # Forget the least popular
+                least = min(self.popularity, key=lambda k: self._decay(*self.popularity[k][:2], now))
+                del self.popularity[least]
+
+    def _decay(self, count, updated, now):
+        return count * 0.5 ** ((now - updated) / self.half_life)
+
+    def candidates(self, now=None):
+        """Queries worth prefetching now, most important first"""
+        now = now or time.time()
+        hour = time.strftime("%Y-%m-%d %H", time.localtime(now))
+        local_hour = time.localtime(now).tm_hour
+        queries = []
+        with self.lock:
+            for entry in self.schedule:
+                key = normalize_query(entry["query"])
+                hours = entry.get("hours")
+                if (hours is None or local_hour in hours) and self.scheduled_runs.get(key) != hour:
+                    queries.append(entry["query"])
+            popular = sorted(((self._decay(count, updated, now), query)
+                              for count, updated, query in self.popularity.values()), reverse=True)
+        queries += [query for score, query in popular if score >= self.min_popularity]
+
+        seen = set()
+        fresh = []
+        for query in queries:
+            key = normalize_query(query)
+            if key in seen or self.agent.has_cached_report(query):
+                continue
+            seen.add(key)
+            fresh.append(query)
+        return fresh
+
+    def is_idle(self):
+        with self.lock:
+            quiet = time.time() - self.last_live_request >= self.idle_grace
+        snapshot = self.admission.snapshot()
+        return quiet and snapshot["in_flight"] == 0 and snapshot["queued"] == 0
+
+    def _live_traffic(self, started):
+        """True once a live request arrived after started (the prefetch itself holds one slot)"""
+        with self.lock:
+            arrived = self.last_live_request > started
+        snapshot = self.admission.snapshot()
+        return arrived or snapshot["in_flight"] > 1 or snapshot["queued"] > 0
+
+    def run_once(self):
+        """Prefetch the top candidate if the worker is idle; returns the query or None"""
+        now = time.time()
+        self.recent_runs = [t for t in self.recent_runs if now - t < 3600]
+        if len(self.recent_runs) >= self.max_per_hour:
+            return None
+        if not self.is_idle():
+            self.skipped_busy += 1
+            return None
+
+        candidates = self.candidates(now)
+        if not candidates:
+            return None
+        ticket = self.admission.acquire(timeout=0)
+        if ticket is None:
+            self.skipped_busy += 1
+            return None
+
+        query = candidates[0]
+        key = normalize_query(query)
+        failed = False
+        measured = True
+        try:
+            print(f"Prefetching: '{query}'")
+            self.recent_runs.append(now)
+            with self.lock:
+                self.scheduled_runs[key] = time.strftime("%Y-%m-%d %H", time.localtime(now))
+            failed = self.agent.research(query, should_stop=lambda: self._live_traffic(now)).startswith(
+                "An error occurred")
+            self.prefetched += 1
+        except ResearchCancelled:
+            print(f"Live traffic arrived, abandoning the prefetch of '{query}'")
+            self.abandoned += 1
+            measured = False  # A partial run says nothing about the worker's latency
+            with self.lock:
+                self.scheduled_runs.pop(key, None)  # Try again at the next idle moment
+        except Exception as e:
+            print(f"Prefetch of '{query}' failed: {e}")
+            failed = True
+        finally:
+            self.admission.release(ticket, failed=failed, measured=measured)
+        return query
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        """Start the background thread (once per process)"""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name="prefetch", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def snapshot(self):
+        now = time.time()
+        with self.lock:
+            popular = sorted(((round(self._decay(count, updated, now), 2), query)
+                              for count, updated, query in self.popularity.values()), reverse=True)[:10]
+        return {"prefetched": self.prefetched, "skipped_busy": self.skipped_busy, "abandoned": self.abandoned,
+                "last_hour": len(self.recent_runs), "popular": popular}
+
+def load_schedule(path):
+    """
+    Read a prefetch schedule: a JSON list of {"query": ..., "hours": [...]}
+    entries or plain query strings. Returns [] if the file can't be read.
+    """
+    if not path:
+        return []
+    try:
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)
+        return [{"query": e} if isinstance(e, str) else e for e in entries
+                if isinstance(e, str) or (isinstance(e, dict) and e.get("query"))]
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Could not load prefetch schedule from {path}: {e}")
+        return []
+
+def schedule_from_env():
+    """PREFETCH_SCHEDULE (JSON file) entries plus PREFETCH_QUERIES ("|"-separated, every hour)"""
+    schedule = load_schedule(os.getenv("PREFETCH_SCHEDULE"))
+    schedule += [{"query": q.strip()} for q in os.getenv("PREFETCH_QUERIES", "").split("|") if q.strip()]
+    return schedule
@@ -0,0 +1,259 @@
+import cProfile
+import contextvars
+import io
+import itertools
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter, OrderedDict
+
+# Threads whose innermost frame is in these modules are idle (waiting for work), not worth a sample
+IDLE_MODULES = ("threading.py", "queue.py", "selectors.py", "socketserver.py")
+
+def collapse_stack(frame):
+    """One thread's stack in collapsed format (root first, ';'-separated)"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ","))
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class StackSampler:
+    """
+    Samples the stacks of all threads every interval seconds and counts
+    them in collapsed format (one "frame;frame;frame count" line per stack,
+    as read by flamegraph.pl and speedscope)
+
+    Samples are wall-clock: a thread blocked on a socket or lock counts
+    where it waits. Idle threads waiting for work are skipped.
+
+    Args:
+        interval (float): Seconds between samples
+        max_stacks (int): Distinct stacks kept; further new stacks are counted as "[other]"
+    """
+    def __init__(self, interval=0.05, max_stacks=5000):
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.lock = threading.Lock()
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def sample(self):
+        """Take one sample of every other thread"""
+        own = threading.get_ident()
+        stacks = []
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own or os.path.basename(frame.f_code.co_filename) in IDLE_MODULES:
+                continue
+            stacks.append(collapse_stack(frame))
+        with self.lock:
+            self.samples += 1
+            for stack in stacks:
+                if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+                    stack = "[other]"
+                self.stacks[stack] += 1
+
+    def _loop(self):
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+
+    def start(self):
+        """Start sampling in a daemon thread (once)"""
+        with self.lock:
+            if self.thread is None:
+                self.stop_event.clear()
+                self.thread = threading.Thread(target=self._loop, name="stack-sampler", daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            thread, self.thread = self.thread, None
+        self.stop_event.set()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def collapsed(self):
+        """The counted stacks as collapsed-format text, hottest first"""
+        with self.lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def reset(self):
+        with self.lock:
+            self.stacks.clear()
+            self.samples = 0
+            self.started_at = time.time()
+
+    def snapshot(self):
+        with self.lock:
+            return {"running": self.thread is not None, "interval": self.interval,
+                    "samples": self.samples, "stacks": len(self.stacks),
+                    "since": round(self.started_at, 1)}
+
+# Profiles of the worker-thread tasks of the request being cProfiled, if any
+_task_profiles = contextvars.ContextVar("task_profiles", default=None)
+
+# Before 3.12 cProfile only sees the thread it is enabled in; from 3.12 on it
+# uses sys.monitoring, which covers every thread but allows one profiler at a time
+PER_THREAD_PROFILERS = sys.version_info < (3, 12)
+
+def profiled_task(func, *args, **kwargs):
+    """
+    Run an executor task of a request; while the request is cProfiled (before
+    Python 3.12), under a profiler of its own that ProfileStore.run() merges
+    into the request's profile. Submit it through
+    contextvars.copy_context().run so it sees the request.
+
+    Profiling never fails the task: if the profiler can't be enabled, func
+    runs unprofiled.
+    """
+    profiles = _task_profiles.get()
+    if profiles is None or not PER_THREAD_PROFILERS:
+        return func(*args, **kwargs)
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:  # Another profiling tool is active
+        print(f"Could not profile task {getattr(func, '__name__', func)}: {e}")
+        return func(*args, **kwargs)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profiles.append(profiler)
+
+class ProfileStore:
+    """
+    Profiles single research runs on request and keeps the most recent ones
+
+    Modes:
+    - "cprofile": deterministic profile of the request thread plus the
+      worker-thread tasks it submits through profiled_task() (scraping,
+      parsing, content analysis), merged; exported as a pstats file. Work in
+      other processes (the HTML parsing pool) and in the LLM client's own
+      threads is not included before Python 3.12; from 3.12 on the profile
+      covers every thread in the process. Only one runs at a time (each one
+      slows its request down); others, and runs while another profiling
+      tool is active, fall back to "sample"
+    - "sample": stacks of all threads, including the scrape workers, every
+      5 ms while the run lasts; exported as collapsed stacks. Concurrent
+      requests show up in it too
+
+    Args:
+        max_profiles (int): Profiles kept; the oldest are dropped
+    """
+    MODES = ("cprofile", "sample")
+
+    def __init__(self, max_profiles=20):
+        self.max_profiles = max_profiles
+        self.lock = threading.Lock()
+        self.cprofile_lock = threading.Lock()
+        self.profiles = OrderedDict()
+        self.ids = itertools.count(1)
+        self.armed = 0  # Next requests to profile, set from the admin endpoint
+        self.armed_mode = "cprofile"
+        self.sample_interval = 0.005
+
+    def arm(self, count, mode="cprofile"):
+        """Profile the next count research requests"""
+        with self.lock:
+            self.armed = max(0, int(count))
+            self.armed_mode = mode
+
+    def take_armed(self):
+        """The mode to profile the current request with, or None"""
+        with self.lock:
+            if self.armed <= 0:
+                return None
+            self.armed -= 1
+            return self.armed_mode
+
+    def run(self, mode, label, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs), profiling it with the given mode
+
+        Returns:
+            tuple: (func's result, profile id)
+        """
+        started = time.time()
+        if mode == "cprofile" and self.cprofile_lock.acquire(blocking=False):
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:  # Another profiling tool is active
+                print(f"cProfile unavailable, sampling instead: {e}")
+                self.cprofile_lock.release()
+            else:
+                return self._run_cprofile(profiler, label, started, func, *args, **kwargs)
+
+        sampler = StackSampler(interval=self.sample_interval)
+        sampler.start()
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            sampler.stop()
+            profile_id = self._store("sample", label, started, sampler.collapsed().encode("utf-8"), None)
+        return result, profile_id
+
+    def _run_cprofile(self, profiler, label, started, func, *args, **kwargs):
+        """Call func under the enabled profiler, merge in its tasks' profiles and store the result"""
+        task_profiles = []
+        token = _task_profiles.set(task_profiles)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            _task_profiles.reset(token)
+            self.cprofile_lock.release()
+            summary = io.StringIO()
+            stats = pstats.Stats(profiler, stream=summary)
+            # Tasks still running (e.g. abandoned scrapes) are left out
+            for task_profiler in list(task_profiles):
+                stats.add(task_profiler)
+            data = marshal.dumps(stats.stats)  # The pstats file format
+            stats.sort_stats("cumulative").print_stats(40)
+            profile_id = self._store("cprofile", label, started, data, summary.getvalue())
+        return result, profile_id
+
+    def _store(self, mode, label, started, data, summary):
+        with self.lock:
+            profile_id = str(next(self.ids))
+            self.profiles[profile_id] = {"id": profile_id, "mode": mode, "label": label,
+                                         "started": round(started, 1),
+                                         "duration": round(time.time() - started, 3),
+                                         "data": data, "summary": summary}
+            while len(self.profiles) > self.max_profiles:
+                self.profiles.popitem(last=False)
+        print(f"Stored {mode} profile {profile_id} of '{label}'")
+        return profile_id
+
+    def get(self, profile_id):
+        with self.lock:
+            return self.profiles.get(profile_id)
+
+    def list(self):
+        """Metadata of the stored profiles, oldest first"""
+        with self.lock:
+            return [{k: v for k, v in p.items() if k not in ("data", "summary")} for p in self.profiles.values()]
+
+# One always-on sampler per process, when PROFILE_SAMPLING=on
+stack_sampler = None
+stack_sampler_lock = threading.Lock()
+
+def get_stack_sampler():
+    """Return the process's StackSampler, created (not started) on first use"""
+    global stack_sampler
+    if stack_sampler is None:
+        with stack_sampler_lock:
+            if stack_sampler is None:
+                stack_sampler = StackSampler(interval=float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.05)))
+    return stack_sampler
+
+def sampling_enabled():
+    return os.getenv("PROFILE_SAMPLING", "off").lower() in ("on", "1", "true")
@@ -0,0 +1,159 @@
+import re
+import math
+from utils import split_sentences, get_env_variable
+
+# Words that carry no topical signal for relevance scoring
+STOPWORDS = frozenset("""
+a an and are as at be but by can did do does for from has have how i in is it its
+last latest me my new not of on or our so than that the their them there these they
+this to was we were what when where which who why will with you your about into
+""".split())
+
+# Queries about recent events: term overlap can't tell a stale page from a fresh one
+TIME_SENSITIVE_TERMS = ("score", "match", "game", "won", "win", "ipl", "cricket", "football", "soccer", "nba", "nfl",
+                        "latest", "today", "yesterday", "tonight", "last night", "news", "current", "this week")
+
+def tokenize(text):
+    """Lowercase word tokens of text without stopwords or single characters"""
+    return [t for t in re.findall(r'\w+', text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+def _aspect_list(key_aspects):
+    """Key aspects as a list of strings; they may arrive as a list or a single string"""
+    if isinstance(key_aspects, str):
+        key_aspects = [key_aspects]
+    return [a for a in (key_aspects or []) if isinstance(a, str)]
+
+def _aspect_terms(key_aspects):
+    """Tokens of the key aspects"""
+    return set(tokenize(" ".join(_aspect_list(key_aspects))))
+
+class LocalRelevanceScorer:
+    """
+    Cheap lexical relevance model used in front of the Gemini analysis
+
+    Scores a page on a 0-10 scale from how many query and key-aspect terms
+    it contains and how often (BM25-style saturation). Confident rejects and
+    accepts are decided locally; the uncertain middle band is escalated to
+    the LLM. Repeating the query's words is not enough for an accept: it
+    also needs key aspects, every one of them mentioned, and a query that
+    isn't about recent events (sports, news), where a stale page matches as
+    well as a fresh one.
+    """
+    def __init__(self, reject_below=None, accept_above=None):
+        # Band thresholds on the 0-10 scale; scores in between go to the LLM
+        self.reject_below = float(reject_below if reject_below is not None
+                                  else get_env_variable("CASCADE_REJECT_BELOW", 1.5))
+        self.accept_above = float(accept_above if accept_above is not None
+                                  else get_env_variable("CASCADE_ACCEPT_ABOVE", 7.5))
+        self.k1 = 1.2  # Term frequency saturation
+        self.query_weight = 0.7  # Share of the score from query terms vs. key aspects
+        self.max_summary_length = 1500
+
+    def score(self, text, query, key_aspects=None):
+        """
+        Score text relevance to a query on a 0-10 scale
+
+        Args:
+            text (str): Page text
+            query (str): User query
+            key_aspects (list): Optional key aspects from query analysis
+
+        Returns:
+            float: Relevance score
+        """
+        return self._score(self._term_counts(text), query, key_aspects)
+
+    @staticmethod
+    def _term_counts(text):
+        term_counts = {}
+        for token in tokenize(text):
+            term_counts[token] = term_counts.get(token, 0) + 1
+        return term_counts
+
+    def _score(self, term_counts, query, key_aspects):
+        query_score = self._coverage(set(tokenize(query)), term_counts)
+        aspect_terms = _aspect_terms(key_aspects)
+        if not aspect_terms:
+            return round(10 * query_score, 2)
+
+        aspect_score = self._coverage(aspect_terms, term_counts)
+        return round(10 * (self.query_weight * query_score + (1 - self.query_weight) * aspect_score), 2)
+
+    def _coverage(self, terms, term_counts):
+        """Mean per-term credit: 0.5 for being present, up to 1.0 as it repeats"""
+        if not terms:
+            return 0.0
+        total = 0.0
+        for term in terms:
+            tf = term_counts.get(term, 0)
+            if tf:
+                total += 0.5 + 0.5 * tf / (tf + self.k1)
+        return total / len(terms)
+
+    def assess(self, text, query, key_aspects=None):
+        """
+        Decide locally whether a page is relevant, or escalate it
+
+        Args:
+            text (str): Page text
+            query (str): User query
+            key_aspects (list): Optional key aspects from query analysis
+
+        Returns:
+            dict: 'decision' ("reject", "accept" or "escalate") and 'relevance_score'
+        """
+        if not tokenize(query) and not _aspect_terms(key_aspects):
+            # Nothing to match on (e.g. an all-stopword query), let the LLM judge
+            return {"decision": "escalate", "relevance_score": None}
+
+        term_counts = self._term_counts(text)
+        score = self._score(term_counts, query, key_aspects)
+        if score < self.reject_below:
+            decision = "reject"
+        elif score >= self.accept_above and self._may_accept(term_counts, query, key_aspects):
+            decision = "accept"
+        else:
+            decision = "escalate"
+        return {"decision": decision, "relevance_score": score}
+
+    def _may_accept(self, term_counts, query, key_aspects):
+        """A local accept needs key aspects, each mentioned, for a query that isn't about recent events"""
+        if any(term in query.lower() for term in TIME_SENSITIVE_TERMS):
+            return False
+        aspects = [set(tokenize(aspect)) for aspect in _aspect_list(key_aspects)]
+        aspects = [terms for terms in aspects if terms]
+        return bool(aspects) and all(any(term in term_counts for term in terms) for terms in aspects)
+
+    def summarize(self, text, query, key_aspects=None):
+        """
+        Extractive summary: the sentences with the most query/aspect terms, in page order
+
+        Args:
+            text (str): Page text
+            query (str): User query
+            key_aspects (list): Optional key aspects from query analysis
+
+        Returns:
+            str: Summary of at most max_summary_length characters
+        """
+        terms = set(tokenize(query))
+        terms.update(_aspect_terms(key_aspects))
+
+        sentences = split_sentences(text)
+        scored = []
+        for position, sentence in enumerate(sentences):
+            hits = sum(1 for token in set(tokenize(sentence)) if token in terms)
+            if hits:
+                # Favor dense sentences over long ones that merely mention a term
+                scored.append((hits / math.log(len(sentence) + 2), position))
+
+        chosen = []
+        length = 0
+        for _, position in sorted(scored, reverse=True):
+            sentence_length = len(sentences[position]) + 1
+            if length + sentence_length > self.max_summary_length:
+                continue
+            chosen.append(position)
+            length += sentence_length
+
+        return " ".join(sentences[position] for position in sorted(chosen))
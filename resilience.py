@@ -0,0 +1,244 @@
+import contextvars
+import os
+import random
+import threading
+import time
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling an upstream whose circuit is open"""
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one upstream API (Gemini, SerpAPI)
+
+    After failure_threshold consecutive failures the circuit opens and calls
+    fail immediately with CircuitOpenError. Once reset_timeout seconds have
+    passed it goes half-open: a single probe call is let through, and its
+    outcome closes the circuit again or re-opens it for another period.
+
+    Args:
+        name (str): Upstream name, for logs and stats
+        failure_threshold (int): Consecutive failures that open the circuit
+        reset_timeout (float): Seconds the circuit stays open before probing
+    """
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.lock = threading.Lock()
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0
+        self.probe_in_flight = False
+        self.opens = 0
+        self.rejected = 0
+
+    def allow(self):
+        """True if a call may go ahead (in half-open state, reserves the probe)"""
+        with self.lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self.probe_in_flight = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self.probe_in_flight:
+                self.probe_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def is_open(self):
+        """True while calls would be rejected (open, or half-open with the probe out)"""
+        with self.lock:
+            if self.state == "open":
+                return time.monotonic() - self.opened_at < self.reset_timeout
+            return self.state == "half_open" and self.probe_in_flight
+
+    def record_success(self):
+        with self.lock:
+            if self.state != "closed":
+                print(f"{self.name} circuit closed")
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"{self.name} circuit opened after {self.consecutive_failures} failures")
+                    self.opens += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self.probe_in_flight = False
+
+    def release_probe(self):
+        """Give back a half-open probe whose call ended without an outcome"""
+        with self.lock:
+            self.probe_in_flight = False
+
+    def snapshot(self):
+        with self.lock:
+            return {"state": self.state, "consecutive_failures": self.consecutive_failures,
+                    "opens": self.opens, "rejected": self.rejected}
+
+class RetryBudget:
+    """
+    Seconds one request may spend on retries (backoff waits plus the retried
+    calls themselves), across all its upstream calls and threads
+
+    Args:
+        seconds (float): Total retry time allowed
+    """
+    def __init__(self, seconds):
+        self.remaining = seconds
+        self.lock = threading.Lock()
+
+    def take(self, delay):
+        """Spend delay seconds of the budget; False (and nothing spent) if it doesn't fit"""
+        with self.lock:
+            if delay > self.remaining:
+                return False
+            self.remaining -= delay
+            return True
+
+    def spend(self, seconds):
+        """Charge the time a retried call took (may leave the budget overdrawn)"""
+        with self.lock:
+            self.remaining -= seconds
+
+# The current request's retry budget; copied into the threads and tasks it starts
+_retry_budget = contextvars.ContextVar("retry_budget", default=None)
+
+def set_retry_budget(seconds):
+    """Give the current request a retry budget; returns a token for reset_retry_budget()"""
+    return _retry_budget.set(RetryBudget(seconds))
+
+def reset_retry_budget(token):
+    _retry_budget.reset(token)
+
+def current_retry_budget():
+    """The current request's RetryBudget, or None outside a request (no retries)"""
+    return _retry_budget.get()
+
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """Full-jitter exponential backoff: uniform in [0, min(cap, base * 2^attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+def _charge_retry(attempt, start_time):
+    """Charge a retried call's duration to the request's budget"""
+    budget = current_retry_budget()
+    if attempt > 1 and budget is not None:
+        budget.spend(time.monotonic() - start_time)
+
+def _next_delay(breaker, attempt, max_attempts, error, retryable):
+    """Seconds to wait before retrying, or None to give up"""
+    if attempt >= max_attempts or isinstance(error, CircuitOpenError) or (retryable and not retryable(error)):
+        return None
+    budget = current_retry_budget()
+    delay = backoff_delay(attempt)
+    if budget is None or not budget.take(delay):
+        return None
+    print(f"{breaker.name} call failed ({error}), retrying in {delay:.2f}s")
+    return delay
+
+def call_upstream(breaker, func, *args, max_attempts=3, is_failure=None, retryable=None, is_local=None, **kwargs):
+    """
+    Call func through a circuit breaker, retrying failures with jittered
+    backoff while the request's retry budget lasts
+
+    Args:
+        breaker (CircuitBreaker): The upstream's breaker
+        func (callable): The call
+        max_attempts (int): Attempts at most, including the first
+        is_failure (callable): Returns True for a result that is an upstream error (e.g. an error payload)
+        retryable (callable): Returns False for errors not worth retrying (e.g. timeouts)
+        is_local (callable): Returns True for errors raised before the upstream was reached
+            (e.g. no free local slot); they are re-raised without counting against the breaker
+
+    Raises:
+        CircuitOpenError: If the circuit is open
+    """
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise CircuitOpenError(f"{breaker.name} is unavailable (circuit open)")
+        attempt += 1
+        start_time = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+            if is_failure is not None and is_failure(result):
+                raise RuntimeError(f"{breaker.name} returned an error: {str(result)[:200]}")
+        except Exception as e:
+            if is_local is not None and is_local(e):
+                breaker.release_probe()
+                raise
+            breaker.record_failure()
+            _charge_retry(attempt, start_time)
+            delay = _next_delay(breaker, attempt, max_attempts, e, retryable)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        _charge_retry(attempt, start_time)
+        return result
+
+async def acall_upstream(breaker, func, *args, max_attempts=3, is_failure=None, retryable=None, is_local=None,
+                         **kwargs):
+    """asyncio version of call_upstream(); func is a coroutine function"""
+    import asyncio
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise CircuitOpenError(f"{breaker.name} is unavailable (circuit open)")
+        attempt += 1
+        start_time = time.monotonic()
+        try:
+            result = await func(*args, **kwargs)
+            if is_failure is not None and is_failure(result):
+                raise RuntimeError(f"{breaker.name} returned an error: {str(result)[:200]}")
+        except asyncio.CancelledError:
+            # Not the upstream's fault; let another call probe it
+            breaker.release_probe()
+            raise
+        except Exception as e:
+            if is_local is not None and is_local(e):
+                breaker.release_probe()
+                raise
+            breaker.record_failure()
+            _charge_retry(attempt, start_time)
+            delay = _next_delay(breaker, attempt, max_attempts, e, retryable)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        _charge_retry(attempt, start_time)
+        return result
+
+# One breaker per upstream for the whole process
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name):
+    """
+    Get the process-wide CircuitBreaker for an upstream, creating it on first use
+
+    Thresholds come from BREAKER_FAILURE_THRESHOLD (default 5) and
+    BREAKER_RESET_TIMEOUT (default 30 seconds).
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name, failure_threshold=int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5)),
+                                     reset_timeout=float(os.getenv("BREAKER_RESET_TIMEOUT", 30)))
+            _breakers[name] = breaker
+        return breaker
+
+def breaker_stats():
+    """State of every upstream's breaker, keyed by name"""
+    with _breakers_lock:
+        breakers = dict(_breakers)
+    return {name: breaker.snapshot() for name, breaker in breakers.items()}
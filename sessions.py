@@ -0,0 +1,60 @@
+import threading
+from utils import TTLCache, get_env_variable, canonicalize_url
+
+class SessionStore:
+    """
+    Bounded in-memory store of research sessions for follow-up queries
+
+    Each session keeps its previous queries and the pages scraped for them
+    (URL, title, extracted text), so a follow-up can be answered from
+    material that was already gathered. Sessions expire after a period of
+    inactivity and the least recently used are evicted beyond max_sessions.
+    Sessions live in the worker process, so a follow-up routed to another
+    worker simply starts fresh.
+    """
+    def __init__(self, max_sessions=None, ttl=None, max_pages=20, max_queries=5):
+        self.sessions = TTLCache(maxsize=int(max_sessions or get_env_variable("SESSION_MAX_SESSIONS", 200)),
+                                 ttl=float(ttl or get_env_variable("SESSION_TTL", 1800)))
+        self.max_pages = max_pages  # Per session, most recent kept
+        self.max_queries = max_queries
+        self.lock = threading.Lock()
+
+    def get(self, session_id):
+        """
+        Get a copy of a session's material
+
+        Args:
+            session_id (str): Session id supplied by the client
+
+        Returns:
+            dict: 'queries' and 'pages' (list of {url, title, content}), both
+                  oldest first and empty for an unknown or expired session
+        """
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return {"queries": [], "pages": []}
+            return {"queries": list(session["queries"]), "pages": list(session["pages"].values())}
+
+    def add(self, session_id, query, pages):
+        """
+        Record a query and the pages scraped for it
+
+        Args:
+            session_id (str): Session id supplied by the client
+            query (str): The query just researched
+            pages (list): Dicts with 'url', 'title' and 'content'
+        """
+        with self.lock:
+            session = self.sessions.get(session_id) or {"queries": [], "pages": {}}
+            session["queries"] = (session["queries"] + [query])[-self.max_queries:]
+            for page in pages:
+                if page.get("content"):
+                    url = canonicalize_url(page["url"])
+                    session["pages"].pop(url, None)
+                    session["pages"][url] = {"url": page["url"], "title": page.get("title", ""),
+                                             "content": page["content"]}
+            while len(session["pages"]) > self.max_pages:
+                session["pages"].pop(next(iter(session["pages"])))
+            # Re-setting refreshes the session's TTL
+            self.sessions.set(session_id, session)
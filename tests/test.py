@@ -1,5 +1,5 @@
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, MagicMock, AsyncMock
 import json
 import sys
 import os
@@ -8,8 +8,37 @@ import time
 # Add the parent directory to the path so we can import the modules
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from agent import WebResearchAgent
+# Keep persisted runtime state (domain stats) out of the shared temp files
+import tempfile
+import pstats
+TEST_STATE_DIR = tempfile.mkdtemp(prefix="web_research_tests_")
+os.environ["DOMAIN_STATS_PATH"] = os.path.join(TEST_STATE_DIR, "domain_stats.json")
+os.environ["KNOWLEDGE_INDEX_DIR"] = os.path.join(TEST_STATE_DIR, "index")
+# Deeper search rounds add upstream calls; tests that count them enable them explicitly
+os.environ["MAX_SEARCH_ROUNDS"] = "1"
+# Mocked upstream failures would otherwise trip the process-wide breakers for later tests
+os.environ["BREAKER_FAILURE_THRESHOLD"] = "1000"
+
+from agent import WebResearchAgent, ResearchContext, DEGRADED_REPORT_NOTE
 from tools import WebSearchTool, WebScraperTool, ContentAnalyzerTool, NewsAggregatorTool
+from utils import SharedRateLimiter, pack_context, estimate_tokens, TTLCache, canonicalize_url
+from sessions import SessionStore
+from knowledge_index import KnowledgeIndex
+from parsing import HTMLParsingPool, parse_html
+from async_agent import AsyncWebResearchAgent
+from admission import AdaptiveLimiter
+from prefetch import PrefetchScheduler
+from profiling import ProfileStore, StackSampler
+from cassettes import Cassette, CassetteMiss, install
+import asgi
+from relevance import LocalRelevanceScorer
+from llm import LLMClient, LLMTimeoutError, LLMSlotTimeoutError
+from depth import resolve_depth
+from resilience import CircuitBreaker, CircuitOpenError, call_upstream, set_retry_budget, reset_retry_budget
+import asyncio
+import threading
+import bulk_research
+from domain_stats import DomainStats
 
 class TestWebResearchAgent(unittest.TestCase):
     def setUp(self):
@@ -306,5 +335,1602 @@ class TestWebResearchAgent(unittest.TestCase):
         # Check final result
         self.assertTrue(result.startswith("Final research report"))
 
+class TestOverprovisionedExtraction(unittest.TestCase):
+    def setUp(self):
+        self.agent = WebResearchAgent()
+        self.agent.max_extracted_sources = 2
+        self.agent.scrape_overprovision = 1
+
+    def _scrape(self, url):
+        if "slow" in url:
+            time.sleep(2)
+        if "broken" in url:
+            return {"title": "Error loading page", "content": "", "url": url}
+        return {"title": url, "content": f"Content of {url}", "url": url}
+
+    @patch('tools.ContentAnalyzerTool.analyze')
+    @patch('tools.WebScraperTool.scrape')
+    def test_stops_after_enough_sources_and_replaces_failures(self, mock_scrape, mock_analyze):
+        mock_scrape.side_effect = self._scrape
+        mock_analyze.return_value = {"relevance_score": 8, "relevant_content": "Relevant", "source_quality": 6}
+        urls = ["http://slow.example.com", "http://broken.example.com",
+                "http://a.example.com", "http://b.example.com", "http://c.example.com"]
+
+        start_time = time.time()
+        results = self.agent.extract_content([{"link": url} for url in urls], "test query")
+
+        # The slow host is abandoned and the broken one replaced by the next candidates
+        self.assertLess(time.time() - start_time, 1.5)
+        self.assertEqual(sorted(r["url"] for r in results), ["http://a.example.com", "http://b.example.com"])
+
+    @patch('tools.ContentAnalyzerTool.analyze')
+    @patch('tools.WebScraperTool.scrape')
+    def test_stragglers_are_not_analyzed_after_the_stop(self, mock_scrape, mock_analyze):
+        def scrape(url):
+            if "slow" in url:
+                time.sleep(0.3)
+            return {"title": url, "content": f"Content of {url}", "url": url}
+        mock_scrape.side_effect = scrape
+        mock_analyze.return_value = {"relevance_score": 8, "relevant_content": "Relevant", "source_quality": 6}
+        urls = ["http://slow1.example.com", "http://a.example.com", "http://b.example.com"]
+
+        results = self.agent.extract_content([{"link": url} for url in urls], "test query")
+        self.assertEqual(len(results), 2)
+        time.sleep(0.5)  # The slow scrape finishes after extraction stopped
+
+        self.assertEqual(mock_scrape.call_count, 3)
+        self.assertEqual(mock_analyze.call_count, 2)
+
+    @patch('tools.ContentAnalyzerTool.analyze')
+    @patch('tools.WebScraperTool.scrape')
+    def test_irrelevant_candidates_are_replaced(self, mock_scrape, mock_analyze):
+        mock_scrape.side_effect = self._scrape
+        mock_analyze.side_effect = lambda text, query, **kwargs: {
+            "relevance_score": 2 if "irrelevant" in text else 7, "relevant_content": text}
+        urls = ["http://irrelevant1.example.com", "http://irrelevant2.example.com",
+                "http://a.example.com", "http://b.example.com"]
+
+        results = self.agent.extract_content([{"link": url} for url in urls], "test query")
+
+        self.assertEqual(len(results), 2)
+        self.assertEqual(mock_scrape.call_count, 4)
+
+    @patch('tools.ContentAnalyzerTool.analyze')
+    @patch('tools.WebScraperTool.scrape')
+    def test_quorum_of_strong_sources_stops_extraction(self, mock_scrape, mock_analyze):
+        self.agent.max_extracted_sources = 5
+        self.agent.scrape_concurrency = 1
+        mock_scrape.side_effect = self._scrape
+        mock_analyze.side_effect = lambda text, query, **kwargs: {
+            "relevance_score": 9 if "strong" in text else 6, "relevant_content": "Short"}
+        urls = ["http://weak.example.com", "http://strong1.example.com", "http://strong2.example.com",
+                "http://a.example.com", "http://b.example.com"]
+
+        results = self.agent.extract_content([{"link": url} for url in urls], "who won the match",
+                                             quorum=self.agent.quorum["sports"])
+        self.assertEqual(len(results), 3)
+        self.assertEqual(mock_scrape.call_count, 3)
+
+        # Without a quorum every candidate is tried
+        mock_scrape.reset_mock()
+        self.agent.extract_content([{"link": url} for url in urls], "test query")
+        self.assertEqual(mock_scrape.call_count, 5)
+
+    @patch('tools.ContentAnalyzerTool.analyze')
+    @patch('tools.WebScraperTool.scrape')
+    def test_quorum_stop_cuts_upstream_work(self, mock_scrape, mock_analyze):
+        self.agent.max_extracted_sources = 5
+        self.agent.scrape_concurrency = 3
+
+        def scrape(url):
+            if "slow" in url:
+                time.sleep(0.3)
+            return {"title": url, "content": f"Content of {url}", "url": url}
+        mock_scrape.side_effect = scrape
+        mock_analyze.return_value = {"relevance_score": 9, "relevant_content": "Short"}
+        urls = ["http://slow.example.com", "http://strong1.example.com", "http://strong2.example.com"]
+
+        results = self.agent.extract_content([{"link": url} for url in urls], "who won the match",
+                                             quorum=self.agent.quorum["sports"])
+        self.assertEqual(len(results), 2)
+        time.sleep(0.5)  # The slow scrape finishes after the quorum was reached
+
+        self.assertEqual(mock_analyze.call_count, 2)
+
+    def test_quorum_by_budget_and_query_type(self):
+        long_source = {"relevance_score": 9, "content": "word " * (self.agent.synthesis_token_budget * 4)}
+        self.assertTrue(self.agent._quorum_reached([long_source], self.agent.quorum["general"]))
+        self.assertFalse(self.agent._quorum_reached([dict(long_source, relevance_score=7)],
+                                                    self.agent.quorum["general"]))
+        # The cascade's local accepts aren't LLM-verified and don't count
+        local_sources = [{"relevance_score": 9, "content": "Short", "scored_by": "local"}] * 3
+        self.assertFalse(self.agent._quorum_reached(local_sources, self.agent.quorum["general"]))
+        self.assertTrue(self.agent._quorum_reached([dict(item, scored_by="llm") for item in local_sources],
+                                                   self.agent.quorum["general"]))
+        self.assertEqual(ResearchContext("who won the IPL match").query_type, "sports")
+        self.assertEqual(ResearchContext("latest news on solar").query_type, "news")
+
+class TestDomainStats(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "stats.json")
+        self.stats = DomainStats(self.path)
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_repeated_failures_open_circuit(self):
+        for _ in range(3):
+            self.stats.record_fetch("https://www.paywalled.com/article", 10.0, 0, failed=True)
+
+        self.assertTrue(self.stats.is_open("https://paywalled.com/other"))
+        results = self.stats.rank([{"link": "https://paywalled.com/x"}, {"link": "https://ok.com/y"}])
+        self.assertEqual(results, [{"link": "https://ok.com/y"}])
+
+    def test_short_pages_count_as_failures(self):
+        self.stats.record_fetch("https://blocked.com/", 0.5, 40)
+        self.assertEqual(self.stats.snapshot()["blocked.com"]["failures"], 1)
+
+    def test_low_relevance_domains_are_deprioritized(self):
+        for _ in range(3):
+            self.stats.record_fetch("https://spam.com/page", 0.5, 2000)
+            self.stats.record_relevance("https://spam.com/page", 1)
+
+        ranked = self.stats.rank([{"link": "https://spam.com/a"}, {"link": "https://good.com/b"}])
+        self.assertEqual(ranked[0]["link"], "https://good.com/b")
+
+    def test_stats_persist_across_restarts(self):
+        self.stats.record_fetch("https://slow.com/", 7.5, 1500)
+        self.stats.save()
+
+        reloaded = DomainStats(self.path)
+        self.assertEqual(reloaded.snapshot()["slow.com"]["latency_ewma"], 7.5)
+
+    @patch('requests.get')
+    def test_scraper_records_http_errors(self, mock_get):
+        mock_get.return_value = MagicMock(status_code=403, content=b"<html>Access denied</html>")
+        scraper = WebScraperTool()
+        scraper.domain_stats = self.stats
+
+        result = scraper.scrape("https://forbidden.com/page")
+
+        self.assertEqual(result["content"], "")
+        self.assertEqual(self.stats.snapshot()["forbidden.com"]["failures"], 1)
+
+class FakeStreamResponse:
+    """Streaming Gemini response that records how many chunks were consumed"""
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.consumed = 0
+        self.text = "".join(chunks)
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.consumed += 1
+            yield MagicMock(text=chunk)
+
+class TestContentAnalyzerStreaming(unittest.TestCase):
+    def setUp(self):
+        self.analyzer = ContentAnalyzerTool()
+        self.analyzer.min_request_interval = 0
+        self.analyzer.cascade = None  # Exercise the LLM path directly
+
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_low_score_aborts_stream(self, mock_generate):
+        stream = FakeStreamResponse(['{"relevance_score": 2,', ' "source_quality": 6,',
+                                     ' "relevant_content": "long text"', '}'])
+        mock_generate.return_value = stream
+
+        result = self.analyzer.analyze("Some page text", "test query", min_relevance=5)
+
+        self.assertEqual(mock_generate.call_args.kwargs.get("stream"), True)
+        self.assertEqual(result["relevance_score"], 2)
+        self.assertEqual(result["relevant_content"], "")
+        # Generation stopped right after the score arrived
+        self.assertEqual(stream.consumed, 1)
+
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_score_is_not_read_before_it_is_complete(self, mock_generate):
+        # "1" followed by "0" must be read as 10, not 1
+        stream = FakeStreamResponse(['{"relevance_score": 1', '0, "source_quality": 8, ',
+                                     '"relevant_content": "Useful facts"}'])
+        mock_generate.return_value = stream
+
+        result = self.analyzer.analyze("Some page text", "test query", min_relevance=5)
+
+        self.assertEqual(result["relevance_score"], 10)
+        self.assertEqual(result["relevant_content"], "Useful facts")
+        self.assertEqual(stream.consumed, 3)
+
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_no_threshold_does_not_stream(self, mock_generate):
+        mock_response = MagicMock()
+        mock_response.text = json.dumps({"relevance_score": 2, "relevant_content": "Text", "source_quality": 4})
+        mock_generate.return_value = mock_response
+
+        result = self.analyzer.analyze("Some page text", "test query")
+
+        self.assertNotIn("stream", mock_generate.call_args.kwargs)
+        self.assertEqual(result["relevant_content"], "Text")
+
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_analyses_cached_by_text_query_and_prompt(self, mock_generate):
+        mock_response = MagicMock()
+        mock_response.text = json.dumps({"relevance_score": 8, "relevant_content": "Text", "source_quality": 6})
+        mock_generate.return_value = mock_response
+
+        self.analyzer.analyze("Match report text", "Who won the final?")
+        result = self.analyzer.analyze("Match report text", "who won the  final")
+        self.assertEqual(result["relevance_score"], 8)
+        self.assertEqual(mock_generate.call_count, 1)
+
+        # Different text, or a changed prompt template, is analyzed again
+        self.analyzer.analyze("Another report", "who won the final")
+        with patch.object(ContentAnalyzerTool, '_build_prompt', return_value="New template"):
+            self.analyzer.analyze("Match report text", "who won the final")
+        self.assertEqual(mock_generate.call_count, 3)
+
+class TestRelevanceCascade(unittest.TestCase):
+    RELEVANT_TEXT = ("Coral reefs suffer mass bleaching during marine heatwaves caused by climate change. "
+                     "Bleaching happens when corals expel their algae. Ocean acidification weakens coral reefs. "
+                     "Reef recovery after bleaching takes years.")
+
+    def setUp(self):
+        self.analyzer = ContentAnalyzerTool()
+        self.analyzer.min_request_interval = 0
+        self.aspects = ["bleaching", "ocean acidification"]
+
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_confident_reject_skips_llm(self, mock_generate):
+        result = self.analyzer.analyze("Book snorkelling tours from Cairns today.",
+                                       "climate change coral reefs", key_aspects=self.aspects)
+
+        mock_generate.assert_not_called()
+        self.assertEqual(result["scored_by"], "local")
+        self.assertLess(result["relevance_score"], 5)
+
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_confident_accept_uses_extractive_summary(self, mock_generate):
+        result = self.analyzer.analyze(self.RELEVANT_TEXT, "climate change coral reefs", key_aspects=self.aspects)
+
+        mock_generate.assert_not_called()
+        self.assertGreaterEqual(result["relevance_score"], self.analyzer.cascade.accept_above)
+        self.assertIn("bleaching", result["relevant_content"])
+
+    @patch('google.generativeai.GenerativeModel.generate_content')
+    def test_uncertain_band_escalates_to_llm(self, mock_generate):
+        mock_response = MagicMock()
+        mock_response.text = json.dumps({"relevance_score": 6, "relevant_content": "Some facts", "source_quality": 7})
+        mock_generate.return_value = mock_response
+        self.analyzer.cascade = LocalRelevanceScorer(reject_below=0, accept_above=10.1)
+
+        result = self.analyzer.analyze(self.RELEVANT_TEXT, "climate change coral reefs", key_aspects=self.aspects)
+
+        mock_generate.assert_called_once()
+        self.assertEqual(result["relevance_score"], 6)
+
+    def test_term_repetition_alone_is_not_a_local_accept(self):
+        scorer = LocalRelevanceScorer()
+        # A stale results page matches a recent-events query as well as a fresh one
+        ipl_history = ("IPL history: who won the IPL final each season. Chennai won the IPL in 2010. "
+                       "Mumbai won the IPL last night of the 2013 season, and won again in 2015.")
+        decision = scorer.assess(ipl_history, "who won ipl last night")
+        self.assertGreaterEqual(decision["relevance_score"], scorer.accept_above)
+        self.assertEqual(decision["decision"], "escalate")
+
+        # Without key aspects, repeating the query's words is all the score measures
+        generic = "Python dictionaries. " * 3 + "Learn python dictionaries and more about python dictionaries."
+        decision = scorer.assess(generic, "python dictionaries")
+        self.assertGreaterEqual(decision["relevance_score"], scorer.accept_above)
+        self.assertEqual(decision["decision"], "escalate")
+
+    def test_local_accept_needs_every_key_aspect(self):
+        scorer = LocalRelevanceScorer(accept_above=6)
+        query = "climate change coral reefs"
+        self.assertEqual(scorer.assess(self.RELEVANT_TEXT, query, self.aspects)["decision"], "accept")
+
+        # High enough to accept, but one aspect isn't mentioned at all
+        decision = scorer.assess(self.RELEVANT_TEXT, query, self.aspects + ["tourism revenue"])
+        self.assertGreaterEqual(decision["relevance_score"], scorer.accept_above)
+        self.assertEqual(decision["decision"], "escalate")
+
+    def test_all_stopword_query_escalates(self):
+        decision = LocalRelevanceScorer().assess("Any page text at all.", "what is it")
+        self.assertEqual(decision["decision"], "escalate")
+
+class FakeModel:
+    """Model whose calls take the next latency from a list (tail latency injection)"""
+    def __init__(self, latencies):
+        self.latencies = list(latencies)
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def generate_content(self, prompt, **kwargs):
+        with self.lock:
+            latency = self.latencies[self.calls] if self.calls < len(self.latencies) else 0
+            self.calls += 1
+            call_number = self.calls
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(latency)
+        with self.lock:
+            self.in_flight -= 1
+        return MagicMock(text=f"answer {call_number}")
+
+class TestLLMClient(unittest.TestCase):
+    def _warm(self, client, samples=20):
+        for _ in range(samples):
+            client.stats.record(0.05)
+
+    def test_hedged_request_wins_over_stalled_call(self):
+        model = FakeModel([2.0, 0.01])
+        client = LLMClient(model, timeout=5)
+        client.min_hedge_delay = 0.1
+        self._warm(client)
+
+        start_time = time.time()
+        response = client.generate("prompt")
+
+        self.assertEqual(response.text, "answer 2")
+        self.assertLess(time.time() - start_time, 1.0)
+        self.assertEqual(client.stats.hedges, 1)
+        self.assertEqual(client.stats.hedge_wins, 1)
+
+    def test_no_hedging_before_enough_samples(self):
+        model = FakeModel([0.3])
+        client = LLMClient(model, timeout=5)
+        client.min_hedge_delay = 0.05
+
+        self.assertEqual(client.generate("prompt").text, "answer 1")
+        self.assertEqual(model.calls, 1)
+
+    def test_deadline_raises_timeout(self):
+        client = LLMClient(FakeModel([1.0]), timeout=0.2, hedge=False)
+
+        with self.assertRaises(LLMTimeoutError):
+            client.generate("prompt")
+        self.assertEqual(client.stats.timeouts, 1)
+
+    def test_errors_propagate(self):
+        model = MagicMock()
+        model.generate_content.side_effect = ValueError("bad request")
+        client = LLMClient(model)
+
+        with self.assertRaises(ValueError):
+            client.generate("prompt")
+        self.assertEqual(client.stats.errors, 1)
+
+    def test_waiting_for_a_local_slot_does_not_trip_the_breaker(self):
+        breaker = CircuitBreaker("gemini-test", failure_threshold=1)
+        client = LLMClient(FakeModel([0.01]), max_concurrency=1, timeout=0.1, hedge=False, breaker=breaker)
+        client._slots.acquire()  # Every slot busy with other requests
+        try:
+            with self.assertRaises(LLMSlotTimeoutError):
+                client.generate("prompt")
+        finally:
+            client._slots.release()
+        self.assertEqual(breaker.state, "closed")
+
+        # A call that reached the model and timed out still counts
+        client = LLMClient(FakeModel([1.0]), max_concurrency=1, timeout=0.1, hedge=False, breaker=breaker)
+        with self.assertRaises(LLMTimeoutError):
+            client.generate("prompt")
+        self.assertEqual(breaker.state, "open")
+
+    def test_concurrency_limit(self):
+        model = FakeModel([0.1] * 8)
+        client = LLMClient(model, max_concurrency=2, hedge=False)
+
+        threads = [threading.Thread(target=client.generate, args=("prompt",)) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(model.calls, 8)
+        self.assertLessEqual(model.max_in_flight, 2)
+
+    def test_async_interface_hedges(self):
+        model = FakeModel([2.0, 0.01])
+        client = LLMClient(model, timeout=5)
+        client.min_hedge_delay = 0.1
+        self._warm(client)
+
+        response = asyncio.run(client.agenerate("prompt"))
+
+        self.assertEqual(response.text, "answer 2")
+        self.assertEqual(client.stats.snapshot()["hedge_wins"], 1)
+
+    def test_stream_holds_its_slot_until_drained(self):
+        model = MagicMock()
+        model.generate_content.side_effect = lambda prompt, **kwargs: (
+            FakeStreamResponse(["a", "b"]) if kwargs.get("stream") else MagicMock(text="plain"))
+        client = LLMClient(model, max_concurrency=1, timeout=5, hedge=False)
+
+        stream = client.generate("prompt", stream=True)
+        with self.assertRaises(LLMTimeoutError):
+            client.generate("prompt", timeout=0.1)  # The stream still has the only slot
+        self.assertEqual("".join(chunk.text for chunk in stream), "ab")
+        self.assertEqual(client.generate("prompt").text, "plain")
+        # Time to first chunk stays out of the hedging percentile
+        self.assertEqual(len(client.stats.latencies), 1)
+        self.assertEqual(len(client.stream_stats.latencies), 1)
+
+    def test_stalled_stream_times_out(self):
+        released = threading.Event()
+
+        class StalledStream:
+            _iterator = MagicMock(cancel=released.set)
+
+            def __iter__(self):
+                yield MagicMock(text="first")
+                released.wait(5)  # Blocks like a stalled gRPC read until cancelled
+
+        model = MagicMock()
+        model.generate_content.return_value = StalledStream()
+        client = LLMClient(model, max_concurrency=1, timeout=0.3, hedge=False)
+
+        start_time = time.time()
+        with self.assertRaises(LLMTimeoutError):
+            for _ in client.generate("prompt", stream=True):
+                pass
+        self.assertLess(time.time() - start_time, 2)
+        self.assertTrue(client._slots.acquire(timeout=0))
+
+class TestResilience(unittest.TestCase):
+    def _open_breaker(self, name):
+        breaker = CircuitBreaker(name, failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        return breaker
+
+    def test_breaker_opens_then_probes_half_open(self):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=0.1)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertTrue(breaker.is_open())
+        self.assertFalse(breaker.allow())
+
+        time.sleep(0.15)
+        self.assertTrue(breaker.allow())  # The single half-open probe
+        self.assertFalse(breaker.allow())
+        breaker.record_failure()
+        self.assertEqual(breaker.snapshot()["state"], "open")
+
+        time.sleep(0.15)
+        self.assertTrue(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.snapshot()["state"], "closed")
+        self.assertTrue(breaker.allow())
+
+    def test_retries_stop_when_budget_is_spent(self):
+        func = MagicMock(side_effect=ConnectionError("reset"))
+        breaker = CircuitBreaker("test", failure_threshold=10)
+
+        # Outside a request there is no budget, so no retries
+        with self.assertRaises(ConnectionError):
+            call_upstream(breaker, func)
+        self.assertEqual(func.call_count, 1)
+
+        token = set_retry_budget(0.3)
+        try:
+            with patch('resilience.backoff_delay', return_value=0.2):
+                with self.assertRaises(ConnectionError):
+                    call_upstream(breaker, func, max_attempts=5)
+        finally:
+            reset_retry_budget(token)
+        self.assertEqual(func.call_count, 3)  # One retry fits in the budget, the second doesn't
+
+    def test_llm_client_fails_fast_when_open(self):
+        model = MagicMock()
+        model.generate_content.side_effect = ValueError("quota exceeded")
+        client = LLMClient(model, hedge=False, breaker=CircuitBreaker("gemini", failure_threshold=1))
+
+        with self.assertRaises(ValueError):
+            client.generate("prompt")
+        with self.assertRaises(CircuitOpenError):
+            client.generate("prompt")
+        self.assertEqual(model.generate_content.call_count, 1)
+
+    def test_pipeline_degrades_while_gemini_is_open(self):
+        agent = WebResearchAgent()
+        model = MagicMock()
+        agent.llm = LLMClient(model, breaker=self._open_breaker("gemini"))
+        agent.content_analyzer.llm = agent.llm
+        agent.content_analyzer.cascade = LocalRelevanceScorer(reject_below=0, accept_above=11)  # Escalate all
+
+        analysis = agent.content_analyzer.analyze("Solar panels convert sunlight into electricity.", "solar panels")
+        self.assertEqual(analysis["scored_by"], "local")
+        self.assertGreater(analysis["relevance_score"], 0)
+        self.assertEqual(agent.analyze_query("solar panels")["search_terms"],
+                         agent._fallback_analysis("solar panels")["search_terms"])
+
+        report = agent.synthesize_information([{"title": "A", "url": "http://a.example.com",
+                                                "content": "Solar panels convert sunlight.",
+                                                "relevance_score": 8}], "solar panels")
+        self.assertTrue(report.startswith(DEGRADED_REPORT_NOTE))
+        self.assertIn("http://a.example.com", report)
+        model.generate_content.assert_not_called()
+
+    def test_search_serves_cache_only_while_serpapi_is_open(self):
+        agent = WebResearchAgent()
+        agent.web_search.breaker = self._open_breaker("serpapi")
+        agent.web_search.fetch_results = MagicMock()
+        num_results = agent._adjust_search_parameters("solar")["max_results_per_term"]
+        agent.search_cache.set(("solar panels", False, num_results, 0), [{"title": "A", "link": "http://a.example.com"}])
+
+        results = agent.search_web(["solar panels", "wind power"], query="solar")
+
+        self.assertEqual([r["link"] for r in results], ["http://a.example.com"])
+        agent.web_search.fetch_results.assert_not_called()
+
+class TestContextPacking(unittest.TestCase):
+    def test_budget_is_respected(self):
+        sources = [
+            {"content": "First fact about the topic. " * 40, "relevance_score": 9, "source_quality": 8},
+            {"content": "Another angle on it. " * 40, "relevance_score": 6}
+        ]
+        packed = pack_context(sources, token_budget=50)
+
+        self.assertLessEqual(sum(estimate_tokens(p) for p in packed), 50 + len(sources))
+
+    def test_budget_follows_relevance(self):
+        strong = " ".join(f"Strong source sentence number {i}." for i in range(50))
+        weak = " ".join(f"Weak source sentence number {i}." for i in range(50))
+        packed = pack_context([
+            {"content": strong, "relevance_score": 10, "source_quality": 10},
+            {"content": weak, "relevance_score": 5, "source_quality": 5}
+        ], token_budget=200)
+
+        self.assertGreater(len(packed[0]), len(packed[1]))
+        self.assertTrue(packed[1])
+
+    def test_trims_at_sentence_boundaries(self):
+        content = "The first sentence is here. The second sentence follows it. The third one ends it."
+        packed = pack_context([{"content": content, "relevance_score": 8}], token_budget=15)
+
+        self.assertEqual(packed[0], "The first sentence is here. The second sentence follows it.")
+
+    def test_removes_redundant_sentences(self):
+        packed = pack_context([
+            {"content": "Team A won the final by 5 wickets. The match was in Mumbai.", "relevance_score": 9},
+            {"content": "Team A won the final by 5 wickets! Fans celebrated all night.", "relevance_score": 7}
+        ], token_budget=500)
+
+        self.assertIn("Team A won the final", packed[0])
+        self.assertEqual(packed[1], "Fans celebrated all night.")
+
+class TestCanonicalUrl(unittest.TestCase):
+    def test_variants_share_one_url(self):
+        variants = [
+            "https://example.com/news/story",
+            "http://www.example.com/news/story/",
+            "https://example.com/news/story?utm_source=feed&utm_medium=rss#comments",
+            "https://m.example.com/news/story?fbclid=abc",
+            "https://amp.example.com/news/story",
+            "https://example.com/news/story/amp?amp",
+            "https://example.com/amp/news/story?outputType=amp",
+            "https://example-com.cdn.ampproject.org/c/s/www.example.com/news/story",
+            "https://www.google.com/amp/s/example.com/news/story.amp",
+        ]
+        canonical = {canonicalize_url(url) for url in variants}
+        self.assertEqual(canonical, {"https://example.com/news/story"})
+        self.assertEqual(canonicalize_url("https://en.m.wikipedia.org/wiki/Cricket"),
+                         "https://en.wikipedia.org/wiki/Cricket")
+        # News sites' AMP paths need no marker
+        self.assertEqual(canonicalize_url("https://www.theguardian.com/sport/2024/may/26/ipl-final/amp"),
+                         "https://theguardian.com/sport/2024/may/26/ipl-final")
+
+    def test_distinct_pages_stay_distinct(self):
+        self.assertEqual(canonicalize_url("https://example.com/search?q=ipl&page=2&utm_campaign=x"),
+                         "https://example.com/search?page=2&q=ipl")
+        self.assertNotEqual(canonicalize_url("https://example.com/Story"), canonicalize_url("https://example.com/story"))
+        self.assertNotEqual(canonicalize_url("https://example.com:8080/a"), canonicalize_url("https://example.com/a"))
+        self.assertEqual(canonicalize_url(" not a url "), "not a url")
+        # "amp" as a real path segment, without any AMP marker
+        self.assertEqual(canonicalize_url("https://github.com/ampproject/amp"), "https://github.com/ampproject/amp")
+        self.assertNotEqual(canonicalize_url("https://example.com/amp/guide"),
+                            canonicalize_url("https://example.com/guide"))
+
+    def test_search_results_dedupe_by_canonical_url(self):
+        agent = WebResearchAgent()
+        results = agent._dedupe_results([
+            {"title": "Story", "link": "https://example.com/story"},
+            {"title": "Story (AMP)", "link": "https://example.com/story/amp?amp=1&utm_source=google"},
+            {"title": "Other", "link": "https://example.com/other"},
+        ])
+        self.assertEqual([result["title"] for result in results], ["Story", "Other"])
+        # The link that gets fetched and cited is kept as the search engine returned it
+        self.assertEqual(results[0]["link"], "https://example.com/story")
+
+        tool = WebSearchTool()
+        parsed = tool._parse_results({"organic_results": [{"title": "A", "link": "http://m.example.com/a/#top"}]}, 3)
+        self.assertEqual(parsed[0]["link"], "http://m.example.com/a/#top")
+
+class TestSharedAgent(unittest.TestCase):
+    def setUp(self):
+        import app
+        self.app_module = app
+        self.client = app.app.test_client()
+
+    @patch('agent.WebResearchAgent.research')
+    def test_requests_share_one_agent(self, mock_research):
+        agents = []
+        mock_research.side_effect = lambda query, session_id=None: "Report for " + query
+
+        with patch('app.WebResearchAgent', side_effect=WebResearchAgent) as mock_init:
+            self.app_module.research_agent = None
+            for query in ["first", "second", "third"]:
+                response = self.client.post('/research', json={'query': query})
+                self.assertEqual(response.get_json(), {'result': 'Report for ' + query})
+                agents.append(self.app_module.research_agent)
+
+            mock_init.assert_called_once()
+        self.assertTrue(all(agent is agents[0] for agent in agents))
+
+        # Worker threads release their slots right after handing back the result
+        for _ in range(50):
+            if self.app_module.admission.in_flight == 0:
+                break
+            time.sleep(0.01)
+        self.assertEqual(self.app_module.admission.in_flight, 0)
+
+    def test_concurrent_first_use_builds_one_agent(self):
+        self.app_module.research_agent = None
+        seen = []
+        threads = [threading.Thread(target=lambda: seen.append(self.app_module.get_research_agent()))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len({id(agent) for agent in seen}), 1)
+
+    def test_context_holds_per_request_state(self):
+        sports = ResearchContext("who won the IPL match last night")
+        general = ResearchContext("history of the printing press")
+
+        self.assertTrue(sports.is_sports_query)
+        self.assertFalse(general.is_sports_query)
+        with general.timed("search"):
+            pass
+        self.assertIn("search", general.timings)
+        self.assertEqual(sports.timings, {})
+
+class TestSpeculativeSearch(unittest.TestCase):
+    def setUp(self):
+        self.agent = WebResearchAgent()
+        self.agent.speculative_search = True
+        self.agent.knowledge_index = None
+        self.agent.min_api_interval = 0
+        self.searched = []
+
+    def _search(self, query, num_results=3):
+        self.searched.append(query)
+        return [{"link": f"http://{query.replace(' ', '-')}.example.com/{i}", "title": query} for i in range(2)]
+
+    def _run(self, search_terms, mock_analyze_query, mock_search, extracted=None):
+        """Research 'solar panel costs'; every candidate (or those in extracted) becomes a source"""
+        mock_search.side_effect = self._search
+        mock_analyze_query.return_value = {"main_topic": "solar", "key_aspects": [], "content_type": "facts",
+                                           "search_terms": search_terms}
+
+        def extract(results, query, **kwargs):
+            return [{"title": "t", "url": result["link"], "content": "c", "relevance_score": 8, "source_quality": 5}
+                    for result in results if extracted is None or result["link"] in extracted]
+        with patch('time.sleep'), patch.object(self.agent, 'extract_content', side_effect=extract) as mock_extract, \
+                patch.object(self.agent, 'synthesize_information', return_value="Report"), \
+                patch.object(self.agent, '_cache_report'):
+            self.agent.research("solar panel costs")
+        return [result["link"] for result in mock_extract.call_args.args[0]]
+
+    @patch('tools.WebSearchTool.search')
+    @patch('agent.WebResearchAgent.analyze_query')
+    def test_raw_query_searched_once_when_analysis_agrees(self, mock_analyze_query, mock_search):
+        links = self._run(["Solar panel costs", "solar subsidies"], mock_analyze_query, mock_search)
+
+        self.assertEqual(sorted(self.searched), ["solar panel costs", "solar subsidies"])
+        self.assertEqual(links[:2], ["http://solar-panel-costs.example.com/0", "http://solar-panel-costs.example.com/1"])
+        self.assertEqual(self.agent.speculation_snapshot()["used"], 1)
+
+    @patch('tools.WebSearchTool.search')
+    @patch('agent.WebResearchAgent.analyze_query')
+    def test_speculative_results_merged_after_analyzed_terms(self, mock_analyze_query, mock_search):
+        links = self._run(["photovoltaic module prices"], mock_analyze_query, mock_search)
+
+        self.assertEqual(links[0], "http://photovoltaic-module-prices.example.com/0")
+        self.assertIn("http://solar-panel-costs.example.com/0", links)
+
+        # A truncated result list leaves speculative results out: counted as wasted
+        self.agent.max_total_results = 2
+        self._run(["photovoltaic module prices"], mock_analyze_query, mock_search)
+        self.assertEqual(self.agent.speculation_snapshot(), {"searches": 2, "used": 1, "wasted": 1,
+                                                             "scrapes": 0, "scrapes_used": 0})
+
+    @patch('tools.WebSearchTool.search')
+    @patch('agent.WebResearchAgent.analyze_query')
+    def test_used_only_when_a_speculative_only_link_becomes_a_source(self, mock_analyze_query, mock_search):
+        # Its links were extracted, but the analyzed terms returned them too
+        mock_search.side_effect = lambda query, num_results=3: [{"link": "http://same.example.com", "title": query}]
+        mock_analyze_query.return_value = {"main_topic": "solar", "key_aspects": [], "content_type": "facts",
+                                           "search_terms": ["photovoltaic module prices"]}
+        with patch('time.sleep'), patch.object(self.agent, 'synthesize_information', return_value="Report"), \
+                patch.object(self.agent, '_cache_report'), patch.object(self.agent, 'extract_content', return_value=[
+                    {"title": "t", "url": "http://same.example.com", "content": "c", "relevance_score": 8}]):
+            self.agent.research("solar panel costs")
+        self.assertEqual(self.agent.speculation_snapshot()["wasted"], 1)
+
+        # Its own links made the candidate list but weren't kept as sources
+        self._run(["photovoltaic module prices"], mock_analyze_query, mock_search,
+                  extracted={"http://photovoltaic-module-prices.example.com/0"})
+        self.assertEqual(self.agent.speculation_snapshot(), {"searches": 2, "used": 0, "wasted": 2,
+                                                             "scrapes": 0, "scrapes_used": 0})
+
+    @patch('tools.WebSearchTool.search')
+    @patch('agent.WebResearchAgent.analyze_query')
+    def test_no_speculation_when_the_index_covers_the_query(self, mock_analyze_query, mock_search):
+        self.agent.knowledge_index = KnowledgeIndex(tempfile.mkdtemp(prefix="knowledge_index_"))
+        filler = " Installers quote prices per watt, and panel costs keep falling every year."
+        for name in ("a", "b", "c"):
+            self.agent.knowledge_index.add(f"http://{name}.example.com", name,
+                                           "Solar panel costs explained." + filler * 4)
+        self.agent.knowledge_index.flush()
+
+        self._run(["solar panel costs"], mock_analyze_query, mock_search)
+        self.assertEqual(self.agent.speculation_snapshot()["searches"], 0)
+
+class TestIterativeDeepening(unittest.TestCase):
+    def setUp(self):
+        self.agent = WebResearchAgent()
+        self.agent.max_search_rounds = 3
+        self.agent.min_api_interval = 0
+        self.agent.knowledge_index = None
+        self.searched = []
+
+    def _search(self, query, num_results=3, start=0):
+        self.searched.append((query, start))
+        return [{"link": f"http://{query.replace(' ', '-')}.example.com/{start + i}", "title": query}
+                for i in range(num_results)]
+
+    def _research(self, analysis, good_pages):
+        with patch('time.sleep'), \
+                patch('tools.WebSearchTool.search', side_effect=self._search), \
+                patch('tools.WebScraperTool.scrape', side_effect=lambda url: {"title": url, "content": url}), \
+                patch('tools.ContentAnalyzerTool.analyze', side_effect=lambda text, query, **kwargs: {
+                    "relevance_score": 8 if text.endswith(good_pages) else 2, "relevant_content": "Relevant text"}), \
+                patch.object(self.agent, 'analyze_query', return_value=analysis), \
+                patch.object(self.agent, 'synthesize_information', return_value="Report") as mock_synthesize:
+            self.agent.research("how do solar panels work")
+        return mock_synthesize.call_args.args[0]
+
+    def test_malformed_round_limit_falls_back_to_default(self):
+        for setting in ("three", "0"):
+            with patch.dict(os.environ, {"MAX_SEARCH_ROUNDS": setting}):
+                self.assertEqual(WebResearchAgent().max_search_rounds, 3)
+        with patch.dict(os.environ, {"MAX_SEARCH_ROUNDS": " 2 "}):
+            self.assertEqual(WebResearchAgent().max_search_rounds, 2)
+
+    def test_easy_query_searches_once(self):
+        sources = self._research({"main_topic": "solar", "key_aspects": ["battery storage"],
+                                  "search_terms": ["solar panels", "solar cells"]}, good_pages=("/0", "/1"))
+
+        self.assertEqual(self.searched, [("solar panels", 0), ("solar cells", 0)])
+        self.assertEqual(len(sources), 3)  # The general quorum
+
+    def test_hard_query_searches_aspects_then_next_page(self):
+        sources = self._research({"main_topic": "solar", "key_aspects": ["battery storage"],
+                                  "search_terms": ["solar panels"]}, good_pages=("/0", "/2"))
+
+        self.assertEqual(self.searched, [("solar panels", 0), ("solar battery storage", 0), ("solar panels", 2)])
+        self.assertEqual(len(sources), 3)
+
+class TestDepthProfiles(unittest.TestCase):
+    def test_resolve_depth(self):
+        self.assertEqual(resolve_depth(), {})
+        self.assertEqual(resolve_depth("quick", {"max_extracted_sources": 2})["max_extracted_sources"], 2)
+        for depth, overrides in [("exhaustive", None), ("quick", {"max_cost": 1}),
+                                 (None, {"max_total_results": 500}), (None, {"max_search_terms": "4"})]:
+            with self.assertRaises(ValueError):
+                resolve_depth(depth, overrides)
+
+    @patch('agent.WebResearchAgent.search_web', return_value=[{"link": "http://a.example.com"}])
+    @patch('agent.WebResearchAgent.analyze_query', return_value={"search_terms": ["solar panels"]})
+    @patch('tools.WebScraperTool.scrape', return_value={"title": "A", "content": "Solar panels"})
+    @patch('tools.ContentAnalyzerTool.analyze', return_value={"relevance_score": 8, "relevant_content": "Solar"})
+    def test_limits_apply_to_one_request(self, *_):
+        agent = WebResearchAgent()
+        agent.knowledge_index = None
+        seen = []
+
+        def synthesize(extracted_data, query):
+            seen.append((agent.max_extracted_sources, agent.synthesis_token_budget,
+                         agent.content_analyzer.max_analysis_length, agent.web_scraper.max_content_length))
+            return "Report"
+
+        with patch.object(agent, 'synthesize_information', side_effect=synthesize), patch('time.sleep'):
+            agent.research("how do solar panels work", depth="quick", overrides={"max_extracted_sources": 2})
+            agent.research("how do solar panels work")
+
+        self.assertEqual(seen[0], (2, 2 * 400 // 4, 800, 1500))
+        self.assertEqual(seen[1], (5, agent.synthesis_token_budget, 1000, 2500))
+        # The quick report is cached apart from the standard one
+        self.assertEqual(len(agent.report_cache), 2)
+
+    @patch('agent.WebResearchAgent.research', return_value="Report")
+    def test_research_endpoint_accepts_depth(self, mock_research):
+        import app
+        client = app.app.test_client()
+
+        response = client.post('/research', json={'query': 'solar', 'depth': 'deep',
+                                                  'overrides': {'max_extracted_sources': 6}})
+        self.assertEqual(response.get_json(), {'result': 'Report'})
+        self.assertEqual(mock_research.call_args.kwargs, {'session_id': None, 'depth': 'deep',
+                                                          'overrides': {'max_extracted_sources': 6}})
+        self.assertEqual(client.post('/research', json={'query': 'solar', 'depth': 'fast'}).status_code, 400)
+
+class TestSessions(unittest.TestCase):
+    def setUp(self):
+        self.agent = WebResearchAgent()
+        self.pages = {
+            "http://a.example.com": "Solar panels convert sunlight into electricity. Panel efficiency keeps improving.",
+            "http://b.example.com": "Solar panel costs fell sharply. Installation costs depend on the roof.",
+            "http://c.example.com": "Wind turbines in Europe generate a growing share of electricity."
+        }
+
+    def _scrape(self, url):
+        return {"title": url, "content": self.pages[url], "url": url}
+
+    def _analysis(self, key_aspects, search_terms):
+        return {"main_topic": "solar", "key_aspects": key_aspects, "content_type": "facts", "search_terms": search_terms}
+
+    @patch('agent.WebResearchAgent.synthesize_information', return_value="Report")
+    @patch('tools.ContentAnalyzerTool.analyze')
+    @patch('tools.WebScraperTool.scrape')
+    @patch('agent.WebResearchAgent.search_web')
+    @patch('agent.WebResearchAgent.analyze_query')
+    def test_follow_up_is_answered_from_session(self, mock_analyze_query, mock_search, mock_scrape, mock_analyze, _):
+        mock_scrape.side_effect = self._scrape
+        mock_analyze.side_effect = lambda text, query, **kwargs: {"relevance_score": 8, "relevant_content": text}
+        mock_search.return_value = [{"link": "http://a.example.com"}, {"link": "http://b.example.com"}]
+        mock_analyze_query.return_value = self._analysis(["solar panel efficiency"], ["solar panels"])
+
+        self.agent.research("how do solar panels work", session_id="s1")
+        self.assertEqual(mock_scrape.call_count, 2)
+
+        mock_analyze_query.return_value = self._analysis(["solar panel costs"], ["solar panel cost"])
+        self.agent.research("what do they cost", session_id="s1")
+
+        # Covered by the pages already gathered: no new search or scrape
+        mock_search.assert_called_once()
+        self.assertEqual(mock_scrape.call_count, 2)
+        self.assertEqual(mock_analyze_query.call_args.kwargs["previous_queries"], ["how do solar panels work"])
+
+    @patch('agent.WebResearchAgent.synthesize_information', return_value="Report")
+    @patch('tools.ContentAnalyzerTool.analyze')
+    @patch('tools.WebScraperTool.scrape')
+    @patch('agent.WebResearchAgent.search_web')
+    @patch('agent.WebResearchAgent.analyze_query')
+    def test_only_uncovered_aspects_are_searched(self, mock_analyze_query, mock_search, mock_scrape, mock_analyze, _):
+        mock_scrape.side_effect = self._scrape
+        mock_analyze.side_effect = lambda text, query, **kwargs: {"relevance_score": 8, "relevant_content": text}
+        mock_search.return_value = [{"link": "http://a.example.com"}, {"link": "http://b.example.com"}]
+        mock_analyze_query.return_value = self._analysis(["solar panel efficiency"], ["solar panels"])
+        self.agent.research("how do solar panels work", session_id="s2")
+
+        mock_search.return_value = [{"link": "http://c.example.com"}]
+        mock_analyze_query.return_value = self._analysis(["solar panel costs", "wind turbines Europe"],
+                                                         ["renewables europe"])
+        self.agent.research("how does that compare with wind in Europe", session_id="s2")
+
+        self.assertEqual(mock_search.call_args.args[0], ["wind turbines Europe"])
+
+    def test_store_is_bounded(self):
+        store = SessionStore(max_sessions=2, ttl=60, max_pages=2)
+        pages = [{"url": f"http://{i}.example.com", "title": "", "content": "text"} for i in range(3)]
+        store.add("a", "q1", pages)
+        store.add("b", "q1", [])
+        store.add("c", "q1", [])
+
+        self.assertEqual(store.get("a"), {"queries": [], "pages": []})  # Least recently used evicted
+        store.add("c", "q2", pages)
+        self.assertEqual(store.get("c")["queries"], ["q1", "q2"])
+        self.assertEqual([p["url"] for p in store.get("c")["pages"]], ["http://1.example.com", "http://2.example.com"])
+
+    def test_newest_session_pages_are_used_without_circuit_checks(self):
+        session = {"pages": [{"url": f"http://{i}.example.com", "title": "", "content": "text"} for i in range(12)]}
+        results = self.agent._session_results(session)
+        self.assertEqual(results[0]["link"], "http://11.example.com")
+
+        # A held page needs no fetch, so an open domain circuit doesn't drop it
+        with patch.object(self.agent.web_scraper.domain_stats, 'is_open', return_value=True):
+            ranked = self.agent._rank_candidates(results + [{"link": "http://fetch.example.com"}])
+        self.assertEqual([r["link"] for r in ranked],
+                         [r["link"] for r in results[:self.agent.max_total_results]])
+
+    def test_cache_entries_expire(self):
+        cache = TTLCache(maxsize=10, ttl=0.05)
+        cache.set("key", "value")
+        self.assertEqual(cache.get("key"), "value")
+        time.sleep(0.1)
+        self.assertIsNone(cache.get("key"))
+
+class TestKnowledgeIndex(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="knowledge_index_")
+        self.index = KnowledgeIndex(self.directory)
+        filler = " Other unrelated sentences pad the page out to a realistic length for indexing."
+        self.pages = {
+            "http://tides.example.com": "Ocean tides are caused by the gravitational pull of the moon." + filler * 3,
+            "http://moon.example.com": "The moon orbits the earth every 27 days and drives ocean tides." + filler * 3,
+            "http://bread.example.com": "Sourdough bread rises thanks to wild yeast and bacteria." + filler * 3
+        }
+
+    def _add_all(self, fetched_at=None):
+        for url, content in self.pages.items():
+            self.index.add(url, url, content, fetched_at=fetched_at)
+        self.index.flush()
+
+    def test_search_ranks_matching_passages(self):
+        self._add_all()
+        hits = self.index.search("ocean tides moon")
+
+        self.assertEqual({hit["url"] for hit in hits[:2]}, {"http://tides.example.com", "http://moon.example.com"})
+        self.assertGreater(hits[0]["score"], 0.5)
+        self.assertNotIn("http://bread.example.com", [hit["url"] for hit in hits])
+
+    def test_full_buffer_is_flushed_off_the_scrape_thread(self):
+        flushed = threading.Event()
+        flush_threads = []
+        original_flush = self.index.flush
+
+        def recording_flush():
+            flush_threads.append(threading.current_thread().name)
+            original_flush()
+            flushed.set()
+
+        self.index.flush_size = len(self.pages)
+        with patch.object(self.index, 'flush', recording_flush):
+            for url, content in self.pages.items():
+                self.index.add(url, url, content)
+            self.assertTrue(flushed.wait(5))
+        self.assertEqual(flush_threads, ["knowledge-index-flush"])
+        self.assertEqual({hit["url"] for hit in self.index.search("ocean tides moon")[:2]},
+                         {"http://tides.example.com", "http://moon.example.com"})
+
+    def test_adds_and_searches_do_not_wait_for_a_flush(self):
+        self._add_all()
+        writing = threading.Event()
+        release = threading.Event()
+        original_write_segment = self.index._write_segment
+
+        def slow_write_segment(name, postings):
+            writing.set()
+            release.wait(5)
+            original_write_segment(name, postings)
+
+        self.index.add("http://sea.example.com", "Sea", "Sea levels rise and fall with the tides." * 10)
+        with patch.object(self.index, '_write_segment', slow_write_segment):
+            flusher = threading.Thread(target=self.index.flush)
+            flusher.start()
+            self.assertTrue(writing.wait(5))
+            start_time = time.time()
+            self.index.add("http://lake.example.com", "Lake", "Lakes have no noticeable tides at all." * 10)
+            hits = self.index.search("ocean tides moon")  # The pages loaded before the flush
+            self.assertLess(time.time() - start_time, 1)
+            release.set()
+            flusher.join(5)
+        self.assertEqual({hit["url"] for hit in hits[:2]}, {"http://tides.example.com", "http://moon.example.com"})
+        self.assertIn("http://sea.example.com", [hit["url"] for hit in self.index.search("sea levels")])
+
+    def test_failed_flush_keeps_pages_for_the_next_one(self):
+        for url, content in self.pages.items():
+            self.index.add(url, url, content)
+        with patch.object(self.index, '_write_segment', side_effect=OSError("disk full")):
+            self.index.flush()
+        self.assertEqual(len(self.index.pending), len(self.pages))
+
+        # The retry writes a consistent index: no half-written copy of the pages is left behind
+        self.index.flush()
+        self.assertEqual(self.index.pending, [])
+        self.assertEqual(len(self.index.docs), len(self.pages))
+        self.assertEqual({hit["url"] for hit in self.index.search("ocean tides moon")[:2]},
+                         {"http://tides.example.com", "http://moon.example.com"})
+
+    def test_stale_passages_are_excluded(self):
+        self._add_all(fetched_at=time.time() - 7200)
+
+        self.assertTrue(self.index.search("ocean tides"))
+        self.assertEqual(self.index.search("ocean tides", max_age=3600), [])
+
+    def test_rescraped_page_supersedes_old_copy_and_compaction(self):
+        self._add_all()
+        self.index.add("http://tides.example.com", "Tides", "Tides now explained by a brand new theory." * 6)
+        self.index.flush()
+
+        self.assertNotIn("http://tides.example.com", [hit["url"] for hit in self.index.search("gravitational pull")])
+        passages_before = self.index.manifest["passages"]
+        self.index.compact()
+        self.assertLess(self.index.manifest["passages"], passages_before)
+        self.assertEqual(len(self.index.manifest["segments"]), 1)
+
+        # Another process opening the same directory sees the compacted index
+        reopened = KnowledgeIndex(self.directory)
+        self.assertEqual(reopened.search("brand new theory")[0]["url"], "http://tides.example.com")
+        self.assertEqual(reopened.search("sourdough yeast")[0]["url"], "http://bread.example.com")
+
+    @patch('agent.WebResearchAgent.synthesize_information', return_value="Report")
+    @patch('tools.ContentAnalyzerTool.analyze')
+    @patch('tools.WebScraperTool.scrape')
+    @patch('agent.WebResearchAgent.search_web')
+    @patch('agent.WebResearchAgent.analyze_query')
+    def test_research_uses_index_before_web(self, mock_analyze_query, mock_search, mock_scrape, mock_analyze, _):
+        self.pages["http://ocean.example.com"] = "Spring tides happen when the sun and moon align with ocean tides." * 4
+        self._add_all(fetched_at=time.time() - 5 * 3600)
+        agent = WebResearchAgent()
+        agent.knowledge_index = self.index
+        mock_analyze.side_effect = lambda text, query, **kwargs: {"relevance_score": 8, "relevant_content": text}
+        mock_search.return_value = []
+        mock_analyze_query.return_value = {"key_aspects": ["tides"], "search_terms": ["ocean tides moon"]}
+
+        agent.research("what causes ocean tides")
+        mock_search.assert_not_called()
+        mock_scrape.assert_not_called()
+
+        # Five-hour-old pages are too stale for a news query
+        agent.research("latest news on ocean tides")
+        mock_search.assert_called()
+
+class TestHTMLParsingPool(unittest.TestCase):
+    def test_pool_matches_in_thread_parsing(self):
+        small = b"<html><head><title>Small</title></head><body><p>Hello world</p></body></html>"
+        large = (b"<html><head><title>Large</title></head><body>"
+                 + b"<p>Paragraph of text.</p>" * 5000 + b"</body></html>")
+        pool = HTMLParsingPool(max_workers=1)
+        try:
+            for html in (small, large):
+                self.assertEqual(pool.parse(html, 2500), parse_html(html, 2500))
+        finally:
+            pool.shutdown()
+        self.assertEqual(parse_html(large, 100)["title"], "Large")
+        self.assertEqual(len(parse_html(large, 100)["content"]), 100)
+
+    @patch('requests.get')
+    def test_scraper_falls_back_to_in_thread_parsing(self, mock_get):
+        mock_get.return_value = MagicMock(status_code=200,
+                                          content=b"<html><title>Page</title><body>Body text</body></html>")
+        scraper = WebScraperTool()
+        scraper.parsing_pool = MagicMock()
+        scraper.parsing_pool.parse.side_effect = RuntimeError("pool broken")
+
+        result = scraper.scrape("http://fallback.example.com")
+
+        self.assertEqual(result["title"], "Page")
+        self.assertEqual(result["content"], "Page\nBody text")
+
+    def test_invalid_process_count_parses_in_thread(self):
+        for setting in ("many", "-2"):
+            with patch.dict(os.environ, {"HTML_PARSE_PROCESSES": setting}):
+                self.assertIsNone(WebScraperTool().parsing_pool)
+
+class TestAsyncPipeline(unittest.TestCase):
+    def setUp(self):
+        self.agent = AsyncWebResearchAgent()
+        self.agent.min_api_interval = 0
+        self.agent.knowledge_index = None
+        self.agent.content_analyzer.min_request_interval = 0
+        self.agent.web_search.min_request_interval = 0
+
+    def _patches(self, io_delay=0.0):
+        async def search(term, num_results=3, session=None):
+            await asyncio.sleep(io_delay)
+            return [{"title": f"Result {i}", "link": f"http://{i}.example.com"} for i in range(3)]
+
+        async def scrape(url, session):
+            await asyncio.sleep(io_delay)
+            return {"title": url, "content": f"Content of {url}", "url": url}
+
+        async def generate(prompt, timeout=None, **kwargs):
+            await asyncio.sleep(io_delay)
+            if prompt.startswith("Analyze this query"):
+                return MagicMock(text=json.dumps({"key_aspects": ["topic"], "search_terms": ["test search"]}))
+            return MagicMock(text="Final research report")
+
+        return [patch('async_agent.AsyncWebResearchAgent._http', AsyncMock(return_value=None)),
+                patch('tools.WebSearchTool.asearch', side_effect=search),
+                patch('tools.WebScraperTool.ascrape', side_effect=scrape),
+                patch('tools.ContentAnalyzerTool.aanalyze',
+                      AsyncMock(return_value={"relevance_score": 8, "relevant_content": "Relevant"})),
+                patch.object(self.agent.llm, 'agenerate', side_effect=generate)]
+
+    def _run_with_patches(self, coroutine_factory, io_delay=0.0):
+        patches = self._patches(io_delay)
+        for p in patches:
+            p.start()
+        try:
+            return asyncio.run(coroutine_factory())
+        finally:
+            for p in patches:
+                p.stop()
+
+    def test_async_research_process(self):
+        report = self._run_with_patches(lambda: self.agent.aresearch("test query"))
+
+        self.assertTrue(report.startswith("Final research report"))
+        self.assertIn("http://0.example.com", report)
+
+    def test_concurrent_requests_share_one_loop(self):
+        async def many():
+            return await asyncio.gather(*[self.agent.aresearch(f"query {i}") for i in range(100)])
+
+        start_time = time.time()
+        reports = self._run_with_patches(many, io_delay=0.1)
+
+        # 100 requests, each with five sequential 0.1 s waits, overlap on one thread
+        self.assertEqual(len(reports), 100)
+        self.assertTrue(all(r.startswith("Final research report") for r in reports))
+        self.assertLess(time.time() - start_time, 5)
+
+    def test_blocking_steps_run_off_the_event_loop(self):
+        loop_threads = []
+        step_threads = {}
+
+        def recorder(name, func):
+            def record(*args, **kwargs):
+                step_threads[name] = threading.get_ident()
+                return func(*args, **kwargs)
+            return record
+
+        self.agent.knowledge_index = MagicMock()
+        self.agent.knowledge_index.search.return_value = []
+        with patch.object(self.agent, '_search_knowledge_index',
+                          recorder("index", self.agent._search_knowledge_index)), \
+                patch.object(self.agent, '_rank_candidates', recorder("rank", self.agent._rank_candidates)), \
+                patch.object(self.agent, '_synthesis_prompt', recorder("pack", self.agent._synthesis_prompt)):
+            async def research():
+                loop_threads.append(threading.get_ident())
+                return await self.agent.aresearch("test query")
+            report = self._run_with_patches(research)
+
+        self.assertTrue(report.startswith("Final research report"))
+        self.assertEqual(set(step_threads), {"index", "rank", "pack"})
+        self.assertNotIn(loop_threads[0], step_threads.values())
+
+class TestASGIApp(unittest.TestCase):
+    def _call(self, method, path, body=None, headers=None):
+        messages = []
+
+        async def receive():
+            return {"type": "http.request", "body": json.dumps(body).encode() if body is not None else b"",
+                    "more_body": False}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(asgi.app({"type": "http", "method": method, "path": path, "headers": headers or []},
+                              receive, send))
+        return messages[0]["status"], messages[1]["body"]
+
+    @patch('async_agent.AsyncWebResearchAgent.aresearch', new_callable=AsyncMock, return_value="Report")
+    def test_research_route(self, mock_research):
+        status, body = self._call("POST", "/research", {"query": "test", "session_id": "s1"})
+
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body), {"result": "Report", "session_id": "s1"})
+        mock_research.assert_called_once_with("test", session_id="s1")
+        self.assertEqual(asgi.active_requests, 0)
+
+    def test_validation_and_capacity(self):
+        self.assertEqual(self._call("POST", "/research", {})[0], 400)
+        self.assertEqual(self._call("GET", "/research")[0], 405)
+        self.assertEqual(self._call("GET", "/missing")[0], 404)
+        with patch('asgi.max_requests', 0):
+            self.assertEqual(self._call("POST", "/research", {"query": "test"})[0], 429)
+
+    def test_stats_need_token(self):
+        self.assertEqual(self._call("GET", "/stats")[0], 404)
+        with patch.dict(os.environ, {'ADMIN_TOKEN': 'secret'}):
+            self.assertEqual(self._call("GET", "/stats")[0], 403)
+            status, body = self._call("GET", "/stats", headers=[(b"authorization", b"Bearer secret")])
+        self.assertEqual(status, 200)
+        self.assertIn("active_requests", json.loads(body))
+
+    def test_index_page(self):
+        status, body = self._call("GET", "/")
+        self.assertEqual(status, 200)
+        self.assertIn(b"/research", body)
+
+class TestAdmissionControl(unittest.TestCase):
+    def _complete(self, limiter, count, latency):
+        tickets = [limiter.acquire(timeout=0) for _ in range(count)]
+        for ticket in tickets:
+            ticket.start_time = time.time() - latency
+            limiter.release(ticket)
+
+    def test_limit_grows_while_healthy_and_in_use(self):
+        limiter = AdaptiveLimiter(initial_limit=2, max_limit=10)
+        for _ in range(20):
+            self._complete(limiter, int(limiter.limit), latency=1.0)
+        self.assertGreater(limiter.limit, 4)
+        self.assertLessEqual(limiter.limit, 10)
+
+    def test_slow_requests_shrink_the_limit(self):
+        limiter = AdaptiveLimiter(initial_limit=8)
+        self._complete(limiter, 4, latency=1.0)
+        self._complete(limiter, 1, latency=10.0)
+        self.assertEqual(limiter.limit, 6)
+
+        # Further overload within the decrease interval doesn't compound
+        self._complete(limiter, 1, latency=10.0)
+        self.assertEqual(limiter.limit, 6)
+
+    def test_baseline_recovers_after_fast_burst(self):
+        limiter = AdaptiveLimiter(initial_limit=5)
+        limiter.decrease_interval = 0
+        # Unmeasured fast-path responses leave the baseline alone
+        for _ in range(10):
+            ticket = limiter.acquire(timeout=0)
+            ticket.start_time = time.time() - 0.02
+            limiter.release(ticket, measured=False)
+        self.assertIsNone(limiter.baseline_latency)
+
+        self._complete(limiter, 1, latency=0.02)
+        for _ in range(15):
+            self._complete(limiter, 1, latency=20.0)
+        self.assertAlmostEqual(limiter.baseline_latency, 20.0, places=2)
+        limit = limiter.limit
+        self._complete(limiter, 1, latency=20.0)
+        self.assertGreaterEqual(limiter.limit, limit)
+
+    def test_upstream_errors_shrink_the_limit(self):
+        counters = [(0, 0)]
+        limiter = AdaptiveLimiter(initial_limit=8, upstream_counters=lambda: counters[0])
+        self._complete(limiter, 1, latency=1.0)
+        counters[0] = (10, 8)
+        self._complete(limiter, 1, latency=1.0)
+        self.assertEqual(limiter.limit, 6)
+
+    def test_queued_request_gets_the_freed_slot(self):
+        limiter = AdaptiveLimiter(initial_limit=1, max_queue=1)
+        first = limiter.acquire(timeout=0)
+        granted = []
+        waiter = threading.Thread(target=lambda: granted.append(limiter.acquire(timeout=2)))
+        waiter.start()
+        time.sleep(0.05)
+
+        self.assertIsNone(limiter.acquire(timeout=0.01))  # Queue full
+        limiter.release(first)
+        waiter.join()
+        self.assertIsNotNone(granted[0])
+        self.assertEqual(limiter.in_flight, 1)
+
+    def test_queue_deadline_and_retry_after(self):
+        import app
+        with patch('app.admission', AdaptiveLimiter(initial_limit=1, max_queue=1)), patch('app.queue_timeout', 0.05):
+            app.admission.acquire(timeout=0)
+            response = app.app.test_client().post('/research', json={'query': 'test'})
+
+            self.assertEqual(response.status_code, 429)
+            self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+            self.assertEqual(app.admission.timed_out, 1)
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.agent = WebResearchAgent()
+        self.admission = AdaptiveLimiter(initial_limit=2)
+        self.scheduler = PrefetchScheduler(self.agent, self.admission, schedule=[{"query": "morning headlines"}])
+        self.scheduler.idle_grace = 0
+
+    def test_candidates_rank_schedule_then_popularity(self):
+        for query in ["Solar panels?", "solar panels", "wind power", "wind power", "wind power"]:
+            self.scheduler.record(query)
+        self.scheduler.record("rare query")
+
+        self.assertEqual(self.scheduler.candidates(), ["morning headlines", "wind power", "solar panels"])
+
+        # Fresh cached reports aren't prefetched again
+        self.agent.report_cache.set("wind power", "Report")
+        self.assertNotIn("wind power", self.scheduler.candidates())
+
+    @patch('agent.WebResearchAgent.synthesize_information', return_value="Morning report")
+    @patch('agent.WebResearchAgent.extract_content', return_value=[{"title": "t", "url": "u", "content": "c",
+                                                                   "relevance_score": 8, "source_quality": 5}])
+    @patch('agent.WebResearchAgent.search_web', return_value=[{"link": "u"}])
+    @patch('agent.WebResearchAgent.analyze_query')
+    def test_runs_only_when_idle_and_warms_report_cache(self, mock_analyze_query, mock_search, _, __):
+        mock_analyze_query.return_value = {"main_topic": "news", "key_aspects": [], "content_type": "news",
+                                           "search_terms": ["morning headlines"]}
+
+        # A live request holds a slot: nothing is prefetched
+        ticket = self.admission.acquire(timeout=0)
+        self.assertIsNone(self.scheduler.run_once())
+        self.assertEqual(self.scheduler.skipped_busy, 1)
+        self.admission.release(ticket)
+
+        self.assertEqual(self.scheduler.run_once(), "morning headlines")
+        self.assertEqual(self.admission.in_flight, 0)
+        self.assertTrue(self.agent.has_cached_report("Morning headlines?"))
+
+        # Already run this hour
+        self.assertIsNone(self.scheduler.run_once())
+
+        # The first live requester gets the warmed report without new upstream calls
+        self.assertEqual(self.agent.research("morning headlines"), "Morning report")
+        mock_search.assert_called_once()
+
+    @patch('agent.WebResearchAgent.synthesize_information', return_value="Morning report")
+    @patch('agent.WebResearchAgent.extract_content')
+    @patch('agent.WebResearchAgent.search_web', return_value=[{"link": "u"}])
+    @patch('agent.WebResearchAgent.analyze_query')
+    def test_backs_off_when_live_traffic_arrives(self, mock_analyze_query, _, mock_extract, mock_synthesize):
+        mock_analyze_query.return_value = {"main_topic": "news", "key_aspects": [], "content_type": "news",
+                                           "search_terms": ["morning headlines"]}
+
+        def live_request_arrives(*args, **kwargs):
+            time.sleep(0.01)
+            self.scheduler.record("weather today")
+            return [{"title": "t", "url": "u", "content": "c", "relevance_score": 8, "source_quality": 5}]
+        mock_extract.side_effect = live_request_arrives
+
+        self.assertEqual(self.scheduler.run_once(), "morning headlines")
+        # Abandoned before synthesis: the slot is free and nothing was cached
+        mock_synthesize.assert_not_called()
+        self.assertEqual(self.scheduler.abandoned, 1)
+        self.assertEqual(self.scheduler.prefetched, 0)
+        self.assertEqual(self.admission.in_flight, 0)
+        self.assertFalse(self.agent.has_cached_report("morning headlines"))
+        # The scheduled query is tried again at the next idle moment
+        self.assertIn("morning headlines", self.scheduler.candidates())
+
+    @patch('tools.WebSearchTool.search', return_value=[{"link": "http://a.example.com", "title": "A"}])
+    def test_search_results_are_cached(self, mock_search):
+        self.agent.search_web(["solar panels"], query="solar panels")
+        self.agent.search_web(["Solar  panels"], query="solar panels")
+        mock_search.assert_called_once()
+
+class TestProfiling(unittest.TestCase):
+    def _busy(self, stop):
+        while not stop.is_set():
+            sum(i * i for i in range(1000))
+
+    def test_cprofile_run_exports_pstats(self):
+        store = ProfileStore()
+        result, profile_id = store.run("cprofile", "q", lambda: json.loads(json.dumps({"a": list(range(100))})))
+        self.assertEqual(result["a"][-1], 99)
+
+        path = os.path.join(tempfile.mkdtemp(), "run.prof")
+        with open(path, "wb") as f:
+            f.write(store.get(profile_id)["data"])
+        functions = {name for _, _, name in pstats.Stats(path).stats}
+        self.assertIn("loads", functions)
+        self.assertIn("cumulative", store.get(profile_id)["summary"])
+
+    def test_cprofile_includes_worker_thread_tasks(self):
+        from concurrent.futures import ThreadPoolExecutor
+        import contextvars
+        from profiling import profiled_task
+
+        def worker_only_function():
+            return sum(i * i for i in range(1000))
+
+        def request():
+            with ThreadPoolExecutor(max_workers=2) as executor:
+                futures = [executor.submit(contextvars.copy_context().run, profiled_task, worker_only_function)
+                           for _ in range(2)]
+                return [future.result() for future in futures]
+
+        store = ProfileStore()
+        result, profile_id = store.run("cprofile", "q", request)
+        self.assertEqual(len(result), 2)
+        path = os.path.join(tempfile.mkdtemp(), "run.prof")
+        with open(path, "wb") as f:
+            f.write(store.get(profile_id)["data"])
+        calls = {name: stat[1] for (_, _, name), stat in pstats.Stats(path).stats.items()}
+        self.assertEqual(calls["worker_only_function"], 2)
+
+    @patch('tools.ContentAnalyzerTool.analyze', return_value={"relevance_score": 8, "relevant_content": "Solar"})
+    @patch('tools.WebScraperTool.scrape', side_effect=lambda url: {"title": url, "content": f"Page {url}", "url": url})
+    def test_cprofile_request_through_extract_content(self, *_):
+        agent = WebResearchAgent()
+        store = ProfileStore()
+        results = [{"link": f"http://{name}.example.com"} for name in "abc"]
+
+        sources, profile_id = store.run("cprofile", "q", agent.extract_content, results, "solar panels")
+
+        self.assertEqual(len(sources), 3)
+        path = os.path.join(tempfile.mkdtemp(), "run.prof")
+        with open(path, "wb") as f:
+            f.write(store.get(profile_id)["data"])
+        names = {name for (_, _, name) in pstats.Stats(path).stats}
+        self.assertIn("_extract_one", names)
+
+    def test_task_runs_unprofiled_if_the_profiler_cannot_start(self):
+        import cProfile
+        import profiling
+
+        class BusyProfile(cProfile.Profile):
+            def enable(self, *args, **kwargs):
+                raise ValueError("Another profiling tool is already active")
+
+        profiles = []
+        token = profiling._task_profiles.set(profiles)
+        try:
+            with patch('profiling.cProfile.Profile', BusyProfile), patch('profiling.PER_THREAD_PROFILERS', True):
+                self.assertEqual(profiling.profiled_task(sum, [1, 2, 3]), 6)
+                # The request's own profiler falls back to sampling
+                store = ProfileStore()
+                result, profile_id = store.run("cprofile", "q", sum, [1, 2])
+        finally:
+            profiling._task_profiles.reset(token)
+        self.assertEqual(profiles, [])
+        self.assertEqual(result, 3)
+        self.assertEqual(store.get(profile_id)["mode"], "sample")
+
+    def test_sampler_aggregates_hot_stacks(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=self._busy, args=(stop,))
+        worker.start()
+        sampler = StackSampler(interval=0.001)
+        try:
+            for _ in range(20):
+                sampler.sample()
+        finally:
+            stop.set()
+            worker.join()
+
+        top_stack, count = sampler.collapsed().splitlines()[0].rsplit(" ", 1)
+        self.assertIn("_busy (test.py:", top_stack)
+        self.assertEqual(int(count), 20)
+
+    @patch('agent.WebResearchAgent.research', return_value="Report")
+    def test_admin_routes_need_token(self, _):
+        import app
+        client = app.app.test_client()
+        with patch.dict(os.environ, {'ADMIN_TOKEN': 'secret'}):
+            self.assertEqual(client.get('/admin/stacks').status_code, 403)
+
+            # The profile header is ignored without the token
+            response = client.post('/research', json={'query': 'test'}, headers={'X-Profile': 'cprofile'})
+            self.assertNotIn('profile_id', response.get_json())
+
+            auth = {'Authorization': 'Bearer secret'}
+            response = client.post('/research', json={'query': 'test'}, headers={'X-Profile': 'cprofile', **auth})
+            profile_id = response.get_json()['profile_id']
+            profile = client.get(f'/admin/profiles/{profile_id}?format=text', headers=auth)
+            self.assertEqual(profile.status_code, 200)
+            self.assertIn(b'function calls', profile.data)
+
+            client.post('/admin/profiling', json={'requests': 1, 'mode': 'sample'}, headers=auth)
+            self.assertIn('profile_id', client.post('/research', json={'query': 'test'}).get_json())
+            self.assertNotIn('profile_id', client.post('/research', json={'query': 'test'}).get_json())
+        self.assertEqual(client.get('/admin/stacks').status_code, 404)
+
+    def test_stats_need_token(self):
+        import app
+        client = app.app.test_client()
+        self.assertEqual(client.get('/stats').status_code, 404)
+        with patch.dict(os.environ, {'ADMIN_TOKEN': 'secret'}):
+            self.assertEqual(client.get('/stats').status_code, 403)
+            self.assertEqual(client.get('/stats', headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+            response = client.get('/stats', headers={'Authorization': 'Bearer secret'})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('breakers', response.get_json())
+
+class TestCassettes(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "run.cassette.gz")
+
+    def _agent(self, cassette, live_model=None):
+        agent = WebResearchAgent()
+        agent.llm = LLMClient(live_model or MagicMock(), hedge=False)
+        return install(agent, cassette)
+
+    def test_record_then_replay_tools(self):
+        live_model = MagicMock()
+        live_model.generate_content.return_value = MagicMock(text='{"relevance_score": 7}')
+        cassette = Cassette(self.path, mode="record")
+        agent = self._agent(cassette, live_model)
+        agent.web_search.fetch_results = cassette.wrap_search(
+            lambda params: {"organic_results": [{"title": "A", "link": "http://a.example.com"}]})
+        agent.web_scraper.fetch_page = cassette.wrap_fetch_page(
+            lambda url, headers, timeout: (200, b"<html><title>A</title><body>Solar panels</body></html>"))
+        agent.llm.generate("prompt", timeout=5)
+        agent.web_search.search("solar panels")
+        agent.web_scraper.scrape("http://a.example.com")
+        cassette.save()
+
+        replay = Cassette(self.path, latency_scale=0)
+        agent = self._agent(replay)
+        self.assertEqual(agent.web_search.search("solar panels")[0]["link"], "http://a.example.com")
+        self.assertEqual(agent.web_scraper.scrape("http://a.example.com")["title"], "A")
+        self.assertEqual(agent.llm.generate("prompt", timeout=5).text, '{"relevance_score": 7}')
+
+        # Unrecorded requests fail like an unreachable upstream
+        self.assertEqual(agent.web_search.search("wind power"), [])
+        self.assertEqual(replay.snapshot(), {"calls": {"serpapi": 2, "http": 1, "gemini": 1},
+                                             "misses": {"serpapi": 1}})
+
+    def test_replay_scales_latency(self):
+        cassette = Cassette(self.path, mode="record")
+        cassette.call("http", {"url": "u"}, lambda: (time.sleep(0.2), {"status": 200})[1])
+        cassette.save()
+
+        start_time = time.monotonic()
+        self.assertEqual(Cassette(self.path, latency_scale=0.25).call("http", {"url": "u"}, None)[0]["status"], 200)
+        self.assertLess(time.monotonic() - start_time, 0.15)
+        with self.assertRaises(CassetteMiss):
+            Cassette(self.path).call("http", {"url": "other"}, None)
+
+class TestColdStart(unittest.TestCase):
+    def test_heavy_dependencies_are_not_imported_with_app(self):
+        import subprocess
+        heavy = ["google.generativeai", "serpapi", "bs4", "psutil"]
+        code = ("import sys, app; print(','.join(m for m in %r if m in sys.modules))" % heavy)
+        completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True,
+                                   cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+        self.assertEqual(completed.returncode, 0, completed.stderr)
+        self.assertEqual(completed.stdout.strip(), "")
+
+class TestBulkResearch(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _write(self, name, text):
+        path = os.path.join(self.temp_dir.name, name)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def test_load_queries(self):
+        path = self._write("queries.jsonl",
+                           '{"id": "q1", "query": "first"}\n"second"\n\nnot json\n{"query": ""}\n')
+        queries = bulk_research.load_queries(path)
+
+        # Explicit ids are kept, otherwise the line number is used
+        self.assertEqual(queries, [{"id": "q1", "query": "first"}, {"id": "2", "query": "second"}])
+
+    def test_load_completed_ids_truncates_partial_line(self):
+        complete = '{"id": "q1", "result": "done"}\n'
+        path = self._write("results.jsonl", complete + '{"id": "q2", "res')
+
+        completed = bulk_research.load_completed_ids(path)
+
+        # The killed run's partial record is dropped so q2 runs again
+        self.assertEqual(completed, {"q1"})
+        with open(path) as f:
+            self.assertEqual(f.read(), complete)
+
+    def test_failed_queries_are_retried_on_resume(self):
+        path = self._write("results.jsonl", '{"id": "q1", "result": "done", "error": null}\n'
+                                            '{"id": "q2", "result": null, "error": "boom"}\n')
+        self.assertEqual(bulk_research.load_completed_ids(path), {"q1"})
+
+        agent = MagicMock()
+        agent.research.return_value = "An error occurred during the research process: timeout"
+        with patch.object(bulk_research, "_worker_agent", agent):
+            output = bulk_research._research_one({"id": "q2", "query": "test"})
+        self.assertIsNone(output["result"])
+        self.assertIn("timeout", output["error"])
+
+    def test_load_completed_ids_missing_file(self):
+        path = os.path.join(self.temp_dir.name, "missing.jsonl")
+        self.assertEqual(bulk_research.load_completed_ids(path), set())
+
+    def test_shared_rate_limiter(self):
+        limiter = SharedRateLimiter(0.2)
+        start_time = time.time()
+
+        for _ in range(3):
+            limiter.wait()
+
+        # Three calls need two full intervals between them
+        self.assertGreaterEqual(time.time() - start_time, 0.4)
+
 if __name__ == '__main__':
     unittest.main()
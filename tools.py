@@ -1,46 +1,121 @@
-import requests
+import hashlib
 import json
 import os
-from bs4 import BeautifulSoup
-from serpapi import GoogleSearch
 from dotenv import load_dotenv
-import google.generativeai as genai
 import re
 import gc  # Import garbage collection
 import time  # For rate limiting
-
+import threading
+import contextvars
+from utils import apply_shared_rate_limit, aapply_shared_rate_limit, extract_json_from_text, AsyncIntervalLimiter
+from utils import TTLCache, normalize_query
+from relevance import LocalRelevanceScorer
+from llm import get_llm_client, LLMTimeoutError, LLMStream
+from resilience import CircuitOpenError, acall_upstream, call_upstream, get_breaker
+from depth import DepthLimit
+from domain_stats import get_domain_stats
+from knowledge_index import get_knowledge_index
+from parsing import parse_html, get_parsing_pool
+
+# requests, bs4 and serpapi are imported on first use to keep cold start fast;
+# the Gemini SDK is loaded by the shared client in llm.py
 load_dotenv()
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+
+# SerpAPI's JSON endpoint, called directly by the asyncio methods
+SERPAPI_URL = "https://serpapi.com/search.json"
+
+def serpapi_search(params):
+    """Run a SerpAPI search and return the response as a dict"""
+    from serpapi import GoogleSearch
+    return GoogleSearch(params).get_dict()
+
+def fetch_page(url, headers, timeout=10):
+    """GET a page; returns (status code, body bytes)"""
+    import requests
+    response = requests.get(url, headers=headers, timeout=timeout)
+    return response.status_code, response.content
+
+def serpapi_failed(results):
+    """True for a SerpAPI error payload other than "no results" (bad key, quota, outage)"""
+    error = results.get("error") if isinstance(results, dict) else None
+    return bool(error) and "hasn't returned any results" not in error
+
+async def _fetch_json(session, url, params, timeout=30):
+    """GET a JSON document with an aiohttp session"""
+    import aiohttp
+    async with session.get(url, params=params, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+        return await response.json(content_type=None)
 
 class WebSearchTool:
     def __init__(self):
         self.api_key = os.getenv("SERPAPI_KEY")
         self.last_request_time = 0
         self.min_request_interval = 1  # Minimum 1 second between requests
+        self.rate_limit_lock = threading.Lock()  # The tool is shared by concurrent requests
+        self.async_limiter = AsyncIntervalLimiter()
+        self.fetch_results = serpapi_search  # Swapped out by the record/replay harness (cassettes.py)
+        self.breaker = get_breaker("serpapi")
 
-    def search(self, query, num_results=3):
+    def search(self, query, num_results=3, start=0):
         """
         Performs a web search using SerpAPI and returns search results
         Enhanced with rate limiting and strict result limiting
+
+        start skips that many results (further result pages).
+
+        Failed calls are retried within the request's retry budget; while
+        SerpAPI's circuit is open no call is made and [] is returned at once.
         """
         try:
-            # Rate limiting
+            results = call_upstream(self.breaker, self._fetch, self._params(query, num_results, start),
+                                    is_failure=serpapi_failed)
+
+            search_results = self._parse_results(results, num_results)
+
+            # Clear variables to free memory
+            del results
+            gc.collect()
+
+            return search_results
+        except Exception as e:
+            print(f"Error in web search: {e}")
+            return []
+
+    async def asearch(self, query, num_results=3, session=None, start=0):
+        """asyncio version of search(), calling SerpAPI's JSON endpoint with an aiohttp session"""
+        try:
+            await self.async_limiter.wait(self.min_request_interval)
+            await aapply_shared_rate_limit("serpapi")
+            results = await acall_upstream(self.breaker, _fetch_json, session, SERPAPI_URL,
+                                           self._params(query, num_results, start), is_failure=serpapi_failed)
+            return self._parse_results(results, num_results)
+        except Exception as e:
+            print(f"Error in web search: {e}")
+            return []
+
+    def _fetch(self, params):
+        """One rate-limited SerpAPI call (retries are rate limited too)"""
+        with self.rate_limit_lock:
             current_time = time.time()
             time_since_last_request = current_time - self.last_request_time
             if time_since_last_request < self.min_request_interval:
                 time.sleep(self.min_request_interval - time_since_last_request)
+            apply_shared_rate_limit("serpapi")
 
             self.last_request_time = time.time()
+        return self.fetch_results(params)
 
-            # Clean and sanitize the query to handle special characters
-            # This ensures question marks, exclamation marks, etc. are properly handled
-            sanitized_query = query.strip()
+    def _params(self, query, num_results, start=0):
+        """SerpAPI parameters for a query"""
+        # Clean and sanitize the query to handle special characters
+        # This ensures question marks, exclamation marks, etc. are properly handled
+        sanitized_query = query.strip()
 
-            # Log the query for debugging
-            print(f"Searching for: '{sanitized_query}'")
+        # Log the query for debugging
+        print(f"Searching for: '{sanitized_query}'")
 
-            # Improve search parameters for complex or simple queries
-            params = {
+        # Improve search parameters for complex or simple queries
+        params = {
                 "engine": "google",
                 "q": sanitized_query,
                 "api_key": self.api_key,
@@ -49,344 +124,452 @@ class WebSearchTool:
                 "hl": "en",  # Language English
                 "safe": "active"  # Safe search
             }
-
-            # For very short queries, try to get more diverse results
-            if len(query.split()) < 3:
-                params["tbs"] = "qdr:y"  # Last year results for more relevant content
-
-            # For complex topics, focus on educational content
-            if any(complex_topic in query.lower() for complex_topic in
-                  ["quantum", "physics", "philosophy", "theory"]):
-                params["as_sitesearch"] = ".edu"  # Focus on educational sites
-
-            search = GoogleSearch(params)
-            results = search.get_dict()
-
-            search_results = []
-            if "organic_results" in results:
-                for result in results["organic_results"][:num_results]:
-                    search_results.append({
-                        "title": result.get("title", ""),
-                        "link": result.get("link", ""),
-                        "snippet": result.get("snippet", ""),
-                        "source": "Google Search"
-                    })
-
-            # Clear variables to free memory
-            del results
-            gc.collect()
-
-            # Strictly limit to exactly num_results (or fewer if not available)
-            search_results = search_results[:num_results]
-
-            return search_results
-        except Exception as e:
-            print(f"Error in web search: {e}")
-            return []
+        if start:
+            params["start"] = start  # Result offset, for later pages
+
+        # For very short queries, try to get more diverse results
+        if len(query.split()) < 3:
+            params["tbs"] = "qdr:y"  # Last year results for more relevant content
+
+        # For complex topics, focus on educational content
+        if any(complex_topic in query.lower() for complex_topic in
+              ["quantum", "physics", "philosophy", "theory"]):
+            params["as_sitesearch"] = ".edu"  # Focus on educational sites
+
+        return params
+
+    def _parse_results(self, results, num_results):
+        """Organic results of a SerpAPI response"""
+        search_results = []
+        if "organic_results" in results:
+            for result in results["organic_results"][:num_results]:
+                search_results.append({
+                    "title": result.get("title", ""),
+                    "link": result.get("link", ""),
+                    "snippet": result.get("snippet", ""),
+                    "source": "Google Search"
+                })
+
+        # Strictly limit to exactly num_results (or fewer if not available)
+        return search_results[:num_results]
 
 class WebScraperTool:
+    max_content_length = DepthLimit()  # A request's depth profile can override it (depth.py)
+
     def __init__(self):
         self.headers = {"User-Agent": "Mozilla/5.0"}
         self.max_content_length = 2500  # Increased for Vercel's higher memory capacity
+        # Per-domain latency/failure/relevance memory shared across the process
+        self.domain_stats = get_domain_stats()
+        # Local index of everything scraped, consulted before searching the web
+        self.knowledge_index = get_knowledge_index()
+        # Optional process pool for HTML parsing (None: parse in this thread)
+        self.parsing_pool = get_parsing_pool()
+        self.fetch_page = fetch_page  # Swapped out by the record/replay harness (cassettes.py)
 
     def scrape(self, url):
         """Scrapes content from a URL with error handling and content length limits"""
+        start_time = time.time()
         try:
-            response = requests.get(url, headers=self.headers, timeout=10)
-            soup = BeautifulSoup(response.content, 'html.parser')
-
-            # Extract title and main content
-            title = soup.title.string if soup.title else 'No title found'
-            content = soup.get_text(separator='\n', strip=True)
+            status_code, content = self.fetch_page(url, self.headers, 10)
+            if status_code >= 400:
+                # Bot blocks and paywalls (403, 429...) aren't worth analyzing
+                raise RuntimeError(f"HTTP {status_code}")
 
-            # Limit content size to prevent memory issues
-            content = content[:self.max_content_length]
+            return self._process_page(url, content, start_time)
 
-            return {
-                "title": title,
-                "content": content,
-                "url": url
-            }
+        except Exception as e:
+            return self._failed_scrape(url, start_time, e)
 
+    async def ascrape(self, url, session):
+        """asyncio version of scrape() using an aiohttp session; parsing runs off the event loop"""
+        import asyncio
+        start_time = time.time()
+        try:
+            import aiohttp
+
+            async with session.get(url, headers=self.headers, timeout=aiohttp.ClientTimeout(total=10)) as response:
+                if response.status >= 400:
+                    # Bot blocks and paywalls (403, 429...) aren't worth analyzing
+                    raise RuntimeError(f"HTTP {response.status}")
+                html = await response.read()
+
+            loop = asyncio.get_running_loop()
+            # The copied context carries the request's depth limits into the executor thread
+            return await loop.run_in_executor(None, contextvars.copy_context().run, self._process_page,
+                                              url, html, start_time)
         except Exception as e:
-            print(f"Error scraping {url}: {e}")
-            return {
-                "title": "Error loading page",
-                "content": "",
-                "url": url
-            }
+            # Recording the failure may write the domain stats file
+            return await asyncio.to_thread(self._failed_scrape, url, start_time, e)
+
+    def _process_page(self, url, html, start_time):
+        """Parse a fetched page, record the fetch and index the text"""
+        # Extract title and main content, limiting content size to prevent memory issues
+        parsed = self._parse(html)
+        title = parsed["title"]
+        content = parsed["content"]
+
+        self.domain_stats.record_fetch(url, time.time() - start_time, len(content))
+        if self.knowledge_index is not None:
+            self.knowledge_index.add(url, title, content)
+
+        return {
+            "title": title,
+            "content": content,
+            "url": url
+        }
+
+    def _failed_scrape(self, url, start_time, error):
+        print(f"Error scraping {url}: {error}")
+        self.domain_stats.record_fetch(url, time.time() - start_time, 0, failed=True)
+        return {
+            "title": "Error loading page",
+            "content": "",
+            "url": url
+        }
+
+    def _parse(self, html):
+        """Parse in the process pool when enabled, falling back to this thread"""
+        if self.parsing_pool is not None:
+            try:
+                return self.parsing_pool.parse(html, self.max_content_length)
+            except Exception as e:
+                print(f"Parsing pool failed, parsing in-thread: {e}")
+        return parse_html(html, self.max_content_length)
 
 class ContentAnalyzerTool:
+    max_analysis_length = DepthLimit()  # A request's depth profile can override it (depth.py)
+
     def __init__(self):
         self.api_key = os.getenv("GEMINI_API_KEY")
-        genai.configure(api_key=self.api_key)
-        self.model = genai.GenerativeModel('gemini-1.5-flash')  # Lighter model
+        self.llm = get_llm_client('gemini-1.5-flash')  # Lighter model, shared client pool
+        self.llm_timeout = 20  # Per-call deadline in seconds
         # Set a reasonable content limit for low-resource environment
         self.max_analysis_length = 1000  # Balanced value between 500 and 2000
         self.last_request_time = 0
         self.min_request_interval = 1  # Minimum 1 second between requests
-
-    def analyze(self, text, query):
+        self.rate_limit_lock = threading.Lock()
+        self.async_limiter = AsyncIntervalLimiter()
+        # Stream responses so pages below the caller's threshold can be
+        # rejected as soon as the score arrives
+        self.stream_analysis = True
+        # Local scorer that settles confident cases before calling Gemini;
+        # set to None to send every page to the LLM
+        self.cascade = LocalRelevanceScorer()
+        # Analyses of identical text for the same query and prompt are reused
+        # (popular articles, the same match report for every "who won" query)
+        self.analysis_cache = TTLCache(maxsize=int(os.getenv("ANALYSIS_CACHE_SIZE", 1000)),
+                                       ttl=int(os.getenv("ANALYSIS_CACHE_TTL", 24 * 3600)))
+
+    def analyze(self, text, query, min_relevance=None, key_aspects=None):
         """
         Analyzes text content for relevance to the query
         Enhanced with rate limiting and chunking for long content
+
+        Pages the local cascade is confident about are scored without an LLM
+        call. When min_relevance is given and streaming is enabled, generation
+        is cancelled as soon as the model reports a relevance_score below it.
+        While Gemini's circuit is open, every page is scored locally instead.
         """
         try:
-            # Rate limiting
-            current_time = time.time()
-            time_since_last_request = current_time - self.last_request_time
-            if time_since_last_request < self.min_request_interval:
-                time.sleep(self.min_request_interval - time_since_last_request)
+            local = self._local_analysis(text, query, key_aspects)
+            if local is not None:
+                return local
+            if self.llm.breaker is not None and self.llm.breaker.is_open():
+                return self._degraded_analysis(text, query, key_aspects)
 
-            self.last_request_time = time.time()
+            cache_key = self._cache_key(text, query, min_relevance)
+            cached = self.analysis_cache.get(cache_key)
+            if cached is not None:
+                return dict(cached)
 
-            # Check if this is a sports-related query
-            is_sports_query = any(term in query.lower() for term in
-                                ["score", "match", "game", "won", "win", "ipl", "cricket", "football", "soccer", "nba", "nfl"])
+            # Rate limiting (locked: pages and requests are analyzed concurrently)
+            with self.rate_limit_lock:
+                current_time = time.time()
+                time_since_last_request = current_time - self.last_request_time
+                if time_since_last_request < self.min_request_interval:
+                    time.sleep(self.min_request_interval - time_since_last_request)
+                apply_shared_rate_limit("gemini")
 
-            # Log the query type for debugging
-            if is_sports_query:
-                print(f"Analyzing content for sports query: '{query}'")
-            else:
-                print(f"Analyzing content for query: '{query}'")
-
-            # Clean the query to handle special characters
-            cleaned_query = query.strip()
-
-            # Implement chunking for very long content
-            if len(text) > self.max_analysis_length:
-                chunks = [text[i:i+self.max_analysis_length]
-                         for i in range(0, len(text), self.max_analysis_length)]
-                chunks = chunks[:2]  # Limit to first 2 chunks to save resources
-
-                all_relevant_content = []
-                relevance_scores = []
-
-                for chunk in chunks:
-                    # Process each chunk with appropriate prompt based on query type
-                    if is_sports_query:
-                        prompt = f"""Analyze the following text for information relevant to this sports query: '{cleaned_query}'.
-                        This is a SPORTS-RELATED query, so prioritize:
-                        - Recent match results, scores, and outcomes
-                        - Team or player performance information
-                        - Latest sports news and updates
-                        - Time-sensitive information (like "last night's game")
-
-                        Return a JSON object with three fields:
-                        1. 'relevance_score' (0-10 scale, score 7+ if it contains direct match results)
-                        2. 'relevant_content' (extracted relevant information)
-                        3. 'source_quality' (0-10 scale, indicating how authoritative the source seems)
-
-                        Keep the relevant_content concise, maximum 800 words.
-
-                        Text to analyze: {chunk}"""
-                    else:
-                        prompt = f"""Analyze the following text for information relevant to this query: '{cleaned_query}'.
-                        Return a JSON object with three fields:
-                        1. 'relevance_score' (0-10 scale)
-                        2. 'relevant_content' (extracted relevant information)
-                        3. 'source_quality' (0-10 scale, indicating how authoritative the source seems)
-
-                        Keep the relevant_content concise, maximum 800 words.
-
-                        Text to analyze: {chunk}"""
-
-                    response = self.model.generate_content(prompt)
-
-                    # Process the response to extract JSON
-                    response_text = response.text
-
-                    # Clear variables to free memory
-                    del response
-                    del prompt
-                    gc.collect()
-
-                    # Find JSON content between code blocks if present
-                    json_match = re.search(r'```(?:json)?\s*(.*?)```', response_text, re.DOTALL)
-                    if json_match:
-                        json_str = json_match.group(1)
-                    else:
-                        # Try to find anything that looks like JSON
-                        json_str = re.search(r'(\{.*\})', response_text, re.DOTALL)
-                        if json_str:
-                            json_str = json_str.group(1)
-                        else:
-                            json_str = response_text
-
-                    try:
-                        result = json.loads(json_str)
-                        # Ensure the result has the expected fields
-                        if "relevance_score" not in result:
-                            result["relevance_score"] = 5
-                        if "relevant_content" not in result:
-                            result["relevant_content"] = "No relevant content extracted"
-                        if "source_quality" not in result:
-                            result["source_quality"] = 5
-
-                        # Limit the size of relevant_content
-                        if len(result["relevant_content"]) > 2000:
-                            result["relevant_content"] = result["relevant_content"][:2000]
-
-                        # Clear variables to free memory
-                        del json_str
-                        del response_text
-                        gc.collect()
-
-                        # Add result to our collections
-                        relevance_scores.append(result.get("relevance_score", 5))
-                        all_relevant_content.append(result.get("relevant_content", ""))
-
-                        # Continue to next chunk instead of returning immediately
-                        continue
-                    except json.JSONDecodeError:
-                        # If we can't parse JSON, return a default response
-                        content = response_text[:800]
-
-                        # Clear variables to free memory
-                        del response_text
-                        gc.collect()
-
-                        # Add default result to our collections
-                        relevance_scores.append(5)
-                        all_relevant_content.append(content)
-
-                        # Continue to next chunk instead of returning immediately
-                        continue
-
-                # After processing all chunks, combine results
-                # Use the highest relevance score
-                avg_relevance = sum(relevance_scores) / len(relevance_scores) if relevance_scores else 5
-                combined_content = " ".join(all_relevant_content)
-
-                # Limit combined content length
-                if len(combined_content) > 2000:
-                    combined_content = combined_content[:2000]
-
-                return {
-                    "relevance_score": avg_relevance,
-                    "relevant_content": combined_content,
-                    "source_quality": 5
-                }
+                self.last_request_time = time.time()
+
+            cleaned_query, is_sports_query, chunks = self._prepare(text, query)
 
             # For content that doesn't need chunking, process normally
-            # Use different prompts for sports queries vs. regular queries
-            if is_sports_query:
-                prompt = f"""Analyze the following text for information relevant to this sports query: '{cleaned_query}'.
-                This is a SPORTS-RELATED query, so prioritize:
-                - Recent match results, scores, and outcomes
-                - Team or player performance information
-                - Latest sports news and updates
-                - Time-sensitive information (like "last night's game")
-
-                Return a JSON object with three fields:
-                1. 'relevance_score' (0-10 scale, score 7+ if it contains direct match results)
-                2. 'relevant_content' (extracted relevant information)
-                3. 'source_quality' (0-10 scale, indicating how authoritative the source seems)
-
-                Keep the relevant_content concise, maximum 800 words.
-
-                Text to analyze: {text}"""
+            if len(chunks) == 1:
+                result = self._analyze_chunk(chunks[0], cleaned_query, is_sports_query, min_relevance)
             else:
-                prompt = f"""Analyze the following text for information relevant to this query: '{cleaned_query}'.
-                Return a JSON object with three fields:
-                1. 'relevance_score' (0-10 scale)
-                2. 'relevant_content' (extracted relevant information)
-                3. 'source_quality' (0-10 scale, indicating how authoritative the source seems)
-
-                Keep the relevant_content concise, maximum 800 words.
-
-                Text to analyze: {text}"""
+                result = self._combine_chunks([self._analyze_chunk(chunk, cleaned_query, is_sports_query, min_relevance)
+                                               for chunk in chunks])
+            self.analysis_cache.set(cache_key, dict(result))
+            return result
 
-            response = self.model.generate_content(prompt)
-            response_text = response.text
-
-            # Find JSON content between code blocks if present
-            json_match = re.search(r'```(?:json)?\s*(.*?)```', response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                # Try to find anything that looks like JSON
-                json_str = re.search(r'(\{.*\})', response_text, re.DOTALL)
-                if json_str:
-                    json_str = json_str.group(1)
-                else:
-                    json_str = response_text
+        except CircuitOpenError:
+            return self._degraded_analysis(text, query, key_aspects)
+        except Exception as e:
+            print(f"Error in content analysis: {e}")
+            return {"relevance_score": 0, "relevant_content": "", "source_quality": 0}
 
-            try:
-                result = json.loads(json_str)
-                # Ensure the result has the expected fields
-                if "relevance_score" not in result:
-                    result["relevance_score"] = 5
-                if "relevant_content" not in result:
-                    result["relevant_content"] = "No relevant content extracted"
-                if "source_quality" not in result:
-                    result["source_quality"] = 5
-
-                # Limit the size of relevant_content
-                if len(result["relevant_content"]) > 2000:
-                    result["relevant_content"] = result["relevant_content"][:2000]
-
-                # Clear variables to free memory
-                del json_str
-                del response_text
-                del response
-                del prompt
-                gc.collect()
-
-                return result
-            except json.JSONDecodeError:
-                # If we can't parse JSON, return a default response
-                content = response_text[:800]
-
-                # Clear variables to free memory
-                del response_text
-                del response
-                del prompt
-                gc.collect()
-
-                return {"relevance_score": 5, "relevant_content": content, "source_quality": 5}
+    async def aanalyze(self, text, query, min_relevance=None, key_aspects=None):
+        """
+        asyncio version of analyze()
 
+        Chunks are analyzed concurrently. Responses aren't streamed, so there
+        is no early abort below min_relevance; the local cascade still applies.
+        """
+        try:
+            local = self._local_analysis(text, query, key_aspects)
+            if local is not None:
+                return local
+            if self.llm.breaker is not None and self.llm.breaker.is_open():
+                return self._degraded_analysis(text, query, key_aspects)
+
+            cache_key = self._cache_key(text, query, None)
+            cached = self.analysis_cache.get(cache_key)
+            if cached is not None:
+                return dict(cached)
+
+            await self.async_limiter.wait(self.min_request_interval)
+            await aapply_shared_rate_limit("gemini")
+
+            import asyncio
+            cleaned_query, is_sports_query, chunks = self._prepare(text, query)
+            results = await asyncio.gather(*[self._aanalyze_chunk(chunk, cleaned_query, is_sports_query)
+                                             for chunk in chunks])
+            result = results[0] if len(results) == 1 else self._combine_chunks(results)
+            self.analysis_cache.set(cache_key, dict(result))
+            return result
+        except CircuitOpenError:
+            return self._degraded_analysis(text, query, key_aspects)
         except Exception as e:
             print(f"Error in content analysis: {e}")
             return {"relevance_score": 0, "relevant_content": "", "source_quality": 0}
 
+    def _cache_key(self, text, query, min_relevance):
+        """
+        Analysis cache key: hashes of the text and of the prompt template
+        (sports or general variant, so editing a template invalidates its
+        entries), the normalized query, the chunk length (it varies with the
+        request's depth) and the early-abort threshold
+        """
+        is_sports_query = self._is_sports_query(query)
+        template = self._build_prompt("", "", is_sports_query)
+        return (hashlib.sha1(text.encode("utf-8")).hexdigest(),
+                hashlib.sha1(template.encode("utf-8")).hexdigest()[:16],
+                normalize_query(query), self.max_analysis_length, min_relevance)
+
+    def _local_analysis(self, text, query, key_aspects):
+        """The cascade's result when it is confident, else None"""
+        if self.cascade is None:
+            return None
+        local = self.cascade.assess(text, query, key_aspects)
+        if local["decision"] == "reject":
+            return {"relevance_score": local["relevance_score"], "relevant_content": "",
+                    "source_quality": 0, "scored_by": "local"}
+        if local["decision"] == "accept":
+            return {"relevance_score": local["relevance_score"],
+                    "relevant_content": self.cascade.summarize(text, query, key_aspects),
+                    "source_quality": 5, "scored_by": "local"}
+        return None
+
+    def _degraded_analysis(self, text, query, key_aspects):
+        """
+        Local score and extractive summary for a page the cascade would have
+        escalated, used while Gemini is unavailable (not cached)
+        """
+        scorer = self.cascade or LocalRelevanceScorer()
+        return {"relevance_score": scorer.score(text, query, key_aspects),
+                "relevant_content": scorer.summarize(text, query, key_aspects),
+                "source_quality": 5, "scored_by": "local", "degraded": True}
+
+    def _prepare(self, text, query):
+        """Returns (cleaned query, is sports query, chunks of text to analyze)"""
+        is_sports_query = self._is_sports_query(query)
+
+        # Log the query type for debugging
+        if is_sports_query:
+            print(f"Analyzing content for sports query: '{query}'")
+        else:
+            print(f"Analyzing content for query: '{query}'")
+
+        # Clean the query to handle special characters
+        cleaned_query = query.strip()
+
+        # Implement chunking for very long content
+        chunks = [text[i:i+self.max_analysis_length]
+                 for i in range(0, len(text), self.max_analysis_length)]
+        chunks = chunks[:2]  # Limit to first 2 chunks to save resources
+        return cleaned_query, is_sports_query, chunks or [""]
+
+    def _is_sports_query(self, query):
+        """Check if this is a sports-related query"""
+        return any(term in query.lower() for term in
+                   ["score", "match", "game", "won", "win", "ipl", "cricket", "football", "soccer", "nba", "nfl"])
+
+    def _combine_chunks(self, results):
+        """Combine the analyses of a page's chunks"""
+        all_relevant_content = []
+        relevance_scores = []
+
+        for result in results:
+            relevance_scores.append(result.get("relevance_score", 5))
+            if result.get("relevant_content"):
+                all_relevant_content.append(result["relevant_content"])
+
+        # After processing all chunks, combine results
+        avg_relevance = sum(relevance_scores) / len(relevance_scores) if relevance_scores else 5
+        combined_content = " ".join(all_relevant_content)
+
+        # Limit combined content length
+        if len(combined_content) > 2000:
+            combined_content = combined_content[:2000]
+
+        return {
+            "relevance_score": avg_relevance,
+            "relevant_content": combined_content,
+            "source_quality": 5
+        }
+
+    def _build_prompt(self, text, cleaned_query, is_sports_query):
+        """Build the analysis prompt; the score is requested first so it can be streamed early"""
+        if is_sports_query:
+            return f"""Analyze the following text for information relevant to this sports query: '{cleaned_query}'.
+            This is a SPORTS-RELATED query, so prioritize:
+            - Recent match results, scores, and outcomes
+            - Team or player performance information
+            - Latest sports news and updates
+            - Time-sensitive information (like "last night's game")
+
+            Return a JSON object with three fields, in exactly this order:
+            1. 'relevance_score' (0-10 scale, score 7+ if it contains direct match results)
+            2. 'source_quality' (0-10 scale, indicating how authoritative the source seems)
+            3. 'relevant_content' (extracted relevant information)
+
+            Keep the relevant_content concise, maximum 800 words.
+
+            Text to analyze: {text}"""
+
+        return f"""Analyze the following text for information relevant to this query: '{cleaned_query}'.
+            Return a JSON object with three fields, in exactly this order:
+            1. 'relevance_score' (0-10 scale)
+            2. 'source_quality' (0-10 scale, indicating how authoritative the source seems)
+            3. 'relevant_content' (extracted relevant information)
+
+            Keep the relevant_content concise, maximum 800 words.
+
+            Text to analyze: {text}"""
+
+    def _analyze_chunk(self, text, cleaned_query, is_sports_query, min_relevance):
+        """Run one analysis prompt and parse its JSON result"""
+        prompt = self._build_prompt(text, cleaned_query, is_sports_query)
+
+        if self.stream_analysis and min_relevance is not None:
+            response_text, early_score = self._generate_streaming(prompt, min_relevance)
+            if early_score is not None:
+                # Rejected before the model wrote relevant_content
+                return {"relevance_score": early_score, "relevant_content": "", "source_quality": 0}
+        else:
+            response = self.llm.generate(prompt, timeout=self.llm_timeout)
+            response_text = response.text
+            del response
+
+        # Clear variables to free memory
+        del prompt
+        gc.collect()
+
+        return self._parse_analysis(response_text)
+
+    async def _aanalyze_chunk(self, text, cleaned_query, is_sports_query):
+        """asyncio version of _analyze_chunk, without streaming"""
+        prompt = self._build_prompt(text, cleaned_query, is_sports_query)
+        response = await self.llm.agenerate(prompt, timeout=self.llm_timeout)
+        return self._parse_analysis(response.text)
+
+    def _parse_analysis(self, response_text):
+        """Parse an analysis response into relevance_score, relevant_content and source_quality"""
+        result = extract_json_from_text(response_text)
+        if not isinstance(result, dict):
+            # If we can't parse JSON, return a default response
+            return {"relevance_score": 5, "relevant_content": response_text[:800], "source_quality": 5}
+
+        # Ensure the result has the expected fields
+        if "relevance_score" not in result:
+            result["relevance_score"] = 5
+        if "relevant_content" not in result:
+            result["relevant_content"] = "No relevant content extracted"
+        if "source_quality" not in result:
+            result["source_quality"] = 5
+
+        # Limit the size of relevant_content
+        if len(result["relevant_content"]) > 2000:
+            result["relevant_content"] = result["relevant_content"][:2000]
+
+        return result
+
+    def _generate_streaming(self, prompt, min_relevance):
+        """
+        Stream a generation and stop early if the relevance score is below min_relevance
+
+        Returns (response_text, early_score); early_score is set only when
+        generation was cancelled.
+        """
+        deadline = time.monotonic() + self.llm_timeout
+        response = self.llm.generate(prompt, timeout=self.llm_timeout, stream=True)
+        received = ""
+        score_checked = False
+
+        for chunk in response:
+            if time.monotonic() > deadline:
+                _cancel_stream(response)
+                raise LLMTimeoutError("Streaming analysis exceeded its deadline")
+            received += chunk.text
+            if score_checked:
+                continue
+
+            score_match = _STREAM_SCORE_PATTERN.search(received)
+            if not score_match:
+                continue
+
+            score_checked = True
+            score = float(score_match.group(1))
+            if score < min_relevance:
+                print(f"Relevance {score} below {min_relevance}, stopping analysis early")
+                _cancel_stream(response)
+                return received, score
+
+        # The full response is resolved once the stream is exhausted
+        return response.text, None
+
+# Matches a complete "relevance_score": <number> pair in a partial JSON response
+_STREAM_SCORE_PATTERN = re.compile(r'"?relevance_score"?\s*:\s*"?(\d+(?:\.\d+)?)"?\s*[,}\n]')
+
+def _cancel_stream(response):
+    """Stop a streamed generation (an LLMStream also gives its slot back)"""
+    if isinstance(response, LLMStream):
+        response.cancel()
+        return
+    cancel = getattr(getattr(response, "_iterator", None), "cancel", None)
+    if callable(cancel):
+        cancel()
+
 class NewsAggregatorTool:
     def __init__(self):
         self.api_key = os.getenv("SERPAPI_KEY")
         self.last_request_time = 0
         self.min_request_interval = 1  # Minimum 1 second between requests
+        self.async_limiter = AsyncIntervalLimiter()
+        self.fetch_results = serpapi_search  # Swapped out by the record/replay harness (cassettes.py)
+        self.breaker = get_breaker("serpapi")
 
     def get_news(self, topic, max_results=3):  # Reduced from 5
         """
         Gets recent news articles on a specific topic
         """
         try:
-            # Clean and sanitize the topic to handle special characters
-            sanitized_topic = topic.strip()
+            results = call_upstream(self.breaker, self._fetch, self._params(topic, max_results),
+                                    is_failure=serpapi_failed)
 
-            # Log the topic for debugging
-            print(f"Searching news for: '{sanitized_topic}'")
-
-            params = {
-                "engine": "google",
-                "q": sanitized_topic,
-                "tbm": "nws",  # News search
-                "api_key": self.api_key,
-                "num": max_results
-            }
-            search = GoogleSearch(params)
-            results = search.get_dict()
-
-            news_results = []
-            if "news_results" in results:
-                for result in results["news_results"][:max_results]:
-                    news_results.append({
-                        "title": result.get("title", ""),
-                        "link": result.get("link", ""),
-                        "snippet": result.get("snippet", ""),
-                        "source": result.get("source", ""),
-                        "date": result.get("date", "")
-                    })
+            news_results = self._parse_results(results, max_results)
 
             # Clear variables to free memory
             del results
@@ -396,3 +579,50 @@ class NewsAggregatorTool:
         except Exception as e:
             print(f"Error in news aggregation: {e}")
             return []
+
+    async def aget_news(self, topic, max_results=3, session=None):
+        """asyncio version of get_news(), calling SerpAPI's JSON endpoint with an aiohttp session"""
+        try:
+            await self.async_limiter.wait(self.min_request_interval)
+            await aapply_shared_rate_limit("serpapi")
+            results = await acall_upstream(self.breaker, _fetch_json, session, SERPAPI_URL,
+                                           self._params(topic, max_results), is_failure=serpapi_failed)
+            return self._parse_results(results, max_results)
+        except Exception as e:
+            print(f"Error in news aggregation: {e}")
+            return []
+
+    def _fetch(self, params):
+        # Respect limits shared with other processes (bulk CLI workers)
+        apply_shared_rate_limit("serpapi")
+        return self.fetch_results(params)
+
+    def _params(self, topic, max_results):
+        """SerpAPI news search parameters"""
+        # Clean and sanitize the topic to handle special characters
+        sanitized_topic = topic.strip()
+
+        # Log the topic for debugging
+        print(f"Searching news for: '{sanitized_topic}'")
+
+        return {
+            "engine": "google",
+            "q": sanitized_topic,
+            "tbm": "nws",  # News search
+            "api_key": self.api_key,
+            "num": max_results
+        }
+
+    def _parse_results(self, results, max_results):
+        """News results of a SerpAPI response"""
+        news_results = []
+        if "news_results" in results:
+            for result in results["news_results"][:max_results]:
+                news_results.append({
+                    "title": result.get("title", ""),
+                    "link": result.get("link", ""),
+                    "snippet": result.get("snippet", ""),
+                    "source": result.get("source", ""),
+                    "date": result.get("date", "")
+                })
+        return news_results
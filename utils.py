@@ -1,9 +1,12 @@
 import time
 import gc
+import threading
+from collections import OrderedDict
 import json
 import re
-import psutil
 import os
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlencode, urlsplit
 
 # Rate limiting utilities
 def apply_rate_limit(last_call_time, min_interval):
@@ -25,6 +28,238 @@ def apply_rate_limit(last_call_time, min_interval):
 
     return time.time()
 
+class SharedRateLimiter:
+    """
+    Rate limiter whose schedule lives in shared memory so that several worker
+    processes (e.g. the bulk research CLI) respect one upstream limit together
+
+    Args:
+        min_interval (float): Minimum interval between calls in seconds
+    """
+    def __init__(self, min_interval):
+        import multiprocessing  # Only needed by multi-process runners
+        self.min_interval = min_interval
+        self.lock = multiprocessing.Lock()
+        self.next_slot = multiprocessing.RawValue('d', 0.0)
+
+    def wait(self):
+        """Block until this process may make its next upstream call"""
+        with self.lock:
+            current_time = time.time()
+            slot = max(current_time, self.next_slot.value)
+            self.next_slot.value = slot + self.min_interval
+
+        if slot > current_time:
+            time.sleep(slot - current_time)
+
+# Upstream name ("gemini", "serpapi") -> SharedRateLimiter for this process
+_shared_rate_limiters = {}
+
+def set_shared_rate_limiter(upstream, limiter):
+    """
+    Register a rate limiter shared with other processes for an upstream API
+
+    Args:
+        upstream (str): Upstream name, e.g. "gemini" or "serpapi"
+        limiter (SharedRateLimiter): Limiter to apply, or None to remove it
+    """
+    if limiter is None:
+        _shared_rate_limiters.pop(upstream, None)
+    else:
+        _shared_rate_limiters[upstream] = limiter
+
+def apply_shared_rate_limit(upstream):
+    """
+    Wait on the shared rate limiter for an upstream API, if one is registered
+
+    Args:
+        upstream (str): Upstream name, e.g. "gemini" or "serpapi"
+    """
+    limiter = _shared_rate_limiters.get(upstream)
+    if limiter is not None:
+        limiter.wait()
+
+async def aapply_shared_rate_limit(upstream):
+    """
+    asyncio version of apply_shared_rate_limit: waits in a thread so the event loop keeps running
+
+    Args:
+        upstream (str): Upstream name, e.g. "gemini" or "serpapi"
+    """
+    limiter = _shared_rate_limiters.get(upstream)
+    if limiter is not None:
+        import asyncio
+        await asyncio.to_thread(limiter.wait)
+
+class AsyncIntervalLimiter:
+    """
+    Minimum spacing between calls for asyncio code, without blocking the event loop
+
+    The asyncio.Lock is created on first use, inside the running loop.
+    """
+    def __init__(self):
+        self.last_call = 0
+        self.lock = None
+
+    async def wait(self, min_interval):
+        """
+        Wait until min_interval seconds have passed since the previous call
+
+        Args:
+            min_interval (float): Minimum seconds between calls
+        """
+        import asyncio
+        if self.lock is None:
+            self.lock = asyncio.Lock()
+        async with self.lock:
+            delay = self.last_call + min_interval - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.last_call = time.time()
+
+def normalize_query(query):
+    """Lowercased query with collapsed whitespace and no trailing punctuation, for counting and cache keys"""
+    return " ".join(query.lower().split()).rstrip("?!. ")
+
+# Known AMP and mobile variants, rewritten in order to the canonical page.
+# Each pattern is matched against "host/path" (lowercased host, no scheme).
+URL_REWRITE_RULES = [
+    # Google AMP cache: example-com.cdn.ampproject.org/c/s/example.com/page
+    (re.compile(r"^[^/]+\.cdn\.ampproject\.org/(?:[a-z]/)+(?:s/)?(.+)$"), r"\1"),
+    # Google AMP viewer: google.com/amp/s/example.com/page
+    (re.compile(r"^(?:www\.)?google\.[a-z.]+/amp/(?:s/)?(.+)$"), r"\1"),
+    # Mobile Wikimedia hosts: en.m.wikipedia.org
+    (re.compile(r"^([a-z-]+)\.m\.(wik[a-z]+\.org)(/.*)?$"), r"\1.\2\3"),
+    # Mobile and AMP subdomains: m.example.com, mobile.example.com, amp.example.com
+    (re.compile(r"^(?:m|mobile|amp)\.([^/]+\.[^/]+)(/.*)?$"), r"\1\2"),
+]
+
+# AMP paths: /amp/page, /page/amp, /page.amp, /page.amp.html. "amp" is also a
+# real path segment (github.com/ampproject/amp), so these only apply to URLs
+# marked as AMP (AMP_MARKERS, an "amp" or outputType=amp parameter) or on AMP_NEWS_HOSTS
+AMP_PATH_RULES = [
+    (re.compile(r"^([^/]+)/amp(/.*)$"), r"\1\2"),
+    (re.compile(r"^(.+)/amp$"), r"\1"),
+    (re.compile(r"^(.+/[^/]+)\.amp(\.html?)?$"), r"\1\2"),
+]
+
+# "host/path" of AMP-only locations: amp. hosts, the Google AMP cache and viewer
+AMP_MARKERS = re.compile(r"^(?:amp\.|[^/]+\.cdn\.ampproject\.org/|(?:www\.)?google\.[a-z.]+/amp/)")
+
+# News sites that serve AMP copies of articles under the paths above (subdomains included)
+AMP_NEWS_HOSTS = frozenset({
+    "bbc.co.uk", "bbc.com", "cbsnews.com", "cnbc.com", "cnn.com", "espn.com", "espncricinfo.com", "foxnews.com",
+    "hindustantimes.com", "independent.co.uk", "indianexpress.com", "indiatimes.com", "latimes.com",
+    "nbcnews.com", "ndtv.com", "news18.com", "nytimes.com", "reuters.com", "telegraph.co.uk", "theguardian.com",
+    "theverge.com", "usatoday.com", "washingtonpost.com",
+})
+
+def _is_amp_location(location, params):
+    """True if a URL's "host/path" and parameters mark it as an AMP copy, or its host serves AMP paths"""
+    if AMP_MARKERS.match(location):
+        return True
+    if any(key.lower() == "amp" or (key.lower() == "outputtype" and value.lower() == "amp") for key, value in params):
+        return True
+    host = location.partition("/")[0]
+    if host.startswith("www."):
+        host = host[4:]
+    return any(host == news_host or host.endswith("." + news_host) for news_host in AMP_NEWS_HOSTS)
+
+# Query parameters that only track the click, never change the page
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "yclid", "igshid", "mc_cid", "mc_eid",
+                   "_ga", "_gl", "ref_src", "ocid", "amp", "outputtype"}
+
+@lru_cache(maxsize=4096)
+def canonicalize_url(url):
+    """
+    Canonical form of a URL, so variants of one page share dedup and cache keys
+
+    Only a key: the page may not be served at this URL, so fetch and cite the
+    original.
+
+    https scheme, lowercased host without 'www.' or a default port, AMP and
+    mobile variants rewritten per URL_REWRITE_RULES (and AMP_PATH_RULES for
+    AMP-marked URLs and known news hosts), tracking parameters
+    (utm_* and TRACKING_PARAMS) and the fragment dropped, the remaining
+    parameters sorted and no trailing slash.
+
+    Args:
+        url (str): URL as found in a search result
+
+    Returns:
+        str: The canonical URL; anything that isn't an absolute http(s) URL is returned stripped
+    """
+    url = url.strip()
+    parts = urlsplit(url)
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        return url
+
+    host = parts.hostname
+    if parts.port not in (None, 80, 443):
+        host = f"{host}:{parts.port}"
+    location = host + parts.path.rstrip("/")
+    all_params = parse_qsl(parts.query, keep_blank_values=True)
+    is_amp = _is_amp_location(location, all_params)
+    for pattern, replacement in URL_REWRITE_RULES:
+        location = pattern.sub(replacement, location)
+    if is_amp or _is_amp_location(location, ()):
+        for pattern, replacement in AMP_PATH_RULES:
+            location = pattern.sub(replacement, location)
+    host, slash, path = location.partition("/")
+    host = host.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = slash + path.rstrip("/") if path.rstrip("/") else ""
+
+    params = sorted((key, value) for key, value in all_params
+                    if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS)
+    query = f"?{urlencode(params)}" if params else ""
+    return f"https://{host}{path}{query}"
+
+# Caching utilities
+class TTLCache:
+    """
+    Thread-safe, size-bounded LRU cache whose entries expire after a TTL
+
+    Args:
+        maxsize (int): Maximum number of entries; the least recently used is evicted
+        ttl (float): Seconds an entry stays valid
+    """
+    def __init__(self, maxsize=128, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # key -> (expires_at, value)
+
+    def get(self, key, default=None):
+        """Return a live entry (marking it recently used) or default"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] < time.time():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        """Store a value, optionally with its own TTL in seconds"""
+        with self.lock:
+            self.entries[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            return default if entry is None else entry[1]
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
 # Memory management utilities
 def check_memory_usage(max_memory_mb=900, threshold=0.85):
     """
@@ -38,6 +273,7 @@ def check_memory_usage(max_memory_mb=900, threshold=0.85):
     Returns:
         float: Current memory usage in MB
     """
+    import psutil  # Imported on first use to keep cold start fast
     process = psutil.Process()
     memory_info = process.memory_info()
     memory_usage_mb = memory_info.rss / (1024 * 1024)
@@ -75,11 +311,128 @@ def extract_json_from_text(text):
     except (json.JSONDecodeError, AttributeError):
         return None
 
+# Context packing utilities
+CHARS_PER_TOKEN = 4  # Rough average for English text with Gemini's tokenizer
+
+def estimate_tokens(text):
+    """
+    Estimate the number of tokens in a piece of text
+
+    Args:
+        text (str): Text to measure
+
+    Returns:
+        int: Approximate token count
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+def split_sentences(text):
+    """
+    Split text into sentences on terminal punctuation and line breaks
+
+    Args:
+        text (str): Text to split
+
+    Returns:
+        list: Non-empty, stripped sentences
+    """
+    return [s.strip() for s in re.split(r'(?<=[.!?])\s+|\n+', text) if s.strip()]
+
+def _sentence_tokens(sentence):
+    return frozenset(re.findall(r'\w+', sentence.lower()))
+
+def _is_redundant(tokens, seen_tokens, similarity_threshold):
+    """Check a sentence's word set against already packed sentences (Jaccard)"""
+    if not tokens:
+        return True
+    for other in seen_tokens:
+        overlap = len(tokens & other)
+        if overlap and overlap / len(tokens | other) >= similarity_threshold:
+            return True
+    return False
+
+def pack_context(sources, token_budget, similarity_threshold=0.8):
+    """
+    Pack source contents into a fixed token budget for the synthesis prompt
+
+    The budget is divided among sources in proportion to relevance_score x
+    source_quality. Content is trimmed at sentence boundaries, and sentences
+    that repeat (or nearly repeat) one already packed from a stronger source
+    are dropped. Budget a source cannot use is handed on to the others.
+
+    Args:
+        sources (list): Dicts with 'content', 'relevance_score' and optional 'source_quality'
+        token_budget (int): Total tokens available for all source contents
+        similarity_threshold (float): Word-overlap ratio at which a sentence counts as redundant
+
+    Returns:
+        list: Packed content string for each source, in the input order
+    """
+    char_budget = token_budget * CHARS_PER_TOKEN
+    weights = [max(float(source.get("relevance_score", 0) or 0), 0.1) *
+               max(float(source.get("source_quality", 5) or 5), 0.1)
+               for source in sources]
+    total_weight = sum(weights)
+    # Strongest sources first so they keep the sentences others repeat
+    order = sorted(range(len(sources)), key=lambda i: weights[i], reverse=True)
+
+    # Drop redundant sentences across sources
+    candidates = {}
+    seen_tokens = []
+    for i in order:
+        kept = []
+        for sentence in split_sentences(sources[i].get("content", "") or ""):
+            tokens = _sentence_tokens(sentence)
+            if _is_redundant(tokens, seen_tokens, similarity_threshold):
+                continue
+            seen_tokens.append(tokens)
+            kept.append(sentence)
+        candidates[i] = kept
+
+    packed = {i: [] for i in order}
+    used = {i: 0 for i in order}
+    next_sentence = {i: 0 for i in order}
+
+    def fill(i, limit):
+        # Take whole sentences in order while they fit
+        sentences = candidates[i]
+        while next_sentence[i] < len(sentences):
+            sentence = sentences[next_sentence[i]]
+            cost = len(sentence) + 1
+            if used[i] + cost > limit:
+                break
+            packed[i].append(sentence)
+            used[i] += cost
+            next_sentence[i] += 1
+
+    # First pass: proportional shares
+    for i in order:
+        fill(i, char_budget * weights[i] / total_weight if total_weight else 0)
+
+    # Second pass: hand unused budget to the strongest sources
+    for i in order:
+        remaining = char_budget - sum(used.values())
+        if remaining <= 0:
+            break
+        fill(i, used[i] + remaining)
+        # A source whose first sentence is longer than the whole remainder
+        # gets a word-boundary cut rather than nothing at all
+        if not packed[i] and candidates[i] and remaining > 40:
+            cut = candidates[i][0][:remaining - 4].rsplit(" ", 1)[0]
+            packed[i].append(cut + "...")
+            used[i] += len(cut) + 4
+
+    return [" ".join(packed.get(i, [])) for i in range(len(sources))]
+
 # Error handling utilities
 def safe_request(func, *args, max_retries=3, **kwargs):
     """
     Execute a function with retry logic for API requests
 
+    Retries wait a jittered exponential backoff, taken from the current
+    request's retry budget (see resilience.py); without a budget, or once
+    it is spent, there are no more retries.
+
     Args:
         func: Function to execute
         max_retries (int): Maximum number of retry attempts
@@ -88,17 +441,19 @@ def safe_request(func, *args, max_retries=3, **kwargs):
     Returns:
         The result of the function or None if all retries fail
     """
+    from resilience import backoff_delay, current_retry_budget
     retries = 0
     while retries < max_retries:
         try:
             return func(*args, **kwargs)
         except Exception as e:
             retries += 1
-            if retries >= max_retries:
-                print(f"Failed after {max_retries} attempts: {str(e)}")
+            delay = backoff_delay(retries)
+            budget = current_retry_budget()
+            if retries >= max_retries or budget is None or not budget.take(delay):
+                print(f"Failed after {retries} attempts: {str(e)}")
                 return None
-            # Exponential backoff
-            time.sleep(2 ** retries)
+            time.sleep(delay)
 
 # Environment configuration
 def get_env_variable(name, default=None):